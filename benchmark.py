@@ -0,0 +1,601 @@
+"""Offline benchmarks for the Technofino Thread Summarizer.
+
+Serves synthetic XenForo-style thread pages from a local HTTP server, and answers Gemini requests
+with a fake model, so scraping, caching and summarization can be measured reproducibly without
+touching technofino.in or the Gemini API.
+
+Usage:
+    python benchmark.py suite --pages 100 --json results.json
+    python benchmark.py suite --compare results.json
+    python benchmark.py memory --pages 200 800 1600
+    python benchmark.py engines --pages 200 --posts-per-page 20
+    python benchmark.py parsers --pages 50
+    python benchmark.py parse-workers --pages 400 --workers 0 2 4
+    python benchmark.py importtime --budget-ms 75
+    python benchmark.py cache-index --entries 50000
+"""
+import argparse
+import collections
+import contextlib
+import datetime
+import gc
+import http.server
+import io
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+
+import cache_index
+import main
+import metrics
+import parsers
+import thread_cache
+
+# --- Synthetic Thread Fixtures ---
+def generate_thread_page(page_num, total_pages, posts_per_page=20, post_size=400):
+    """Generates the HTML of one XenForo-style thread page with pagination and dated messages."""
+    articles = []
+    for post_index in range(posts_per_page):
+        post_id = (page_num - 1) * posts_per_page + post_index
+        day = 1 + post_id // 50 % 28
+        minute = post_id % 60
+        words = f"Post {post_id} about card rewards and bill payments. " * max(1, post_size // 50)
+        articles.append(
+            f'<article class="message message--post" data-content="post-{post_id}">'
+            f'<div class="message-attribution"><time class="u-dt" datetime="2025-06-{day:02d}T10:{minute:02d}:00+0530">Jun {day}, 2025</time></div>'
+            f'<div class="message-content"><div class="bbWrapper">{words}<br />Second line of post {post_id}.</div></div>'
+            f'</article>'
+        )
+    nav_pages = sorted({1, max(1, page_num - 1), page_num, min(total_pages, page_num + 1), total_pages})
+    nav = ''.join(f'<li class="pageNav-page"><a href="/threads/bench.1/page-{p}">{p}</a></li>' for p in nav_pages)
+    return (
+        f'<html><head><title>Bench thread - Page {page_num}</title></head><body>'
+        f'<nav><div class="pageNav"><ul class="pageNav-main">{nav}</ul></div></nav>'
+        f'<div class="block-body">{"".join(articles)}</div></body></html>'
+    )
+
+# Hand-written page exercising the extraction edge cases every parser backend must agree on:
+# entities, comments, scripts/styles, quotes, unclosed tags, missing/empty datetime attributes,
+# the .bbWrapper fallback, empty messages, messages nested in messages (each is extracted, the outer one
+# taking a nested date or wrapper it lacks) and non-numeric or href-less pagination links.
+EDGE_CASE_PAGE = """<!DOCTYPE html><html><head><meta charset="utf-8"><script>var a="<article class='message'>";</script></head><body>
+<ul class="pageNav-main"><li class="pageNav-page"><a href="/p1">1</a></li><li class="pageNav-page"><a href="/p2"> 2 </a></li><li class="pageNav-page"><a>99</a></li><li class="pageNav-page"><a href="/p3"><span>3</span></a></li><li><a href="/n">Next</a></li></ul>
+<ul class="pageNav-main"><li class="pageNav-page"><a href="/x">7</a></li></ul>
+<article class="message message--post"><time class="u-dt" datetime="2025-06-01T10:00:00+0530">x</time>
+<div class="message-content"><div class="bbWrapper">Hello &amp; welcome&nbsp;<br>line <b>two</b>three<!-- c -->four
+<blockquote class="bbCodeBlock bbCodeBlock--quote"><div class="bbCodeBlock-content">quoted text</div></blockquote><p>para<p>nested
+<script>ignored()</script><style>.x{}</style> caf\u00e9</div></div></article>
+<article class="message"><time class="u-dt"> Jun <span>2</span>, 2025 </time><div class="bbWrapper">fallback body</div></article>
+<article class="message"><div class="bbWrapper">  </div><div class="message-content"><div class="bbWrapper">  </div></div></article>
+<article class="message"><div class="message-content"><p>no wrapper</p></div></article>
+<article class="message"><time class="u-dt" datetime>t</time><div class="message-content"><div class="bbWrapper">empty datetime<img src=x></div><div class="bbWrapper">second</div></div></article>
+<article class="message"><div class="bbWrapper">outer fallback</div><div class="message-content"><div class="bbWrapper">primary wins</div></div></article>
+<article class="message"><div class="message-content"><div class="bbWrapper">outer post<article class="message"><time class="u-dt" datetime="2025-06-03T09:00:00+0530">y</time>
+<div class="message-content"><div class="bbWrapper">inner post</div></div></article>outer tail</div></div></article>
+<article class="message"><article class="message"><div class="bbWrapper">only the nested post has a body</div></article></article>
+</body></html>""".encode('utf-8')
+
+class BacklogHTTPServer(http.server.ThreadingHTTPServer):
+    """ThreadingHTTPServer with a listen backlog sized for many concurrent connections.
+
+    The default backlog of 5 makes the kernel drop connection attempts when a fetch engine opens
+    more at once, and the client's SYN retransmissions (a second or more) then dominate the timings.
+    """
+    request_queue_size = 128
+
+class SyntheticThreadServer:
+    """Local threaded HTTP server serving one synthetic thread under /threads/bench.1/.
+
+    page_errors maps page numbers to the HTTP statuses answered to their first requests (e.g.
+    {3: [503]} fails page 3 once, then serves it); pages in missing_pages always answer 404.
+    """
+    def __init__(self, total_pages, posts_per_page=20, post_size=400, latency=0.0, page_errors=None, missing_pages=()):
+        self.total_pages = total_pages
+        self.latency = latency
+        self.pages = {
+            page_num: generate_thread_page(page_num, total_pages, posts_per_page, post_size).encode('utf-8')
+            for page_num in range(1, total_pages + 1) if page_num not in missing_pages
+        }
+        self.page_errors = {page_num: list(statuses) for page_num, statuses in (page_errors or {}).items()}
+        self.request_count = 0
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1' # Keep-alive, like the real site
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                match = re.search(r'/page-(\d+)', self.path)
+                page_num = int(match.group(1)) if match else 1
+                with server.lock:
+                    server.request_count += 1
+                    pending_errors = server.page_errors.get(page_num)
+                    error_status = pending_errors.pop(0) if pending_errors else None
+                body = server.pages.get(page_num)
+                if server.latency:
+                    time.sleep(server.latency)
+                if body is None or error_status is not None:
+                    self.send_response(error_status or 404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.httpd = BacklogHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.thread_url = f"http://127.0.0.1:{self.httpd.server_port}/threads/bench.1/"
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+# --- Fake Gemini Client ---
+class FakeUsageMetadata:
+    def __init__(self, prompt_token_count, candidates_token_count):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+        self.total_token_count = prompt_token_count + candidates_token_count
+
+class FakeResponse:
+    """Quacks like a genai GenerateContentResponse (or one chunk of a streamed one)."""
+    def __init__(self, text, usage_metadata=None):
+        self.text = text
+        self.usage_metadata = usage_metadata
+
+class FakeGenerativeModel:
+    """Stand-in for genai.GenerativeModel answering every prompt after a fixed latency.
+
+    Streamed responses arrive in `stream_chunks` pieces spread over the same latency. Prompts are
+    recorded, so benchmarks can report request counts and prompt sizes.
+    """
+    def __init__(self, latency=0.0, response_size=2000, stream_chunks=10):
+        self.latency = latency
+        self.response_text = ("Summary sentence about the thread. " * (response_size // 35 + 1))[:response_size]
+        self.stream_chunks = stream_chunks
+        self.prompts = []
+        self.lock = threading.Lock()
+
+    def generate_content(self, prompt, stream=False):
+        with self.lock:
+            self.prompts.append(prompt)
+        usage = FakeUsageMetadata(main.estimate_tokens_locally(prompt), main.estimate_tokens_locally(self.response_text))
+        if not stream:
+            time.sleep(self.latency)
+            return FakeResponse(self.response_text, usage)
+        return self._stream(usage)
+
+    def _stream(self, usage):
+        chunk_size = -(-len(self.response_text) // self.stream_chunks)
+        for start in range(0, len(self.response_text), chunk_size):
+            time.sleep(self.latency / self.stream_chunks)
+            last = start + chunk_size >= len(self.response_text)
+            yield FakeResponse(self.response_text[start:start + chunk_size], usage if last else None)
+
+# --- Benchmarks ---
+REPO_DIR = Path(__file__).resolve().parent
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)")
+# Modules that must only be imported on the code paths that use them, never at startup
+LAZY_MODULES = ('google.generativeai', 'requests', 'bs4', 'aiohttp', 'lxml', 'selectolax', 'dotenv', 'asyncio')
+DEFAULT_IMPORT_BUDGET_MS = 75
+def time_scrape(thread_url, **fetcher_options):
+    """Scrapes a thread without caching, returning (seconds, messages). Scraper output is discarded."""
+    main.configure_page_fetcher(**fetcher_options)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        messages = main.get_all_messages_from_thread(thread_url, use_cache=False, cache_dir=Path(os.devnull), cache_expiry_days=0)
+    return time.perf_counter() - start, messages
+
+def bench_engines(args):
+    """Compares the thread-pool and asyncio fetch engines on the same synthetic thread, checking they scrape identical messages."""
+    print(f"Synthetic thread: {args.pages} pages x {args.posts_per_page} posts, {args.latency * 1000:.0f} ms server latency")
+    expected = None
+    mismatches = 0
+    with SyntheticThreadServer(args.pages, args.posts_per_page, args.post_size, args.latency) as server:
+        for engine in main.FETCH_ENGINES:
+            for connections in args.connections:
+                seconds, messages = time_scrape(server.thread_url, engine=engine, max_connections=connections, rate_limit=0)
+                if expected is None:
+                    expected = messages
+                status = "identical" if messages == expected else f"DIFFERS from {main.FETCH_ENGINES[0]}"
+                mismatches += messages != expected
+                print(f"  {engine:8s} connections={connections:<4d} {seconds:7.2f}s  {args.pages / seconds:8.1f} pages/s  ({len(messages)} messages, {status})")
+    if mismatches:
+        raise SystemExit(1)
+
+def bench_parse_workers(args):
+    """Measures scraping with parsing in the fetch threads versus in a pool of parse processes."""
+    main.configure_parser_backend(args.parser)
+    print(f"Synthetic thread: {args.pages} pages x {args.posts_per_page} posts, parser {main.get_parser_backend()}, {os.cpu_count()} CPU(s)")
+    baseline = None
+    with SyntheticThreadServer(args.pages, args.posts_per_page, args.post_size, args.latency) as server:
+        for workers in args.workers:
+            main.configure_parse_workers(workers)
+            seconds, messages = time_scrape(server.thread_url, max_connections=args.connections, rate_limit=0)
+            baseline = baseline or seconds
+            print(f"  parse_workers={workers:<3d} {seconds:7.2f}s  {args.pages / seconds:8.1f} pages/s  x{baseline / seconds:.2f}  ({len(messages)} messages)")
+    main.configure_parse_workers(0)
+
+def run_cold(command):
+    """Runs a command in a fresh interpreter without an API key or stdin, so any key prompt fails instead of blocking."""
+    env = {key: value for key, value in os.environ.items() if key != "GEMINI_API_KEY"}
+    return subprocess.run([sys.executable] + command, cwd=REPO_DIR, env=env, stdin=subprocess.DEVNULL, capture_output=True, text=True)
+
+def measure_import(module_name):
+    """Imports a module under -X importtime.
+
+    Returns its cumulative import time in microseconds and the (module, cumulative us, depth) entries
+    of everything it imported; importtime lists a module's imports right before the module itself.
+    """
+    result = run_cold(['-X', 'importtime', '-c', f'import {module_name}'])
+    if result.returncode:
+        raise SystemExit(f"Importing {module_name} failed:\n{result.stderr[-2000:]}")
+    entries = []
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            entries.append((match.group(4), int(match.group(2)), len(match.group(3)) // 2))
+    end = next(index for index, (name, _, depth) in enumerate(entries) if name == module_name and depth == 0)
+    start = end
+    while start > 0 and entries[start - 1][2] > 0:
+        start -= 1
+    return entries[end][1], entries[start:end]
+
+def bench_importtime(args):
+    """Checks the CLI's cold start: import time of main.py against a budget, and that heavy SDKs are not imported eagerly."""
+    run_cold(['-c', 'import main']) # Warm-up, so bytecode compilation is not measured
+    samples = []
+    for _ in range(args.runs):
+        microseconds, imported = measure_import('main')
+        samples.append(microseconds / 1000)
+    import_ms = statistics.median(samples)
+    eager = {name for name, _, _ in imported if any(name == module or name.startswith(module + '.') for module in LAZY_MODULES)}
+    direct_imports = sorted(((microseconds, name) for name, microseconds, depth in imported if depth == 1), reverse=True)
+    help_samples = []
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        result = run_cold(['main.py', '--help'])
+        help_samples.append((time.perf_counter() - start) * 1000)
+        if result.returncode:
+            raise SystemExit(f"main.py --help failed:\n{result.stderr[-2000:]}")
+
+    print(f"import main: {import_ms:7.1f} ms median of {args.runs} (budget {args.budget_ms:.0f} ms)")
+    print(f"main.py --help: {statistics.median(help_samples):7.1f} ms wall clock, including interpreter startup")
+    print("Heaviest imports of main:")
+    for microseconds, name in direct_imports[:args.top]:
+        print(f"  {microseconds / 1000:7.1f} ms  {name}")
+    failures = []
+    if import_ms > args.budget_ms:
+        failures.append(f"import time {import_ms:.1f} ms exceeds the {args.budget_ms:.0f} ms budget")
+    if eager:
+        failures.append(f"imported eagerly: {', '.join(sorted(eager))}")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        raise SystemExit(1)
+
+def measure(run, repeats, items=1, setup=None):
+    """Times `run` (after one warm-up call), then reruns it under tracemalloc for its peak memory.
+
+    setup, if given, is called before every run and its result passed to run, outside the timing.
+    Returns latency percentiles in ms, throughput in items per second (at the median) and peak MB.
+    Output printed by the code under test is discarded.
+    """
+    setup = setup or (lambda: None)
+    seconds = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        run(setup())
+        for _ in range(repeats):
+            state = setup()
+            start = time.perf_counter()
+            run(state)
+            seconds.append(time.perf_counter() - start)
+        state = setup()
+        tracemalloc.start()
+        try:
+            run(state)
+            _, peak_bytes = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    seconds.sort()
+    median = metrics.quantile_of(seconds, 0.5) # The same nearest-rank quantiles as the --metrics report
+    return {
+        "runs": repeats,
+        "p50_ms": round(median * 1000, 3),
+        "p99_ms": round(metrics.quantile_of(seconds, 0.99) * 1000, 3),
+        "min_ms": round(seconds[0] * 1000, 3),
+        "throughput_per_s": round(items / median, 2) if median else None,
+        "peak_memory_mb": round(peak_bytes / 1024 / 1024, 3),
+    }
+
+def git_revision():
+    """Returns the checked-out commit (with a '-dirty' suffix for local changes), or None outside git."""
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=REPO_DIR, capture_output=True, text=True).stdout.strip()
+        return revision + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_suite(args):
+    """Runs every end-to-end benchmark and returns the results as a JSON-serializable dict."""
+    message_count = args.pages * args.posts_per_page
+    results = {}
+    main.configure_parser_backend(args.parser)
+    main.configure_page_fetcher(max_connections=args.connections, rate_limit=0)
+    with SyntheticThreadServer(args.pages, args.posts_per_page, args.post_size, args.latency) as server, \
+            tempfile.TemporaryDirectory() as cache_root:
+        cache_dir = Path(cache_root)
+        # Scraping: get_all_messages_from_thread with no cache, throughput in pages per second
+        results["scrape"] = measure(
+            lambda _: main.get_all_messages_from_thread(server.thread_url, use_cache=False, cache_dir=cache_dir, cache_expiry_days=0),
+            args.repeats, items=args.pages)
+        with contextlib.redirect_stdout(io.StringIO()):
+            main.get_all_messages_from_thread(server.thread_url, use_cache=True, cache_dir=cache_dir, cache_expiry_days=7)
+        cache_filepath = main.get_cache_filepath(main.get_canonical_url(server.thread_url), cache_dir)
+        cache_metadata = thread_cache.read_metadata(cache_filepath)
+        cached_pages = list(thread_cache.iter_pages(cache_filepath))
+        messages = [msg_dict for _, _, page_messages in cached_pages for msg_dict in page_messages]
+
+        # Thread cache paths, throughput in messages per second
+        results["cache_save"] = measure(lambda _: thread_cache.write_entry(cache_filepath, cache_metadata, cached_pages), args.repeats, items=message_count)
+        results["cache_load"] = measure(lambda _: list(main.load_from_cache(cache_filepath, 7)), args.repeats, items=message_count)
+        results["cache_hit_scrape"] = measure(
+            lambda _: main.get_all_messages_from_thread(server.thread_url, use_cache=True, cache_dir=cache_dir, cache_expiry_days=7),
+            args.repeats, items=args.pages)
+
+    # Summarization and Q&A against the fake model; a fresh list per run so each run renders the thread anew
+    model = FakeGenerativeModel(args.llm_latency, args.response_size)
+    fresh_messages = lambda: list(messages)
+    results["summarize_single"] = measure(
+        lambda thread: main.generate_summary(thread, None, model, "fake-model", mode='single'),
+        args.repeats, items=message_count, setup=fresh_messages)
+    results["summarize_chunked"] = measure(
+        lambda thread: main.generate_summary(thread, None, model, "fake-model", mode='chunked', chunk_tokens=args.chunk_tokens, max_concurrency=args.llm_concurrency),
+        args.repeats, items=message_count, setup=fresh_messages)
+    results["summarize_streamed"] = measure(
+        lambda thread: main.generate_summary(thread, None, model, "fake-model", mode='single', on_chunk=lambda text: None),
+        args.repeats, items=message_count, setup=fresh_messages)
+    index = main.load_or_build_retrieval_index(messages)
+    question = "What did people say about card rewards on bill payments?"
+    results["qna_full_context"] = measure(
+        lambda _: main.answer_question_with_gemini(messages, question, model=model), args.repeats)
+    results["qna_retrieval"] = measure(
+        lambda _: main.answer_question_with_gemini(messages, question, retrieval_index=index, model=model), args.repeats)
+    results["retrieval_index_build"] = measure(
+        lambda thread: main.load_or_build_retrieval_index(thread), args.repeats, items=message_count, setup=fresh_messages)
+    results["compact"] = measure(
+        lambda thread: main.compact_messages(thread), args.repeats, items=message_count, setup=fresh_messages)
+
+    return {
+        "revision": git_revision(),
+        "created_at": datetime.datetime.now().isoformat(timespec='seconds'),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "parameters": {
+            "pages": args.pages, "posts_per_page": args.posts_per_page, "post_size": args.post_size, "latency": args.latency,
+            "connections": args.connections, "parser": main.get_parser_backend(), "llm_latency": args.llm_latency,
+            "response_size": args.response_size, "chunk_tokens": args.chunk_tokens, "llm_concurrency": args.llm_concurrency,
+            "repeats": args.repeats,
+        },
+        "results": results,
+    }
+
+def bench_suite(args):
+    """Runs the end-to-end suite, prints a table, and optionally saves or compares JSON results."""
+    report = run_suite(args)
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get("parameters") != report["parameters"]:
+            print(f"Warning: {args.compare} was run with different parameters; deltas are not comparable.")
+    print(f"revision {report['revision']}, {args.pages} pages x {args.posts_per_page} posts, parser {report['parameters']['parser']}, "
+          f"{args.llm_latency * 1000:.0f} ms fake Gemini latency, {args.repeats} runs each")
+    print(f"  {'benchmark':24s} {'p50 ms':>10s} {'p99 ms':>10s} {'items/s':>11s} {'peak MB':>9s}" + ("  p50 vs baseline" if baseline else ""))
+    for name, result in report["results"].items():
+        line = f"  {name:24s} {result['p50_ms']:10.2f} {result['p99_ms']:10.2f} {result['throughput_per_s'] or 0:11.1f} {result['peak_memory_mb']:9.2f}"
+        previous = (baseline or {}).get("results", {}).get(name)
+        if previous and previous.get("p50_ms"):
+            line += f"  {(result['p50_ms'] - previous['p50_ms']) / previous['p50_ms'] * 100:+7.1f}% ({baseline.get('revision')})"
+        print(line)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results saved to {args.json}")
+
+def traced_peak_mb(run):
+    """Runs `run` under tracemalloc, with its output discarded, and returns its peak Python memory in MB."""
+    gc.collect() # Don't count garbage left over from earlier measurements
+    with contextlib.redirect_stdout(io.StringIO()):
+        tracemalloc.start()
+        try:
+            run()
+            _, peak_bytes = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return peak_bytes / 1024 / 1024
+
+def bench_memory(args):
+    """Shows that streaming a thread page by page uses memory bounded by the fetch window, not the thread's size.
+
+    For each thread size, measures the peak memory of consuming iter_thread_pages (scraping into the
+    cache, then reading the cache) without keeping the pages, next to collecting all messages and
+    building a summary prompt, which necessarily grow with the thread. Fails unless the streamed peak
+    plateaus: the largest thread's may exceed the highest of the smaller threads' by at most --max-growth.
+    """
+    main.configure_parser_backend(args.parser)
+    main.configure_page_fetcher(max_connections=args.connections, rate_limit=0)
+    model = FakeGenerativeModel(response_size=200)
+    drain = lambda pages: collections.deque(pages, maxlen=0)
+    print(f"Synthetic threads of {', '.join(map(str, args.pages))} pages x {args.posts_per_page} posts, {args.connections} connections, "
+          f"window of {main.FETCH_WINDOW_PER_CONNECTION * args.connections} pages; peak Python memory (tracemalloc) in MB")
+    print(f"  {'pages':>6s} {'thread MB':>10s} {'stream scrape':>14s} {'stream cache':>13s} {'all messages':>13s} {'summary prompt':>15s}")
+    with SyntheticThreadServer(2, args.posts_per_page, args.post_size) as server:
+        time_scrape(server.thread_url, max_connections=args.connections, rate_limit=0) # Import the parser outside the measurements
+    stream_peaks = []
+    for pages in args.pages:
+        with SyntheticThreadServer(pages, args.posts_per_page, args.post_size) as server, tempfile.TemporaryDirectory() as cache_root:
+            cache_dir = Path(cache_root)
+            scrape_peak = traced_peak_mb(lambda: drain(main.iter_thread_pages(server.thread_url, True, cache_dir, 7)))
+            cache_peak = traced_peak_mb(lambda: drain(main.iter_thread_pages(server.thread_url, True, cache_dir, 7)))
+            with contextlib.redirect_stdout(io.StringIO()):
+                messages = main.get_all_messages_from_thread(server.thread_url, True, cache_dir, 7)
+            collect_peak = traced_peak_mb(lambda: main.get_all_messages_from_thread(server.thread_url, True, cache_dir, 7))
+            summary_peak = traced_peak_mb(lambda: main.generate_summary(list(messages), None, model, "fake-model", mode='single'))
+        thread_mb = sum(len(msg_dict['content']) + len(msg_dict['date']) for msg_dict in messages) / 1024 / 1024
+        stream_peaks.append(max(scrape_peak, cache_peak))
+        print(f"  {pages:6d} {thread_mb:10.2f} {scrape_peak:14.2f} {cache_peak:13.2f} {collect_peak:13.2f} {summary_peak:15.2f}")
+    growth = stream_peaks[-1] / max(stream_peaks[:-1] or stream_peaks)
+    print(f"Streamed peak at {args.pages[-1]} pages is x{growth:.2f} the highest at fewer pages (limit x{args.max_growth:.2f})")
+    if growth > args.max_growth:
+        raise SystemExit(1)
+
+def bench_parsers(args):
+    """Checks that every installed parser backend matches the bs4 output exactly, then times each one."""
+    backends = [name for name in parsers.PARSER_BACKENDS if name != 'auto' and parsers.is_parser_backend_available(name)]
+    fixtures = [EDGE_CASE_PAGE] + [
+        generate_thread_page(page_num, args.pages, args.posts_per_page, args.post_size).encode('utf-8')
+        for page_num in range(1, args.pages + 1)
+    ]
+    expected = [parsers.parse_page(fixture, 'bs4') for fixture in fixtures]
+    print(f"{len(fixtures)} fixture pages, {sum(len(fixture) for fixture in fixtures) / 1e6:.1f} MB; backends: {', '.join(backends)}")
+    mismatches = 0
+    for backend in backends:
+        start = time.perf_counter()
+        results = [parsers.parse_page(fixture, backend) for fixture in fixtures]
+        seconds = time.perf_counter() - start
+        differing = sum(result != golden for result, golden in zip(results, expected))
+        mismatches += differing
+        status = "identical" if not differing else f"{differing} page(s) DIFFER from bs4"
+        print(f"  {backend:10s} {seconds:7.3f}s  {len(fixtures) / seconds:8.1f} pages/s  {status}")
+    if mismatches:
+        raise SystemExit(1)
+
+def time_per_call(function, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        function()
+    return (time.perf_counter() - start) / repeats * 1000
+
+def bench_cache_index(args):
+    """Times the thread cache index's per-write, per-hit, listing and eviction operations at a large entry count,
+    and the one-time scan that indexes an existing cache directory."""
+    entry_size = 200 * 1024
+    with tempfile.TemporaryDirectory() as cache_root:
+        cache_dir = Path(cache_root)
+        index = cache_index.CacheIndex(cache_dir / cache_index.CACHE_INDEX_FILENAME, args.entries * entry_size)
+        now = time.time()
+        start = time.perf_counter()
+        index.add_scanned([(f"{entry:032x}.tfcache", f"https://example.test/threads/t.{entry}/", entry_size, 10, 200, now - entry, 0) for entry in range(args.entries)])
+        print(f"Index of {args.entries} entries built in {time.perf_counter() - start:.2f}s; time per operation:")
+        operations = [
+            ("record + evict (per cache write)", lambda: (index.record("new.tfcache", "https://example.test/threads/new.1/", 1024, 1, 20, time.time()), index.evict("new.tfcache"))),
+            ("touch (per cache hit)", lambda: index.touch(f"{args.entries // 2:032x}.tfcache")),
+            ("stats", lambda: index.stats(expired_before=time.time() - 7 * 86400)),
+            ("recent entries", lambda: index.recent_entries(main.CACHE_STATS_RECENT_ENTRIES)),
+            ("lookup by URL", lambda: index.filenames_for_url(f"https://example.test/threads/t.{args.entries // 3}/")),
+        ]
+        for name, operation in operations:
+            print(f"  {name:34s} {time_per_call(operation, args.repeats):8.3f} ms")
+        index.max_bytes -= args.entries // 100 * entry_size
+        start = time.perf_counter()
+        evicted = index.evict()
+        print(f"  {'evict 1% least recently used':34s} {(time.perf_counter() - start) * 1000:8.3f} ms  ({len(evicted)} entries)")
+        index.close()
+
+        for entry in range(args.scan_files):
+            thread_cache.write_entry(cache_dir / f"{entry:032x}.tfcache", main.build_cache_metadata(f"https://example.test/threads/t.{entry}/", 1, 1),
+                                     [(1, {"page": 1}, [{"date": "2025-01-01", "content": "Synthetic post."}])])
+        start = time.perf_counter()
+        rows = main.scan_cache_entries(cache_dir)
+        seconds = time.perf_counter() - start
+        print(f"Scan of a cache directory with {args.scan_files} entries: {seconds:.2f}s ({len(rows) / seconds:.0f} entries/s, once per cache directory)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the Technofino Thread Summarizer.")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    engines_parser = subparsers.add_parser("engines", help="Compare page fetching engines against a local synthetic thread.")
+    engines_parser.add_argument("--pages", type=int, default=200, help="Number of pages in the synthetic thread. Default: 200.")
+    engines_parser.add_argument("--posts-per-page", type=int, default=20, help="Posts per page. Default: 20.")
+    engines_parser.add_argument("--post-size", type=int, default=400, help="Approximate characters per post. Default: 400.")
+    engines_parser.add_argument("--latency", type=float, default=0.02, help="Simulated server latency per request, in seconds. Default: 0.02.")
+    engines_parser.add_argument("--connections", type=int, nargs='+', default=[10, 50], help="Connection limits to try for each engine. Default: 10 50.")
+    engines_parser.set_defaults(func=bench_engines)
+
+    parsers_parser = subparsers.add_parser("parsers", help="Verify that all parser backends produce identical messages, and time them.")
+    parsers_parser.add_argument("--pages", type=int, default=50, help="Number of synthetic pages to parse. Default: 50.")
+    parsers_parser.add_argument("--posts-per-page", type=int, default=20, help="Posts per page. Default: 20.")
+    parsers_parser.add_argument("--post-size", type=int, default=400, help="Approximate characters per post. Default: 400.")
+    parsers_parser.set_defaults(func=bench_parsers)
+
+    parse_workers_parser = subparsers.add_parser("parse-workers", help="Compare in-thread parsing with a process pool of parse workers.")
+    parse_workers_parser.add_argument("--pages", type=int, default=400, help="Number of pages in the synthetic thread. Default: 400.")
+    parse_workers_parser.add_argument("--posts-per-page", type=int, default=20, help="Posts per page. Default: 20.")
+    parse_workers_parser.add_argument("--post-size", type=int, default=400, help="Approximate characters per post. Default: 400.")
+    parse_workers_parser.add_argument("--latency", type=float, default=0.0, help="Simulated server latency per request, in seconds. Default: 0.")
+    parse_workers_parser.add_argument("--connections", type=int, default=10, help="Fetch connections. Default: 10.")
+    parse_workers_parser.add_argument("--parser", choices=parsers.PARSER_BACKENDS, default='bs4', help="Parser backend to parse with. Default: bs4.")
+    parse_workers_parser.add_argument("--workers", type=int, nargs='+', default=[0, 2, 4, os.cpu_count()], help="Parse worker counts to try (0 parses in the fetch threads). Default: 0 2 4 <cpu count>.")
+    parse_workers_parser.set_defaults(func=bench_parse_workers)
+
+    suite_parser = subparsers.add_parser("suite", help="End-to-end benchmarks of scraping, the thread cache, summarization and Q&A, with JSON output for comparing commits.")
+    suite_parser.add_argument("--pages", type=int, default=100, help="Number of pages in the synthetic thread. Default: 100.")
+    suite_parser.add_argument("--posts-per-page", type=int, default=20, help="Posts per page. Default: 20.")
+    suite_parser.add_argument("--post-size", type=int, default=400, help="Approximate characters per post. Default: 400.")
+    suite_parser.add_argument("--latency", type=float, default=0.0, help="Simulated server latency per request, in seconds. Default: 0.")
+    suite_parser.add_argument("--connections", type=int, default=10, help="Fetch connections. Default: 10.")
+    suite_parser.add_argument("--parser", choices=parsers.PARSER_BACKENDS, default='bs4', help="Parser backend. Default: bs4, so results do not depend on optional packages.")
+    suite_parser.add_argument("--llm-latency", type=float, default=0.05, help="Fake Gemini latency per request, in seconds. Default: 0.05.")
+    suite_parser.add_argument("--response-size", type=int, default=2000, help="Characters per fake Gemini response. Default: 2000.")
+    suite_parser.add_argument("--chunk-tokens", type=int, default=20000, help="Chunk budget for the chunked summarization benchmark. Default: 20000.")
+    suite_parser.add_argument("--llm-concurrency", type=int, default=main.DEFAULT_LLM_CONCURRENCY, help=f"Concurrent fake Gemini requests. Default: {main.DEFAULT_LLM_CONCURRENCY}.")
+    suite_parser.add_argument("--repeats", type=int, default=5, help="Timed runs per benchmark (after one warm-up run). Default: 5.")
+    suite_parser.add_argument("--json", metavar="FILE", help="Save the results, with the git revision and parameters, to FILE.")
+    suite_parser.add_argument("--compare", metavar="FILE", help="Show p50 changes relative to results saved earlier with --json.")
+    suite_parser.set_defaults(func=bench_suite)
+
+    memory_parser = subparsers.add_parser("memory", help="Check that streaming a thread's pages uses memory bounded by the fetch window, not the thread's size.")
+    memory_parser.add_argument("--pages", type=int, nargs='+', default=[200, 800, 1600], help="Thread sizes to measure, smallest first. Default: 200 800 1600.")
+    memory_parser.add_argument("--posts-per-page", type=int, default=20, help="Posts per page. Default: 20.")
+    memory_parser.add_argument("--post-size", type=int, default=400, help="Approximate characters per post. Default: 400.")
+    memory_parser.add_argument("--connections", type=int, default=10, help="Fetch connections. Default: 10.")
+    memory_parser.add_argument("--parser", choices=parsers.PARSER_BACKENDS, default='bs4', help="Parser backend. Default: bs4.")
+    memory_parser.add_argument("--max-growth", type=float, default=1.5, help="Maximum ratio of the largest thread's streamed peak to the highest of the smaller threads'. Default: 1.5.")
+    memory_parser.set_defaults(func=bench_memory)
+
+    importtime_parser = subparsers.add_parser("importtime", help="Measure the CLI's cold start with python -X importtime and enforce a budget.")
+    importtime_parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters to measure; the median is reported. Default: 5.")
+    importtime_parser.add_argument("--budget-ms", type=float, default=DEFAULT_IMPORT_BUDGET_MS, help=f"Maximum median import time of main.py, in ms. Default: {DEFAULT_IMPORT_BUDGET_MS}.")
+    importtime_parser.add_argument("--top", type=int, default=8, help="Number of heaviest imports to list. Default: 8.")
+    importtime_parser.set_defaults(func=bench_importtime)
+
+    cache_index_parser = subparsers.add_parser("cache-index", help="Time the thread cache index's operations with many cached threads.")
+    cache_index_parser.add_argument("--entries", type=int, default=50000, help="Entries in the synthetic index. Default: 50000.")
+    cache_index_parser.add_argument("--scan-files", type=int, default=1000, help="Entry files to write for timing the initial directory scan. Default: 1000.")
+    cache_index_parser.add_argument("--repeats", type=int, default=50, help="Calls timed per operation. Default: 50.")
+    cache_index_parser.set_defaults(func=bench_cache_index)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -0,0 +1,144 @@
+"""Index of the thread cache directory.
+
+A SQLite database in the cache directory maps each cached thread's entry file to its canonical URL,
+size (and that of the thread's retrieval index), page and message counts, and when it was cached and
+last used. The cache can then be listed,
+kept under a size limit by evicting the least recently used entries, purged of entries unused for
+longer than a retention period, and invalidated per URL, all without opening the entry files.
+Queries go through indexes on the last access time and URL, so they stay fast with tens of
+thousands of entries. Entries written before the index existed are added by a one-time scan.
+"""
+import sqlite3
+import threading
+import time
+
+CACHE_INDEX_FILENAME = "threads.sqlite3"
+INDEX_SCHEMA_VERSION = 2 # Stored as the database's user_version once existing entries have been scanned
+EVICTION_BATCH_SIZE = 256
+
+class CacheIndex:
+    """Thread-safe index of thread cache entries, keyed by entry file name."""
+    def __init__(self, db_filepath, max_bytes, retention_seconds=None):
+        self.db_filepath = db_filepath
+        self.max_bytes = max_bytes
+        self.retention_seconds = retention_seconds
+        self.lock = threading.Lock()
+        db_filepath.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(str(db_filepath), check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " filename TEXT PRIMARY KEY, url TEXT, size INTEGER NOT NULL, page_count INTEGER, message_count INTEGER,"
+            " cached_at REAL NOT NULL, last_access REAL NOT NULL, index_size INTEGER NOT NULL DEFAULT 0)"
+        )
+        if "index_size" not in [column[1] for column in self.connection.execute("PRAGMA table_info(entries)")]:
+            # Created by schema version 1, before retrieval indexes counted; the rescan fills the column in
+            self.connection.execute("ALTER TABLE entries ADD COLUMN index_size INTEGER NOT NULL DEFAULT 0")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS entries_url ON entries (url)")
+        self.connection.commit()
+
+    def needs_scan(self):
+        """Whether entries already in the directory have yet to be added (the index is new)."""
+        with self.lock:
+            return self.connection.execute("PRAGMA user_version").fetchone()[0] < INDEX_SCHEMA_VERSION
+
+    def add_scanned(self, rows):
+        """Adds (filename, url, size, page_count, message_count, cached_at, index_size) rows found by a directory scan.
+
+        Existing rows are kept, apart from their index size, which the scan measures.
+        """
+        with self.lock:
+            self.connection.executemany(
+                "INSERT INTO entries (filename, url, size, page_count, message_count, cached_at, index_size, last_access) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (filename) DO UPDATE SET index_size = excluded.index_size",
+                [(*row, row[5]) for row in rows]
+            )
+            self.connection.execute(f"PRAGMA user_version = {INDEX_SCHEMA_VERSION}")
+            self.connection.commit()
+
+    def record(self, filename, url, size, page_count, message_count, cached_at, index_size=0):
+        """Records a written entry as just used."""
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO entries (filename, url, size, page_count, message_count, cached_at, index_size, last_access) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (filename, url, size, page_count, message_count, cached_at, index_size, time.time())
+            )
+            self.connection.commit()
+
+    def set_index_size(self, filename, index_size):
+        """Updates the size of an entry's retrieval index, saved after the entry itself."""
+        with self.lock:
+            self.connection.execute("UPDATE entries SET index_size = ? WHERE filename = ?", (index_size, filename))
+            self.connection.commit()
+
+    def touch(self, filename):
+        """Marks an entry as just used (read from the cache)."""
+        with self.lock:
+            self.connection.execute("UPDATE entries SET last_access = ? WHERE filename = ?", (time.time(), filename))
+            self.connection.commit()
+
+    def remove(self, filename):
+        with self.lock:
+            self.connection.execute("DELETE FROM entries WHERE filename = ?", (filename,))
+            self.connection.commit()
+
+    def filenames_for_url(self, url):
+        with self.lock:
+            return [row[0] for row in self.connection.execute("SELECT filename FROM entries WHERE url = ?", (url,))]
+
+    def evict(self, keep_filename=None):
+        """Removes entries unused for longer than the retention period, then least recently used ones beyond max_bytes.
+
+        Sizes include the entry's retrieval index. keep_filename (the entry just written) is never
+        evicted. Returns the removed (filename, size) rows; deleting their files is up to the caller.
+        """
+        evicted = []
+        with self.lock:
+            if self.retention_seconds is not None:
+                evicted.extend(self.connection.execute(
+                    "SELECT filename, size + index_size FROM entries WHERE last_access < ? AND filename IS NOT ?",
+                    (time.time() - self.retention_seconds, keep_filename)
+                ).fetchall())
+                self.connection.executemany("DELETE FROM entries WHERE filename = ?", [(filename,) for filename, _ in evicted])
+            excess = self.connection.execute("SELECT COALESCE(SUM(size + index_size), 0) FROM entries").fetchone()[0] - self.max_bytes
+            if excess > 0:
+                # Walks the last-access index oldest first, reading only as many rows as need evicting
+                least_recent = []
+                cursor = self.connection.execute("SELECT filename, size + index_size FROM entries ORDER BY last_access")
+                while excess > 0:
+                    rows = cursor.fetchmany(EVICTION_BATCH_SIZE)
+                    if not rows:
+                        break
+                    for filename, size in rows:
+                        if excess <= 0:
+                            break
+                        if filename != keep_filename:
+                            least_recent.append((filename, size))
+                            excess -= size
+                cursor.close()
+                self.connection.executemany("DELETE FROM entries WHERE filename = ?", [(filename,) for filename, _ in least_recent])
+                evicted.extend(least_recent)
+            self.connection.commit()
+        return evicted
+
+    def stats(self, expired_before=None):
+        """Returns the entry count, total and maximum size, the oldest last access, and the number of entries cached before expired_before."""
+        with self.lock:
+            entries, total_size, oldest_access = self.connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size + index_size), 0), MIN(last_access) FROM entries").fetchone()
+            expired = 0
+            if expired_before is not None:
+                expired = self.connection.execute("SELECT COUNT(*) FROM entries WHERE cached_at < ?", (expired_before,)).fetchone()[0]
+        return {"entries": entries, "size_bytes": total_size, "max_bytes": self.max_bytes, "oldest_access": oldest_access, "expired": expired}
+
+    def recent_entries(self, limit):
+        """Returns the most recently used entries as dicts, most recent first. Sizes include the retrieval index."""
+        with self.lock:
+            cursor = self.connection.execute(
+                "SELECT filename, url, size + index_size AS size, page_count, message_count, cached_at, last_access FROM entries ORDER BY last_access DESC LIMIT ?", (limit,))
+            columns = [description[0] for description in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,175 @@
+"""Message compaction: shrinks a thread's messages before they are sent to Gemini.
+
+XenForo renders quoted replies inline, so a reply's extracted text repeats the post it quotes
+("Name said:", the quoted lines, "Click to expand..."), and long threads are full of "+1" posts and
+near-identical reports. Compaction, applied between scraping and prompting:
+
+*   replaces each attributed quote block with a short reference to the quoted member and the quote's first words,
+*   drops trivial posts ("+1", "Thanks for sharing", ...), including replies that were only a quote,
+*   collapses near-duplicate posts into their first occurrence, noting how many similar posts followed
+    and the date of the last one. Candidates are found with MinHash signatures over word shingles
+    (one-permutation hashing, so each shingle is hashed once) and LSH banding, so the cost stays
+    linear in the number of messages, and each candidate is confirmed with the exact Jaccard
+    similarity of the two posts' shingle sets before anything is collapsed.
+
+Message order and dates are kept, so recency-aware prompts keep working. Compaction is deterministic,
+so the same thread always yields the same prompt (and hits the same cached Gemini responses).
+"""
+import re
+import zlib
+
+from parsers import TEXT_SEPARATOR
+
+_SEPARATOR = re.escape(TEXT_SEPARATOR)
+# "Name said:" <quoted lines> "Click to expand...", as get_text() renders a XenForo quote block. The
+# quoted lines may not start another quote, so a quote within a quote matches first (innermost first).
+QUOTE_PATTERN = re.compile(
+    rf"(?:^|{_SEPARATOR})(?P<name>(?:(?!{_SEPARATOR}).){{1,80}}?) said:{_SEPARATOR}(?P<quoted>(?:(?! said:{_SEPARATOR}).)*?){_SEPARATOR}Click to expand\.\.\.(?={_SEPARATOR}|$)",
+    re.DOTALL,
+)
+REFERENCE_PATTERN = re.compile(r"\[Replying to [^\]]*\]")
+QUOTE_PREVIEW_WORDS = 8
+WORD_PATTERN = re.compile(r"\+1|[^\W_]+")
+TRIVIAL_WORDS = frozenset("""
++1 thanks thank thx ty tq you u so much very a lot for the info information sharing shared update same here me too
+following follow bump up noted agreed agree nice great good super cool awesome congrats congratulations wow lol ok okay
+bro buddy sir mate dude indeed true exactly
+""".split())
+TRIVIAL_MAX_WORDS = 6
+SHINGLE_WORDS = 3
+MIN_DUPLICATE_WORDS = 5 # Shorter posts are only collapsed when they are identical
+MINHASH_BINS = 32 # Signature length; must be a power of two
+LSH_BANDS = 8 # Bands of MINHASH_BINS // LSH_BANDS values; similar signatures share at least one band
+# Messages indexed per band bucket. Threads of templated posts fill the same buckets; the cap keeps
+# the earliest posts (those later duplicates collapse into) and bounds the candidates per message.
+LSH_BUCKET_LIMIT = 8
+DEFAULT_DUPLICATE_THRESHOLD = 0.8
+_BIN_BITS = MINHASH_BINS.bit_length() - 1
+_EMPTY_BIN_OFFSET = 1 << (32 - _BIN_BITS) # Above any in-bin hash value, so borrowed values never equal real ones
+
+class CompactionStats:
+    """Counts of what compaction changed in a thread."""
+    def __init__(self):
+        self.messages_in = 0
+        self.messages_out = 0
+        self.quotes_stripped = 0
+        self.trivial_dropped = 0
+        self.duplicates_collapsed = 0
+
+    def to_dict(self):
+        return dict(vars(self))
+
+def strip_quotes(content):
+    """Replaces XenForo quote blocks with short references. Returns (content, number of quotes replaced).
+
+    Nested quotes are replaced innermost first; an outer quote's preview leaves out the quotes within it.
+    """
+    def reference(match):
+        preview_words = REFERENCE_PATTERN.sub(' ', match.group('quoted').replace(TEXT_SEPARATOR, ' ')).split()
+        preview = ' '.join(preview_words[:QUOTE_PREVIEW_WORDS]) + ('...' if len(preview_words) > QUOTE_PREVIEW_WORDS else '')
+        prefix = TEXT_SEPARATOR if match.start() > 0 else ''
+        return f'{prefix}[Replying to {match.group("name").strip()}: "{preview}"]'
+    total_count = 0
+    while True:
+        content, count = QUOTE_PATTERN.subn(reference, content)
+        total_count += count
+        if not count:
+            return content, total_count
+
+def content_words(content):
+    """Lowercased words of a message, ignoring quote references and punctuation."""
+    return WORD_PATTERN.findall(REFERENCE_PATTERN.sub(' ', content.replace(TEXT_SEPARATOR, ' ')).lower())
+
+def is_trivial(words):
+    """Whether a post has nothing to summarize: no words at all (e.g. only a quote or emoji), or only a few stock phrases."""
+    return len(words) <= TRIVIAL_MAX_WORDS and all(word in TRIVIAL_WORDS for word in words)
+
+def word_shingles(words):
+    """The set of a message's word shingles (word trigrams); shorter messages are a single shingle."""
+    return frozenset(' '.join(words[i:i + SHINGLE_WORDS]) for i in range(max(1, len(words) - SHINGLE_WORDS + 1)))
+
+def minhash_signature(shingles):
+    """One-permutation MinHash signature of a message's set of word shingles.
+
+    Each shingle is hashed once; its hash picks one of MINHASH_BINS bins, and each bin keeps its
+    minimum. Empty bins (messages with few shingles) borrow the value of the next non-empty bin,
+    offset by the distance, which keeps the signatures of similar messages comparable.
+    """
+    signature = [None] * MINHASH_BINS
+    for shingle in shingles:
+        shingle_hash = zlib.crc32(shingle.encode('utf-8'))
+        bin_index, value = shingle_hash & (MINHASH_BINS - 1), shingle_hash >> _BIN_BITS
+        if signature[bin_index] is None or value < signature[bin_index]:
+            signature[bin_index] = value
+    if None in signature:
+        filled = list(signature)
+        for bin_index in range(MINHASH_BINS):
+            distance = 0
+            while filled[(bin_index + distance) % MINHASH_BINS] is None:
+                distance += 1
+            signature[bin_index] = filled[(bin_index + distance) % MINHASH_BINS] + distance * _EMPTY_BIN_OFFSET
+    return tuple(signature)
+
+def jaccard_similarity(shingles, other_shingles):
+    """Exact Jaccard similarity of two messages' shingle sets.
+
+    A 32-bin signature only estimates it, too coarsely to tell apart templated posts that differ
+    in a number or a name, so LSH candidates are confirmed with this before being collapsed.
+    """
+    return len(shingles & other_shingles) / len(shingles | other_shingles)
+
+def compact_messages(messages, duplicate_threshold=DEFAULT_DUPLICATE_THRESHOLD):
+    """Compacts a thread's message dicts for prompting. Returns (compacted messages, CompactionStats).
+
+    The input is not modified; unchanged messages are passed through as the same dicts.
+    """
+    stats = CompactionStats()
+    stats.messages_in = len(messages)
+    rows = MINHASH_BINS // LSH_BANDS
+    kept = [] # [message dict, number of collapsed duplicates, date of the last one]
+    exact_index = {} # normalized short text -> index in kept
+    band_buckets = {} # (band, band hash values) -> indexes in kept
+    shingle_sets = {} # index in kept -> shingle set
+
+    for msg_dict in messages:
+        content, quote_count = strip_quotes(msg_dict.get('content', ''))
+        stats.quotes_stripped += quote_count
+        words = content_words(content)
+        if is_trivial(words):
+            stats.trivial_dropped += 1
+            continue
+
+        duplicate_of = None
+        if len(words) < MIN_DUPLICATE_WORDS:
+            key = ' '.join(words)
+            duplicate_of = exact_index.get(key)
+            if duplicate_of is None:
+                exact_index[key] = len(kept)
+        else:
+            shingles = word_shingles(words)
+            signature = minhash_signature(shingles)
+            bands = [(band, signature[band * rows:(band + 1) * rows]) for band in range(LSH_BANDS)]
+            candidates = sorted({candidate for band in bands for candidate in band_buckets.get(band, ())})
+            duplicate_of = next((candidate for candidate in candidates if jaccard_similarity(shingles, shingle_sets[candidate]) >= duplicate_threshold), None)
+            if duplicate_of is None:
+                shingle_sets[len(kept)] = shingles
+                for band in bands:
+                    bucket = band_buckets.setdefault(band, [])
+                    if len(bucket) < LSH_BUCKET_LIMIT:
+                        bucket.append(len(kept))
+
+        if duplicate_of is not None:
+            stats.duplicates_collapsed += 1
+            kept[duplicate_of][1] += 1
+            kept[duplicate_of][2] = msg_dict.get('date')
+            continue
+        kept.append([msg_dict if not quote_count else {**msg_dict, 'content': content}, 0, None])
+
+    compacted = []
+    for msg_dict, duplicate_count, last_duplicate_date in kept:
+        if duplicate_count:
+            note = f"[{duplicate_count} similar later post(s), the last dated {last_duplicate_date}]"
+            msg_dict = {**msg_dict, 'content': msg_dict['content'] + TEXT_SEPARATOR + note}
+        compacted.append(msg_dict)
+    stats.messages_out = len(compacted)
+    return compacted, stats
@@ -1,38 +1,71 @@
 import os
-import requests
-from bs4 import BeautifulSoup
-import google.generativeai as genai
 import argparse
-from dotenv import load_dotenv
+import atexit
+import collections
 import concurrent.futures # Added
+import functools
 import re # Added for parsing page numbers
+import sys
 import json # Added for caching
 from pathlib import Path # Added for caching
 import datetime # Added for caching
 import hashlib # Added for caching
+import itertools
+import multiprocessing
+import random
+import threading
+import time
+import zlib
+from urllib.parse import urlparse
 from colorama import Fore, init # Added for colored output
+from cache_index import CACHE_INDEX_FILENAME, CacheIndex
+from compaction import DEFAULT_DUPLICATE_THRESHOLD, compact_messages
+from parsers import PARSER_BACKENDS, parse_page, resolve_parser_backend
+from response_cache import RESPONSE_CACHE_FILENAME, ResponseCache
+from retrieval import BM25Index, load_index, messages_fingerprint, save_index, select_relevant_message_ids
+import metrics
+import thread_cache
 
-# Load environment variables from .env file
-load_dotenv() # Added
-
-# Configure the Gemini API key
-try:
-    GEMINI_API_KEY = os.environ["GEMINI_API_KEY"]
-except KeyError:
-    GEMINI_API_KEY = input("Please enter your Gemini API Key: ")
-
-# The API key print statement is now conditional within the main block
-
-genai.configure(api_key=GEMINI_API_KEY)
+# Heavy dependencies (the Gemini SDK, requests, BeautifulSoup) are imported where they are first used,
+# so --help, --clear-cache and cache-only runs start quickly and never ask for an API key.
 
 # --- Caching Configuration ---
 DEFAULT_CACHE_DIR = Path(".cache/technofino_summarizer")
 DEFAULT_CACHE_EXPIRY_DAYS = 7
+CACHE_FILE_SUFFIX = ".tfcache"
+DEFAULT_CACHE_MAX_MB = 1024
+DEFAULT_CACHE_RETENTION_DAYS = 90 # Entries unused for this long are deleted, even if the cache is below its size limit
+CACHE_STATS_RECENT_ENTRIES = 10
+ORPHANED_TEMP_FILE_SECONDS = 3600 # Unfinished entry files left by a crashed run; live writers touch theirs with every page
+
+# --- Gemini API ---
+_genai = None
+_genai_lock = threading.Lock()
+
+def resolve_gemini_api_key():
+    """Returns the Gemini API key from the environment or a .env file, asking for it (once) as a last resort."""
+    api_key = os.environ.get("GEMINI_API_KEY")
+    if not api_key:
+        from dotenv import load_dotenv
+        load_dotenv()
+        api_key = os.environ.get("GEMINI_API_KEY") or input("Please enter your Gemini API Key: ")
+        os.environ["GEMINI_API_KEY"] = api_key
+    return api_key
+
+def get_genai():
+    """Imports and configures the Gemini SDK on first use; only code paths that call Gemini pay for it."""
+    global _genai
+    with _genai_lock:
+        if _genai is None:
+            import google.generativeai as genai
+            genai.configure(api_key=resolve_gemini_api_key())
+            _genai = genai
+        return _genai
 
 # --- Utility to List Models ---
 def list_available_models():
     print("\\n--- Available Gemini Models ---")
-    for m in genai.list_models():
+    for m in get_genai().list_models():
         if 'generateContent' in m.supported_generation_methods:
             print(f"Model name: {m.name} - Display name: {m.display_name}")
     print("-----------------------------\\n")
@@ -41,42 +74,190 @@ def list_available_models():
 def get_cache_filepath(thread_url, cache_dir):
     """Generates a unique filepath for caching a thread's content."""
     url_hash = hashlib.md5(thread_url.encode('utf-8')).hexdigest()
-    return cache_dir / f"{url_hash}.json"
+    return cache_dir / f"{url_hash}{CACHE_FILE_SUFFIX}"
 
-def load_from_cache(cache_filepath, expiry_days):
-    """Loads messages from cache if valid and not expired."""
+def get_legacy_cache_filepath(cache_filepath):
+    """Returns the path of the single-JSON-document cache entry written by older versions."""
+    return cache_filepath.with_suffix('.json')
+
+def read_cache_file(cache_filepath):
+    """Reads the raw cache record for a thread, regardless of its age.
+
+    Returns a dict with the "timestamp", the flat "messages" list and the per-page state in "pages",
+    or None. Entries in the legacy JSON format are read too, until they are next rewritten.
+    """
+    legacy_filepath = get_legacy_cache_filepath(cache_filepath)
+    try:
+        if cache_filepath.exists():
+            metadata = thread_cache.read_metadata(cache_filepath)
+            messages, pages = [], []
+            for _, page_state, page_messages in thread_cache.iter_pages(cache_filepath):
+                messages.extend(page_messages)
+                pages.append(page_state)
+            return {"timestamp": metadata["timestamp"], "messages": messages, "pages": pages}
+        if legacy_filepath.exists():
+            with open(legacy_filepath, 'r') as f:
+                return json.load(f)
+    except (thread_cache.CacheFormatError, zlib.error, json.JSONDecodeError, KeyError, IOError) as e:
+        print(f"{Fore.RED}Error loading cache file {cache_filepath}: {e}{Fore.RESET}")
+    return None
+
+def read_cache_timestamp(cache_filepath):
+    """Reads when a thread was cached without decompressing its pages, or returns None."""
+    try:
+        if cache_filepath.exists():
+            return thread_cache.read_metadata(cache_filepath).get("timestamp")
+    except (thread_cache.CacheFormatError, zlib.error, json.JSONDecodeError, IOError) as e:
+        print(f"{Fore.RED}Error loading cache file {cache_filepath}: {e}{Fore.RESET}")
+        return None
+    cache_data = read_cache_file(cache_filepath) # Legacy entry
+    return cache_data.get("timestamp") if cache_data is not None else None
+
+def read_cache_page_count(cache_filepath):
+    """Reads how many pages a thread's cache entry holds without decompressing them, or returns 0."""
+    try:
+        if cache_filepath.exists():
+            return thread_cache.read_metadata(cache_filepath)["page_count"]
+    except (thread_cache.CacheFormatError, zlib.error, json.JSONDecodeError, KeyError, IOError) as e:
+        print(f"{Fore.RED}Error loading cache file {cache_filepath}: {e}{Fore.RESET}")
+        return 0
+    cache_data = read_cache_file(cache_filepath) # Legacy entry
+    return max((page_num for page_num, _, _ in iter_legacy_pages(cache_data)), default=0) if cache_data is not None else 0
+
+def iter_legacy_pages(cache_data):
+    """Splits a legacy cache record into (page_num, page_state, messages) tuples in page order.
+
+    Records written before per-page state was stored become a single page holding all their messages,
+    without validators, so the thread's next refresh re-fetches every page.
+    """
+    pages_by_num = split_cached_pages(cache_data)
+    if pages_by_num is None:
+        messages = cache_data.get("messages") or []
+        pages_by_num = {1: (messages, build_page_state(1, messages, {}))} if messages else {}
+    for page_num, (page_messages, page_state) in sorted(pages_by_num.items()):
+        yield page_num, page_state, page_messages
+
+class UnreadableCacheError(Exception):
+    """Raised when a thread's cache entry turns out to be unreadable while its pages are streamed."""
+    def __init__(self, cache_filepath, error):
+        self.cache_filepath = cache_filepath
+        super().__init__(f"Error loading cache file {cache_filepath}: {error}")
+
+def iter_cached_pages(cache_filepath, page_nums=None):
+    """Streams a thread's cached pages as (page_num, page_state, messages) tuples in page order.
+
+    Pages of the current format are decompressed one at a time, so only the page being consumed is
+    held in memory. Only the pages in page_nums are read when given. Legacy entries are read whole.
+    Raises UnreadableCacheError if any page (or the entry itself) cannot be read.
+    """
     if cache_filepath.exists():
         try:
-            with open(cache_filepath, 'r') as f:
-                cache_data = json.load(f)
-            
-            timestamp_str = cache_data.get("timestamp")
-            if timestamp_str:
-                timestamp = datetime.datetime.fromisoformat(timestamp_str)
-                if (datetime.datetime.now() - timestamp).days < expiry_days:
-                    print(f"{Fore.GREEN}Cache hit: Loading messages from {cache_filepath}{Fore.RESET}")
-                    return cache_data.get("messages")
-                else:
-                    print(f"{Fore.YELLOW}Cache expired: {cache_filepath}{Fore.RESET}")
-            else:
-                print(f"{Fore.YELLOW}Cache invalid (no timestamp): {cache_filepath}{Fore.RESET}")
-        except (json.JSONDecodeError, IOError) as e:
-            print(f"{Fore.RED}Error loading cache file {cache_filepath}: {e}{Fore.RESET}")
+            yield from thread_cache.iter_pages(cache_filepath, page_nums=page_nums)
+        except (thread_cache.CacheFormatError, zlib.error, json.JSONDecodeError, KeyError, IOError) as e:
+            raise UnreadableCacheError(cache_filepath, e) from e
+        return
+    cache_data = read_cache_file(cache_filepath)
+    for page_num, page_state, page_messages in (iter_legacy_pages(cache_data) if cache_data is not None else ()):
+        if page_nums is None or page_num in page_nums:
+            yield page_num, page_state, page_messages
+
+def observe_iteration_time(items, metric_name):
+    """Passes items through, recording the time spent producing them (but not consuming them) as one sample."""
+    producing_seconds = 0.0
+    started = time.perf_counter()
+    for item in items:
+        producing_seconds += time.perf_counter() - started
+        yield item
+        started = time.perf_counter()
+    metrics.observe(metric_name, producing_seconds + time.perf_counter() - started)
+
+def load_from_cache(cache_filepath, expiry_days):
+    """Returns an iterator streaming the cached pages (see iter_cached_pages) if the entry is valid and not expired, else None."""
+    timestamp_str = read_cache_timestamp(cache_filepath)
+    if timestamp_str:
+        timestamp = datetime.datetime.fromisoformat(timestamp_str)
+        if (datetime.datetime.now() - timestamp).total_seconds() < expiry_days * 86400:
+            print(f"{Fore.GREEN}Cache hit: Loading messages from {cache_filepath}{Fore.RESET}")
+            metrics.increment("thread_cache_hits")
+            if _cache_index is not None:
+                _cache_index.touch(cache_filepath.name)
+            return observe_iteration_time(iter_cached_pages(cache_filepath), "thread_cache_read_seconds")
+        else:
+            print(f"{Fore.YELLOW}Cache expired: {cache_filepath}{Fore.RESET}")
+            metrics.increment("thread_cache_expired")
+    elif cache_filepath.exists() or get_legacy_cache_filepath(cache_filepath).exists():
+        print(f"{Fore.YELLOW}Cache invalid (no timestamp): {cache_filepath}{Fore.RESET}")
+    metrics.increment("thread_cache_misses")
     return None
 
-def save_to_cache(cache_filepath, messages):
-    """Saves messages to cache with a timestamp."""
-    cache_filepath.parent.mkdir(parents=True, exist_ok=True)
-    cache_data = {
-        "timestamp": datetime.datetime.now().isoformat(),
-        "messages": messages
+def build_cache_metadata(thread_url, page_count, message_count, timestamp=None):
+    """Builds the metadata committed with a thread's cache entry, cached now unless an ISO timestamp is given."""
+    return {
+        "timestamp": timestamp or datetime.datetime.now().isoformat(),
+        "url": thread_url,
+        "page_count": page_count,
+        "message_count": message_count,
     }
+
+def append_to_cache(cache_filepath, metadata, changed_pages):
+    """Appends changed (page_num, page_state, messages) tuples to an existing cache entry and commits the new metadata.
+
+    Returns False if the existing entry is unreadable and has to be rewritten instead.
+    """
     try:
-        with open(cache_filepath, 'w') as f:
-            json.dump(cache_data, f)
-        print(f"{Fore.GREEN}Messages cached to {cache_filepath}{Fore.RESET}")
+        with metrics.timed("thread_cache_write_seconds"):
+            thread_cache.append_pages(cache_filepath, metadata, changed_pages)
+        print(f"{Fore.GREEN}Appended {len(changed_pages)} refreshed page(s) to {cache_filepath}{Fore.RESET}")
+        record_cache_entry(cache_filepath, metadata)
+    except (thread_cache.CacheFormatError, zlib.error, json.JSONDecodeError) as e:
+        print(f"{Fore.YELLOW}Cannot append to unreadable cache file {cache_filepath}: {e}{Fore.RESET}")
+        return False
     except IOError as e:
         print(f"{Fore.RED}Error saving cache to {cache_filepath}: {e}{Fore.RESET}")
+    return True
+
+def cache_pages_while_streaming(cache_filepath, thread_url, pages, timestamp=None):
+    """Passes (page_num, page_state, messages) tuples through while streaming them into a new cache entry.
+
+    The entry replaces any previous one once the last page has passed through, if the thread has any
+    messages. If the pages stop early (an error, or the caller stopping), nothing is written.
+    Cache write errors are reported and the pages keep flowing uncached. The entry is timestamped now,
+    or with timestamp when rewriting a legacy entry as it is read.
+    """
+    page_count = message_count = 0
+    write_seconds = 0.0
+    writer = None
+    try:
+        writer = thread_cache.EntryWriter(cache_filepath)
+    except IOError as e:
+        print(f"{Fore.RED}Error saving cache to {cache_filepath}: {e}{Fore.RESET}")
+    try:
+        for page_num, page_state, page_messages in pages:
+            if writer is not None:
+                started = time.perf_counter()
+                try:
+                    writer.add_page(page_num, page_state, page_messages)
+                except IOError as e:
+                    print(f"{Fore.RED}Error saving cache to {cache_filepath}: {e}{Fore.RESET}")
+                    writer.close()
+                    writer = None
+                write_seconds += time.perf_counter() - started
+            page_count, message_count = page_num, message_count + len(page_messages)
+            yield page_num, page_state, page_messages
+        if writer is not None and message_count: # Save to cache only if scraping was successful
+            started = time.perf_counter()
+            try:
+                metadata = build_cache_metadata(thread_url, page_count, message_count, timestamp)
+                writer.commit(metadata)
+                get_legacy_cache_filepath(cache_filepath).unlink(missing_ok=True)
+                print(f"{Fore.GREEN}Messages cached to {cache_filepath}{Fore.RESET}")
+                record_cache_entry(cache_filepath, metadata)
+            except IOError as e:
+                print(f"{Fore.RED}Error saving cache to {cache_filepath}: {e}{Fore.RESET}")
+            metrics.observe("thread_cache_write_seconds", write_seconds + time.perf_counter() - started)
+    finally:
+        if writer is not None:
+            writer.close()
 
 def clear_cache_dir(cache_dir):
     """Clears all files in the cache directory."""
@@ -92,7 +273,341 @@ def clear_cache_dir(cache_dir):
     else:
         print(f"{Fore.YELLOW}Cache directory {cache_dir} does not exist.{Fore.RESET}")
 
+# --- Cache Index ---
+_cache_index = None
+
+def configure_cache_index(cache_dir, max_mb=DEFAULT_CACHE_MAX_MB, retention_days=DEFAULT_CACHE_RETENTION_DAYS):
+    """Enables the thread cache index under cache_dir, adding any entries cached before it existed.
+
+    Entries are then evicted, least recently used first, when the cache grows beyond max_mb, and
+    deleted once unused for retention_days (0 keeps them until evicted for space). Unfinished entry
+    files left behind by a crashed run are deleted.
+    """
+    global _cache_index
+    _cache_index = CacheIndex(cache_dir / CACHE_INDEX_FILENAME, max_mb * 1024 * 1024, retention_days * 86400 if retention_days else None)
+    delete_orphaned_temp_files(cache_dir)
+    if _cache_index.needs_scan():
+        _cache_index.add_scanned(scan_cache_entries(cache_dir))
+    return _cache_index
+
+def get_cache_index():
+    """Returns the thread cache index, or None if it is not enabled."""
+    return _cache_index
+
+def delete_orphaned_temp_files(cache_dir):
+    """Deletes the temporary files of entry writes that were never committed or discarded (the writing process died)."""
+    if not cache_dir.exists():
+        return
+    with os.scandir(cache_dir) as items:
+        for item in items:
+            if item.name.endswith('.tmp') and CACHE_FILE_SUFFIX in item.name:
+                try:
+                    if item.stat().st_mtime < time.time() - ORPHANED_TEMP_FILE_SECONDS:
+                        os.unlink(item.path)
+                        print(f"{Fore.YELLOW}Deleted unfinished cache file: {item.path}{Fore.RESET}")
+                except OSError:
+                    pass # Removed by another process meanwhile, or retried on the next run
+
+def scan_cache_entries(cache_dir):
+    """Lists index rows for the entries in a cache directory, reading only each entry's commit record.
+
+    Legacy JSON entries are not opened: their URL and counts stay unknown until they are rewritten.
+    Retrieval indexes count towards their entry's size.
+    """
+    rows = {}
+    index_sizes = {}
+    if not cache_dir.exists():
+        return []
+    with os.scandir(cache_dir) as items:
+        for item in items:
+            if item.name.endswith('.index.json'):
+                index_sizes[item.name[:-len('.index.json')] + CACHE_FILE_SUFFIX] = item.stat().st_size
+                continue
+            if item.name.endswith(CACHE_FILE_SUFFIX):
+                filename, metadata = item.name, {}
+                try:
+                    metadata = thread_cache.read_metadata(Path(item.path))
+                except (thread_cache.CacheFormatError, zlib.error, json.JSONDecodeError, IOError):
+                    pass # Still indexed, so its size counts until it is rewritten or evicted
+            elif item.name.endswith('.json'):
+                filename, metadata = item.name[:-len('.json')] + CACHE_FILE_SUFFIX, None
+                if filename in rows: # The current-format entry takes precedence, as in read_cache_file
+                    continue
+            else:
+                continue
+            stat = item.stat()
+            cached_at = datetime.datetime.fromisoformat(metadata["timestamp"]).timestamp() if metadata and metadata.get("timestamp") else stat.st_mtime
+            rows[filename] = (filename, (metadata or {}).get("url"), stat.st_size, (metadata or {}).get("page_count"), (metadata or {}).get("message_count"), cached_at)
+    return [(*row, index_sizes.get(filename, 0)) for filename, row in rows.items()]
+
+def record_cache_entry(cache_filepath, metadata):
+    """Records a just-written cache entry in the cache index, then evicts entries beyond the cache's limits."""
+    if _cache_index is None:
+        return
+    index_filepath = get_index_filepath(cache_filepath)
+    _cache_index.record(cache_filepath.name, metadata["url"], cache_filepath.stat().st_size, metadata["page_count"], metadata["message_count"],
+                        datetime.datetime.fromisoformat(metadata["timestamp"]).timestamp(),
+                        index_filepath.stat().st_size if index_filepath.exists() else 0)
+    evict_cache_entries(keep_filepath=cache_filepath)
+
+def record_retrieval_index(index_filepath):
+    """Adds a just-saved retrieval index to its cache entry's size in the cache index, then evicts entries beyond the cache's limits."""
+    if _cache_index is None or index_filepath.parent != _cache_index.db_filepath.parent:
+        return
+    cache_filepath = index_filepath.with_name(index_filepath.name[:-len('.index.json')] + CACHE_FILE_SUFFIX)
+    _cache_index.set_index_size(cache_filepath.name, index_filepath.stat().st_size)
+    evict_cache_entries(keep_filepath=cache_filepath)
+
+def evict_cache_entries(keep_filepath=None):
+    """Deletes the entries the cache index evicts for age or size (never keep_filepath)."""
+    evicted = _cache_index.evict(keep_filepath.name if keep_filepath is not None else None)
+    for filename, _ in evicted:
+        delete_cache_entry(_cache_index.db_filepath.parent / filename)
+    if evicted:
+        metrics.increment("thread_cache_evictions", len(evicted))
+        print(f"{Fore.YELLOW}Evicted {len(evicted)} cache entr{'y' if len(evicted) == 1 else 'ies'} ({sum(size for _, size in evicted) / 1024 / 1024:.1f} MB) "
+              f"beyond the cache's size or retention limits.{Fore.RESET}")
+
+def delete_cache_entry(cache_filepath):
+    """Deletes a thread's cache entry, its legacy-format file and its retrieval index. Returns whether any of them existed."""
+    deleted = False
+    for filepath in (cache_filepath, get_legacy_cache_filepath(cache_filepath), get_index_filepath(cache_filepath)):
+        try:
+            filepath.unlink()
+            deleted = True
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"{Fore.RED}Error deleting cache file {filepath}: {e}{Fore.RESET}")
+    return deleted
+
+def discard_cache_entry(cache_filepath):
+    """Deletes a thread's cache entry files (see delete_cache_entry) and its cache index row. Returns whether any file existed."""
+    deleted = delete_cache_entry(cache_filepath)
+    if _cache_index is not None:
+        _cache_index.remove(cache_filepath.name)
+    return deleted
+
+def invalidate_cached_thread(thread_url, cache_dir):
+    """Deletes one thread's cache entry (and retrieval index), so it is scraped afresh on its next use."""
+    cache_filepath = get_cache_filepath(get_canonical_url(thread_url), cache_dir)
+    deleted = discard_cache_entry(cache_filepath)
+    if deleted:
+        print(f"{Fore.GREEN}Invalidated cached thread {get_canonical_url(thread_url)} ({cache_filepath}).{Fore.RESET}")
+    else:
+        print(f"{Fore.YELLOW}Thread {get_canonical_url(thread_url)} is not cached in {cache_dir}.{Fore.RESET}")
+    return deleted
+
+def print_cache_stats(cache_index, expiry_days):
+    """Prints the thread cache's size and age from its index, and its most recently used entries."""
+    stats = cache_index.stats(expired_before=time.time() - expiry_days * 86400)
+    print(f"{Fore.BLUE}Thread cache: {stats['entries']} entries, {stats['size_bytes'] / 1024 / 1024:.1f} of {stats['max_bytes'] / 1024 / 1024:.0f} MB; "
+          f"{stats['expired']} older than the {expiry_days:g}-day expiry (kept for incremental refreshes).{Fore.RESET}")
+    if stats['oldest_access'] is not None:
+        print(f"{Fore.BLUE}Least recently used entry last used on {datetime.datetime.fromtimestamp(stats['oldest_access']):%Y-%m-%d %H:%M}. "
+              f"Most recently used:{Fore.RESET}")
+    for entry in cache_index.recent_entries(CACHE_STATS_RECENT_ENTRIES):
+        pages = f"{entry['page_count']} pages" if entry['page_count'] is not None else "? pages"
+        print(f"  {datetime.datetime.fromtimestamp(entry['last_access']):%Y-%m-%d %H:%M}  {entry['size'] / 1024:8.0f} KB  {pages:>10}  {entry['url'] or entry['filename']}")
+
+# --- HTTP Fetching ---
+REQUEST_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+
+DEFAULT_MAX_CONNECTIONS = 10
+DEFAULT_RATE_LIMIT = 5.0 # Requests per second, per host
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_REQUEST_TIMEOUT = 30 # Seconds
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+FETCH_ENGINES = ('threads', 'asyncio')
+DEFAULT_FETCH_ENGINE = 'threads'
+# Pages fetched ahead of the one being consumed, per connection; bounds memory however long a thread is
+FETCH_WINDOW_PER_CONNECTION = 2
+
+class MissingPagesError(Exception):
+    """Raised when some pages of a thread could not be fetched, even after retries."""
+    def __init__(self, thread_url, page_nums):
+        self.thread_url = thread_url
+        self.page_nums = sorted(page_nums)
+        super().__init__(f"Could not fetch page(s) {', '.join(map(str, self.page_nums))} of {thread_url}")
+
+class TokenBucket:
+    """Thread-safe token bucket allowing `rate` acquisitions per second, with bursts up to `capacity`."""
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _try_acquire(self):
+        """Takes a token if one is available; otherwise returns how long to wait before trying again."""
+        if self.rate <= 0: # A non-positive rate disables limiting
+            return 0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        """Blocks until a token is available."""
+        while True:
+            wait = self._try_acquire()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        """Waits on the event loop until a token is available."""
+        import asyncio
+        while True:
+            wait = self._try_acquire()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+class PageFetcher:
+    """Shared HTTP client: a pooled keep-alive session with bounded retries and a per-host rate limit.
+
+    At most max_connections requests are in flight through the session at once, however many
+    threads (e.g. concurrent thread scrapes in batch mode) use it.
+    `engine` selects how iter_fetched_pages runs concurrent page fetches: "threads" (a ThreadPoolExecutor
+    over this session) or "asyncio" (aiohttp on one event loop, with the same limits and retry policy).
+    """
+    def __init__(self, max_connections=DEFAULT_MAX_CONNECTIONS, rate_limit=DEFAULT_RATE_LIMIT,
+                 max_retries=DEFAULT_MAX_RETRIES, backoff_base=0.5, backoff_max=30.0, timeout=DEFAULT_REQUEST_TIMEOUT,
+                 engine=DEFAULT_FETCH_ENGINE):
+        self.engine = engine
+        self.max_connections = max_connections
+        self.rate_limit = rate_limit
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.connection_slots = threading.BoundedSemaphore(max_connections)
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._buckets = {}
+        self._buckets_lock = threading.Lock()
+
+    @property
+    def session(self):
+        """The pooled requests.Session, created (and requests imported) on the first request, so cache-hit runs never load it."""
+        with self._session_lock:
+            if self._session is None:
+                import requests
+                session = requests.Session()
+                session.headers.update(REQUEST_HEADERS)
+                adapter = requests.adapters.HTTPAdapter(pool_connections=self.max_connections, pool_maxsize=self.max_connections)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._session = session
+            return self._session
+
+    def bucket_for(self, url):
+        host = urlparse(url).netloc
+        with self._buckets_lock:
+            if host not in self._buckets:
+                self._buckets[host] = TokenBucket(self.rate_limit)
+            return self._buckets[host]
+
+    def backoff_delay(self, attempt, response=None):
+        """Exponential backoff with full jitter, honouring a numeric Retry-After header if present."""
+        if response is not None:
+            retry_after = response.headers.get('Retry-After', '')
+            if retry_after.isdigit():
+                return min(self.backoff_max, float(retry_after))
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def get(self, url, headers=None):
+        """GETs a URL, retrying on connection errors, timeouts and 429/5xx responses.
+
+        The last response is returned once retries are exhausted, so callers still see the final status.
+        """
+        import requests
+        bucket = self.bucket_for(url)
+        for attempt in range(self.max_retries + 1):
+            bucket.acquire()
+            metrics.increment("fetch_requests")
+            try:
+                with self.connection_slots, metrics.timed("fetch_seconds"):
+                    response = self.session.get(url, headers=headers, timeout=self.timeout)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                metrics.increment("fetch_errors")
+                if attempt == self.max_retries:
+                    raise
+                delay = self.backoff_delay(attempt)
+                print(f"{Fore.YELLOW}Request to {url} failed ({e}); retrying in {delay:.1f}s{Fore.RESET}")
+                time.sleep(delay)
+                continue
+            metrics.observe("fetch_bytes", len(response.content))
+            if response.status_code in RETRY_STATUS_CODES and attempt < self.max_retries:
+                metrics.increment("fetch_retried_responses")
+                delay = self.backoff_delay(attempt, response)
+                print(f"{Fore.YELLOW}Got HTTP {response.status_code} from {url}; retrying in {delay:.1f}s{Fore.RESET}")
+                time.sleep(delay)
+                continue
+            return response
+
+_page_fetcher = None
+_page_fetcher_lock = threading.Lock()
+
+def configure_page_fetcher(**kwargs):
+    """Replaces the shared page fetcher with one built from the given PageFetcher options."""
+    global _page_fetcher
+    with _page_fetcher_lock:
+        _page_fetcher = PageFetcher(**kwargs)
+    return _page_fetcher
+
+def get_page_fetcher():
+    """Returns the shared page fetcher, creating one with default settings on first use."""
+    global _page_fetcher
+    with _page_fetcher_lock:
+        if _page_fetcher is None:
+            _page_fetcher = PageFetcher()
+        return _page_fetcher
+
 # --- Scraper ---
+_parser_backend = None
+
+def configure_parser_backend(backend='auto'):
+    """Selects the HTML parser backend used for thread pages ('auto' picks the fastest installed one)."""
+    global _parser_backend
+    _parser_backend = resolve_parser_backend(backend)
+    return _parser_backend
+
+def get_parser_backend():
+    """Returns the configured parser backend, resolving 'auto' on first use."""
+    if _parser_backend is None:
+        return configure_parser_backend()
+    return _parser_backend
+
+_parse_executor = None
+
+def configure_parse_workers(workers):
+    """Parses pages in a pool of `workers` processes, so parsing is not serialized by the GIL.
+
+    With 0 workers, pages are parsed in the thread (or event loop executor) that fetched them.
+    Workers are started here, from a fork server where available (never by forking this process,
+    whose fetch threads may hold locks a forked child would inherit), rather than on the first
+    submit from a fetch thread.
+    """
+    global _parse_executor
+    if _parse_executor is not None:
+        _parse_executor.shutdown()
+    _parse_executor = None
+    if workers > 0:
+        start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        _parse_executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(start_method))
+        for future in [_parse_executor.submit(int) for _ in range(workers)]: # Warm up every worker
+            future.result()
+    return _parse_executor
+
 
 def get_canonical_url(url_str):
     """Converts a potentially specific page/anchor URL to the base thread URL (first page)."""
@@ -114,41 +629,339 @@ def get_canonical_url(url_str):
         
     return base_url_path
 
-def fetch_page_messages(page_url):
-    """Fetches messages with their dates from a single page URL."""
-    messages_with_dates = []
+def get_page_url(canonical_first_page_url, page_num):
+    """Builds the URL of a given page of a thread from its canonical (first page) URL."""
+    if page_num == 1:
+        return canonical_first_page_url
+    return f"{canonical_first_page_url.rstrip('/')}/page-{page_num}"
+
+def build_page_state(page_num, messages, response_headers):
+    """Builds the per-page record stored in the cache to drive incremental refreshes."""
+    return {
+        "page": page_num,
+        "message_count": len(messages),
+        "last_date": messages[-1]['date'] if messages else None,
+        "etag": response_headers.get('ETag'),
+        "last_modified": response_headers.get('Last-Modified'),
+    }
+
+def parse_page_content(content, page_num, response_headers):
+    """Parses raw page HTML into a (messages, page_state) tuple with the configured parser backend.
+
+    When parse workers are configured, the raw bytes are handed to the process pool and the calling
+    fetch thread only waits for the result, leaving the GIL free for network I/O.
+    """
+    with metrics.timed("parse_seconds"):
+        if _parse_executor is not None:
+            messages_with_dates, _ = _parse_executor.submit(parse_page, content, get_parser_backend()).result()
+        else:
+            messages_with_dates, _ = parse_page(content, get_parser_backend())
+    return messages_with_dates, build_page_state(page_num, messages_with_dates, response_headers)
+
+def conditional_request_headers(previous_state):
+    """Builds If-None-Match/If-Modified-Since headers from a previous page state, if it has validators."""
+    headers = {}
+    if previous_state:
+        if previous_state.get("etag"):
+            headers['If-None-Match'] = previous_state["etag"]
+        if previous_state.get("last_modified"):
+            headers['If-Modified-Since'] = previous_state["last_modified"]
+    return headers
+
+def request_page(page_url, previous_state=None):
+    """Requests a thread page, conditionally when the previous page state carries validators.
+
+    Returns None when the server reports the page as not modified (HTTP 304).
+    Raises requests.exceptions.RequestException on failure, once the shared fetcher's retries are exhausted.
+    """
+    response = get_page_fetcher().get(page_url, headers=conditional_request_headers(previous_state))
+    if response.status_code == 304:
+        metrics.increment("fetch_not_modified")
+        return None
+    response.raise_for_status()
+    return response
+
+def fetch_page_messages(page_url, page_num, previous_state=None):
+    """Fetches messages with their dates from a single page URL.
+
+    Returns a (messages, page_state) tuple. messages is None when the page is unchanged
+    since previous_state, and page_state is None when the page could not be fetched.
+    """
+    import requests
     print(f"{Fore.CYAN}Fetching messages from: {page_url}{Fore.RESET}")
     try:
-        response = requests.get(page_url, headers={
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        })
-        response.raise_for_status()
-        soup = BeautifulSoup(response.content, 'html.parser')
-        
-        message_articles = soup.select('article.message') 
-        for article in message_articles:
-            date_str = "Unknown date"
-            time_tag = article.select_one('time.u-dt')
-            if time_tag:
-                if time_tag.has_attr('datetime'):
-                    date_str = time_tag['datetime']
-                else:
-                    date_str = time_tag.get_text(strip=True) # Fallback to text
+        response = request_page(page_url, previous_state)
+        if response is None:
+            print(f"{Fore.GREEN}Page {page_num} not modified since last fetch.{Fore.RESET}")
+            return None, previous_state
+        return parse_page_content(response.content, page_num, response.headers)
+    except requests.exceptions.RequestException as e:
+        print(f"{Fore.RED}Error fetching page {page_url}: {e}{Fore.RESET}")
+    return [], None
+
+def iter_pages_threaded(canonical_first_page_url, page_nums, previous_states):
+    """Fetches pages with a ThreadPoolExecutor sharing the fetcher's session, yielding (page_num, (messages, page_state)) in page order.
+
+    Only a window of pages is in flight or held for an earlier page at a time. Failed pages yield ([], None).
+    """
+    # Workers share the fetcher's connection pool; politeness is enforced by its per-host rate limit.
+    fetcher = get_page_fetcher()
+    max_workers = min(fetcher.max_connections, len(page_nums))
+    page_num_iter = iter(page_nums)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        submit = lambda page_num: (page_num, executor.submit(fetch_page_messages, get_page_url(canonical_first_page_url, page_num), page_num, previous_states.get(page_num)))
+        pending = collections.deque(submit(page_num) for page_num in itertools.islice(page_num_iter, FETCH_WINDOW_PER_CONNECTION * fetcher.max_connections))
+        try:
+            while pending:
+                page_num, future = pending.popleft()
+                next_page_num = next(page_num_iter, None)
+                if next_page_num is not None:
+                    pending.append(submit(next_page_num))
+                try:
+                    result = future.result()
+                except Exception as exc:
+                    print(f'{Fore.RED}Page {page_num} generated an exception: {exc}{Fore.RESET}')
+                    result = ([], None)
+                yield page_num, result
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+async def fetch_page_messages_async(session, semaphore, page_url, page_num, previous_state=None):
+    """Async counterpart of fetch_page_messages: fetches on the event loop and parses in an executor thread."""
+    import asyncio
+    import aiohttp
+    fetcher = get_page_fetcher()
+    bucket = fetcher.bucket_for(page_url)
+    headers = conditional_request_headers(previous_state)
+    async with semaphore:
+        print(f"{Fore.CYAN}Fetching messages from: {page_url}{Fore.RESET}")
+        for attempt in range(fetcher.max_retries + 1):
+            await bucket.acquire_async()
+            metrics.increment("fetch_requests")
+            fetch_started = time.perf_counter()
+            try:
+                async with session.get(page_url, headers=headers) as response:
+                    if response.status in RETRY_STATUS_CODES and attempt < fetcher.max_retries:
+                        metrics.increment("fetch_retried_responses")
+                        delay = fetcher.backoff_delay(attempt, response)
+                        print(f"{Fore.YELLOW}Got HTTP {response.status} from {page_url}; retrying in {delay:.1f}s{Fore.RESET}")
+                    elif response.status == 304:
+                        metrics.increment("fetch_not_modified")
+                        print(f"{Fore.GREEN}Page {page_num} not modified since last fetch.{Fore.RESET}")
+                        return None, previous_state
+                    else:
+                        response.raise_for_status()
+                        content = await response.read()
+                        response_headers = dict(response.headers)
+                        metrics.observe("fetch_seconds", time.perf_counter() - fetch_started)
+                        metrics.observe("fetch_bytes", len(content))
+                        break
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                metrics.increment("fetch_errors")
+                if attempt == fetcher.max_retries:
+                    print(f"{Fore.RED}Error fetching page {page_url}: {e}{Fore.RESET}")
+                    return [], None
+                delay = fetcher.backoff_delay(attempt)
+                print(f"{Fore.YELLOW}Request to {page_url} failed ({e}); retrying in {delay:.1f}s{Fore.RESET}")
+            except aiohttp.ClientResponseError as e:
+                print(f"{Fore.RED}Error fetching page {page_url}: {e}{Fore.RESET}")
+                return [], None
+            await asyncio.sleep(delay) # Back off outside the response context so the connection is released
+    # Parsing is CPU-bound; keep it off the event loop (in the parse process pool, if configured) so other downloads proceed
+    loop = asyncio.get_running_loop()
+    with metrics.timed("parse_seconds"):
+        messages_with_dates, _ = await loop.run_in_executor(_parse_executor, parse_page, content, get_parser_backend())
+    return messages_with_dates, build_page_state(page_num, messages_with_dates, response_headers)
+
+async def iter_pages_async(canonical_first_page_url, page_nums, previous_states=None):
+    """Fetches pages concurrently on one event loop, yielding (page_num, (messages, page_state)) in page order.
 
-            content_tag = article.select_one('.message-content .bbWrapper')
-            if not content_tag:
-                 content_tag = article.select_one('.bbWrapper') # General fallback within article
+    Concurrency is bounded by the fetcher's max_connections; later pages that finish early are
+    held until every earlier page has been yielded, and only a window of pages is scheduled at a time.
+    """
+    import asyncio
+    import aiohttp
+    previous_states = previous_states or {}
+    fetcher = get_page_fetcher()
+    semaphore = asyncio.Semaphore(fetcher.max_connections)
+    connector = aiohttp.TCPConnector(limit=fetcher.max_connections)
+    timeout = aiohttp.ClientTimeout(total=fetcher.timeout)
+    page_num_iter = iter(page_nums)
+    async with aiohttp.ClientSession(headers=REQUEST_HEADERS, connector=connector, timeout=timeout) as session:
+        schedule = lambda page_num: (page_num, asyncio.ensure_future(fetch_page_messages_async(session, semaphore, get_page_url(canonical_first_page_url, page_num), page_num, previous_states.get(page_num))))
+        pending = collections.deque(schedule(page_num) for page_num in itertools.islice(page_num_iter, FETCH_WINDOW_PER_CONNECTION * fetcher.max_connections))
+        try:
+            while pending:
+                page_num, task = pending.popleft()
+                next_page_num = next(page_num_iter, None)
+                if next_page_num is not None:
+                    pending.append(schedule(next_page_num))
+                try:
+                    yield page_num, await task
+                except Exception as exc:
+                    print(f'{Fore.RED}Page {page_num} generated an exception: {exc}{Fore.RESET}')
+                    yield page_num, ([], None)
+        finally:
+            for _, task in pending:
+                task.cancel()
+            await asyncio.gather(*(task for _, task in pending), return_exceptions=True)
+
+def iter_async_generator(async_iterator):
+    """Drives an async iterator from synchronous code on a private event loop, one item at a time."""
+    import asyncio
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(async_iterator.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        try:
+            loop.run_until_complete(async_iterator.aclose())
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            loop.run_until_complete(loop.shutdown_default_executor())
+        finally:
+            loop.close()
+
+def iter_fetched_pages(canonical_first_page_url, page_nums, previous_states=None):
+    """Fetches the given pages of a thread in parallel with the shared fetcher's engine, streaming them in page order.
+
+    Yields (page_num, page_state, messages) tuples as each page becomes the next in order; messages
+    is None when a page is unchanged since its state in previous_states.
+    Raises MissingPagesError, once every page has been tried, if any page is still missing after the
+    fetcher's retries. Pages after the first missing one are then not yielded.
+    """
+    previous_states = previous_states or {}
+    page_nums = list(page_nums)
+    if not page_nums:
+        return
+    if get_page_fetcher().engine == 'asyncio':
+        results = iter_async_generator(iter_pages_async(canonical_first_page_url, page_nums, previous_states))
+    else:
+        results = iter_pages_threaded(canonical_first_page_url, page_nums, previous_states)
+    missing_page_nums = []
+    for page_num, (page_messages, page_state) in results:
+        if page_state is None:
+            missing_page_nums.append(page_num)
+        elif not missing_page_nums:
+            yield page_num, page_state, page_messages
+    if missing_page_nums:
+        raise MissingPagesError(canonical_first_page_url, missing_page_nums)
+
+def split_cached_pages(cache_data):
+    """Splits a cached flat message list back into per-page slices using the stored page state.
 
-            if content_tag:
-                content_text = content_tag.get_text(separator='\\n', strip=True) # MODIFIED: separator='\n'
-                if content_text: # Only add if there's actual content
-                    messages_with_dates.append({'date': date_str, 'content': content_text})
+    Returns a dict mapping page number to a (messages, page_state) tuple, or None if the cache entry
+    has no usable page state (e.g. it was written before incremental refreshes existed).
+    """
+    cached_messages = cache_data.get("messages") or []
+    cached_pages = cache_data.get("pages") or []
+    if not cached_pages or [p.get("page") for p in cached_pages] != list(range(1, len(cached_pages) + 1)):
+        return None
+    if sum(p.get("message_count", 0) for p in cached_pages) != len(cached_messages):
+        return None
+    pages_by_num = {}
+    offset = 0
+    for page_state in cached_pages:
+        count = page_state["message_count"]
+        pages_by_num[page_state["page"]] = (cached_messages[offset:offset + count], page_state)
+        offset += count
+    return pages_by_num
+
+def refresh_thread_incrementally(canonical_first_page_url, cache_filepath):
+    """Refreshes a cached thread by re-reading page 1 (for the page count) and only the tail pages.
+
+    Pages between the first and the previously last page are streamed from the cache, as only the
+    last page(s) of a thread change when new replies are posted.
+    Returns (pages, changed_pages): an iterator of (page_num, page_state, messages) tuples in page
+    order, and a list that collects the re-fetched pages that changed as the iterator is consumed.
+    Returns None if a full scrape is required instead.
+    """
+    import requests
+    cached_last_page = read_cache_page_count(cache_filepath)
+    try:
+        edge_pages = {page_num: (page_state, page_messages) for page_num, page_state, page_messages in iter_cached_pages(cache_filepath, {1, cached_last_page})}
+    except UnreadableCacheError as e:
+        print(f"{Fore.RED}{e}{Fore.RESET}")
+        edge_pages = {}
+    if 1 not in edge_pages or cached_last_page not in edge_pages:
+        print(f"{Fore.YELLOW}Cache has no page state; falling back to a full scrape.{Fore.RESET}")
+        return None
+
+    print(f"{Fore.CYAN}Refreshing cached thread incrementally: {canonical_first_page_url}{Fore.RESET}")
+    try:
+        response = request_page(canonical_first_page_url, edge_pages[1][0])
     except requests.exceptions.RequestException as e:
-        print(f"{Fore.RED}Error fetching page {page_url}: {e}{Fore.RESET}")
-    return messages_with_dates
+        print(f"{Fore.RED}Error fetching initial page {canonical_first_page_url}: {e}{Fore.RESET}")
+        return None
+
+    changed_pages = []
+    if response is None: # Page 1, including its pagination, is unchanged
+        total_pages = cached_last_page
+        first_page = (1, *edge_pages[1])
+    else:
+        with metrics.timed("parse_seconds"):
+            first_page_messages, total_pages = parse_page(response.content, get_parser_backend())
+        first_page = (1, build_page_state(1, first_page_messages, response.headers), first_page_messages)
+        changed_pages.append(first_page)
+
+    if total_pages < cached_last_page:
+        print(f"{Fore.YELLOW}Thread now has fewer pages ({total_pages}) than cached ({cached_last_page}); falling back to a full scrape.{Fore.RESET}")
+        return None
+
+    # The previously last page may have gained replies; anything after it is new
+    tail_page_nums = list(range(max(2, cached_last_page), total_pages + 1))
+    print(f"{Fore.BLUE}Total pages identified: {total_pages} (re-fetching {len(tail_page_nums)} tail page(s)){Fore.RESET}")
+    previous_states = {page_num: edge_pages[page_num][0] for page_num in tail_page_nums if page_num in edge_pages}
 
-def get_all_messages_from_thread(thread_url, use_cache, cache_dir, cache_expiry_days):
-    """Extracts all messages (with dates) from all pages of a Technofino thread, using cache if enabled."""
+    def iter_refreshed_pages():
+        yield first_page
+        yield from iter_cached_pages(cache_filepath, range(2, cached_last_page))
+        for page_num, page_state, page_messages in iter_fetched_pages(canonical_first_page_url, tail_page_nums, previous_states):
+            if page_messages is None: # Not modified, reuse the cached page
+                yield (page_num, *edge_pages[page_num])
+            else:
+                changed_pages.append((page_num, page_state, page_messages))
+                yield changed_pages[-1]
+
+    return iter_refreshed_pages(), changed_pages
+
+def iter_scraped_pages(canonical_first_page_url):
+    """Scrapes a whole thread, streaming (page_num, page_state, messages) tuples in page order.
+
+    Page 1 is yielded as soon as it is parsed (it gives the page count), and the other pages follow
+    as they arrive. Yields nothing if the first page cannot be fetched.
+    """
+    import requests
+    # Fetch the first page to get total pages and first page messages
+    print(f"{Fore.CYAN}Fetching initial page to determine pagination: {canonical_first_page_url}{Fore.RESET}") # Use canonical URL
+    try:
+        response = request_page(canonical_first_page_url)
+    except requests.exceptions.RequestException as e:
+        print(f"{Fore.RED}Error fetching initial page {canonical_first_page_url}: {e}{Fore.RESET}") # Use canonical URL
+        return
+
+    with metrics.timed("parse_seconds"):
+        first_page_messages_with_dates, total_pages = parse_page(response.content, get_parser_backend())
+    first_page_state = build_page_state(1, first_page_messages_with_dates, response.headers)
+    response = None # Don't hold on to the raw page while the rest of the thread streams through
+
+    print(f"{Fore.BLUE}Total pages identified: {total_pages}{Fore.RESET}")
+    yield 1, first_page_state, first_page_messages_with_dates
+    yield from iter_fetched_pages(canonical_first_page_url, range(2, total_pages + 1))
+
+def iter_thread_pages(thread_url, use_cache, cache_dir, cache_expiry_days, force_refresh=False):
+    """Streams all pages of a Technofino thread as (page_num, page_state, messages) tuples in page order, using cache if enabled.
+
+    Pages flow one at a time from the cache or the network to the caller, and fetched pages are
+    written to the cache as they pass through, so memory is bounded by the fetch window rather than
+    by the thread's size. An expired cache entry (or any entry when force_refresh is set) is
+    refreshed incrementally, fetching only the pages that can have changed since it was written.
+    An entry found unreadable is discarded and the thread scraped instead, or, if some of its pages
+    have already been streamed, UnreadableCacheError is raised so the caller can start over.
+    """
     
     original_user_url = thread_url # Keep for logging or other purposes if needed
     canonical_first_page_url = get_canonical_url(original_user_url)
@@ -159,148 +972,396 @@ def get_all_messages_from_thread(thread_url, use_cache, cache_dir, cache_expiry_
     cache_filepath = get_cache_filepath(canonical_first_page_url, cache_dir) # Use canonical URL for caching
 
     if use_cache:
-        cached_messages = load_from_cache(cache_filepath, cache_expiry_days)
-        if cached_messages is not None:
-            return cached_messages
+        served_page_count = 0
+        try:
+            if not force_refresh:
+                cached_pages = load_from_cache(cache_filepath, cache_expiry_days)
+                if cached_pages is not None:
+                    if not cache_filepath.exists(): # Legacy entry: rewrite it in the current format, keeping its timestamp
+                        cached_pages = cache_pages_while_streaming(cache_filepath, canonical_first_page_url, cached_pages, read_cache_timestamp(cache_filepath))
+                    for page in cached_pages:
+                        served_page_count += 1
+                        yield page
+                    if served_page_count:
+                        return
 
-    all_messages_by_page = {} # Store messages keyed by page number to maintain order
+            if cache_filepath.exists() or get_legacy_cache_filepath(cache_filepath).exists():
+                refreshed = refresh_thread_incrementally(canonical_first_page_url, cache_filepath)
+                if refreshed is not None:
+                    pages, changed_pages = refreshed
+                    is_legacy = not cache_filepath.exists()
+                    if is_legacy: # Rewrite it in the current format
+                        pages = cache_pages_while_streaming(cache_filepath, canonical_first_page_url, pages)
+                    page_count = message_count = 0
+                    for page_num, page_state, page_messages in pages:
+                        served_page_count += 1
+                        page_count, message_count = page_num, message_count + len(page_messages)
+                        yield page_num, page_state, page_messages
+                    if not is_legacy and message_count and not append_to_cache(cache_filepath, build_cache_metadata(canonical_first_page_url, page_count, message_count), changed_pages):
+                        cache_filepath.unlink(missing_ok=True) # The pages have been consumed; the next run scrapes afresh
+                    return
+        except UnreadableCacheError as e:
+            print(f"{Fore.RED}{e}{Fore.RESET}")
+            discard_cache_entry(cache_filepath)
+            if served_page_count:
+                raise # The pages already streamed cannot be taken back
+            print(f"{Fore.YELLOW}Discarded the unreadable cache entry; falling back to a full scrape.{Fore.RESET}")
 
-    # Fetch the first page to get total pages and first page messages
-    print(f"{Fore.CYAN}Fetching initial page to determine pagination: {canonical_first_page_url}{Fore.RESET}") # Use canonical URL
+    pages = iter_scraped_pages(canonical_first_page_url)
+    if use_cache:
+        pages = cache_pages_while_streaming(cache_filepath, canonical_first_page_url, pages)
+    yield from pages
+
+def get_all_messages_from_thread(thread_url, use_cache, cache_dir, cache_expiry_days, force_refresh=False):
+    """Extracts all messages (with dates) from all pages of a Technofino thread, using cache if enabled.
+
+    Collects the pages streamed by iter_thread_pages into one flat list, without intermediate per-page copies.
+    """
     try:
-        response = requests.get(canonical_first_page_url, headers={ # Use canonical URL
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        })
-        response.raise_for_status()
-    except requests.exceptions.RequestException as e:
-        print(f"{Fore.RED}Error fetching initial page {canonical_first_page_url}: {e}{Fore.RESET}") # Use canonical URL
-        return []
+        return [msg_dict for _, _, page_messages in iter_thread_pages(thread_url, use_cache, cache_dir, cache_expiry_days, force_refresh) for msg_dict in page_messages]
+    except UnreadableCacheError: # The entry was discarded part-way through; the thread is scraped afresh
+        print(f"{Fore.YELLOW}Discarded the unreadable cache entry; scraping the whole thread again.{Fore.RESET}")
+        return [msg_dict for _, _, page_messages in iter_thread_pages(thread_url, use_cache, cache_dir, cache_expiry_days, force_refresh) for msg_dict in page_messages]
 
-    soup = BeautifulSoup(response.content, 'html.parser')
-    
-    # Extract messages from the first page
-    first_page_messages_with_dates = []
-    message_articles_fp = soup.select('article.message')
-    for article_fp in message_articles_fp:
-        date_str_fp = "Unknown date"
-        time_tag_fp = article_fp.select_one('time.u-dt')
-        if time_tag_fp:
-            if time_tag_fp.has_attr('datetime'):
-                date_str_fp = time_tag_fp['datetime']
+# --- Response Caching ---
+PROMPT_TEMPLATE_VERSION = 2 # Bump whenever prompt wording changes, so cached responses to old prompts are not reused
+DEFAULT_RESPONSE_CACHE_EXPIRY_DAYS = 7
+DEFAULT_RESPONSE_CACHE_MAX_MB = 100
+
+_response_cache = None
+_llm_slots = None
+
+def configure_llm_concurrency(max_concurrency):
+    """Bounds the number of Gemini requests in flight across all threads of the process."""
+    global _llm_slots
+    _llm_slots = threading.BoundedSemaphore(max(1, max_concurrency))
+
+def record_token_usage(response):
+    """Adds the prompt and response token counts from a Gemini response's usage metadata to the metrics."""
+    usage = getattr(response, 'usage_metadata', None)
+    if usage is not None:
+        metrics.increment("gemini_prompt_tokens", getattr(usage, 'prompt_token_count', 0) or 0)
+        metrics.increment("gemini_response_tokens", getattr(usage, 'candidates_token_count', 0) or 0)
+
+def _generate_content_text(model, prompt, on_chunk=None):
+    metrics.increment("gemini_requests")
+    with metrics.timed("gemini_request_seconds"):
+        if on_chunk is None:
+            response = model.generate_content(prompt)
+            text = response.text
+        else:
+            request_started = time.perf_counter()
+            parts = []
+            response = model.generate_content(prompt, stream=True)
+            for chunk in response:
+                chunk_text = chunk.text
+                if chunk_text:
+                    if not parts:
+                        metrics.observe("gemini_first_chunk_seconds", time.perf_counter() - request_started)
+                    on_chunk(chunk_text)
+                    parts.append(chunk_text)
+            text = ''.join(parts) # The stream's usage metadata is complete once it has been consumed
+    if metrics.get_metrics() is not None:
+        record_token_usage(response)
+    return text
+
+def call_model(model, prompt, on_chunk=None):
+    """Calls the model, waiting for a free slot when a global concurrency limit is configured.
+
+    With on_chunk, the response is streamed: on_chunk receives each piece of text as it is generated,
+    and the full text is still returned once the stream completes.
+    """
+    if _llm_slots is None:
+        return _generate_content_text(model, prompt, on_chunk)
+    with _llm_slots:
+        return _generate_content_text(model, prompt, on_chunk)
+
+def configure_response_cache(cache_dir, expiry_days=DEFAULT_RESPONSE_CACHE_EXPIRY_DAYS, max_mb=DEFAULT_RESPONSE_CACHE_MAX_MB):
+    """Enables the persistent Gemini response cache under cache_dir."""
+    global _response_cache
+    _response_cache = ResponseCache(cache_dir / RESPONSE_CACHE_FILENAME, expiry_days * 86400, max_mb * 1024 * 1024)
+    return _response_cache
+
+def get_response_cache():
+    """Returns the response cache, or None if it is not enabled."""
+    return _response_cache
+
+def generate_text(model, model_name, prompt, on_chunk=None):
+    """Generates the model's response text for a prompt, reusing a cached response to an identical request.
+
+    Prompts embed the current date, so cached responses are naturally not reused across days.
+    With on_chunk the response is streamed (see call_model); a cached response is passed to on_chunk
+    whole, and a streamed one is only cached once it has completed.
+    """
+    if _response_cache is None:
+        return call_model(model, prompt, on_chunk)
+    key = ResponseCache.make_key(model_name, prompt, PROMPT_TEMPLATE_VERSION)
+    cached_text = _response_cache.get(key)
+    if cached_text is not None:
+        print(f"{Fore.GREEN}Response cache hit ({model_name}){Fore.RESET}")
+        metrics.increment("response_cache_hits")
+        if on_chunk is not None:
+            on_chunk(cached_text)
+        return cached_text
+    metrics.increment("response_cache_misses")
+    text = call_model(model, prompt, on_chunk)
+    _response_cache.put(key, model_name, text)
+    return text
+
+class ResponseStream:
+    """on_chunk callback that prints streamed response text (and writes it to an open file) as it arrives."""
+    def __init__(self, output_file=None, color=""):
+        self.output_file = output_file
+        self.color = color
+        self.parts = []
+
+    def __call__(self, text):
+        self.parts.append(text)
+        print(f"{self.color}{text}", end='', flush=True)
+        if self.output_file is not None:
+            self.output_file.write(text)
+            self.output_file.flush()
+
+    def finish(self, final_text):
+        """Writes whatever of final_text was not streamed (e.g. an error message), then ends the console line."""
+        streamed_text = ''.join(self.parts)
+        if final_text != streamed_text:
+            if final_text.startswith(streamed_text):
+                self(final_text[len(streamed_text):])
             else:
-                date_str_fp = time_tag_fp.get_text(strip=True)
-        
-        content_tag_fp = article_fp.select_one('.message-content .bbWrapper')
-        if not content_tag_fp:
-             content_tag_fp = article_fp.select_one('.bbWrapper')
-
-        if content_tag_fp:
-            content_text_fp = content_tag_fp.get_text(separator='\\n', strip=True) # MODIFIED: separator='\n'
-            if content_text_fp: # Only add if there's actual content
-                first_page_messages_with_dates.append({'date': date_str_fp, 'content': content_text_fp})
-    
-    all_messages_by_page[1] = first_page_messages_with_dates
-
-    # Determine total number of pages
-    total_pages = 1
-    page_nav = soup.select_one('.pageNav-main')
-    if page_nav:
-        # Try to find the last page number from pagination links
-        page_links = page_nav.select('li.pageNav-page a[href]')
-        if page_links:
-            last_page_link_text = page_links[-1].get_text(strip=True)
-            if last_page_link_text.isdigit():
-                total_pages = int(last_page_link_text)
-            else: # Fallback if last link is not a number (e.g., "Next")
-                # Check previous elements if the last one is "Next" or similar
-                if len(page_links) > 1 and page_links[-2].get_text(strip=True).isdigit():
-                    total_pages = int(page_links[-2].get_text(strip=True))
-                # If still not found, it might be a single page or very few pages
-                # The initial value of total_pages = 1 will handle single page cases.
-                # This part can be further improved if specific non-numeric last links are common.
-        else: # No page links found, assume single page
-             pass # total_pages remains 1
+                self(("\n" if streamed_text else "") + final_text)
+        print()
 
-    print(f"{Fore.BLUE}Total pages identified: {total_pages}{Fore.RESET}")
+def print_response_cache_stats(response_cache):
+    """Prints the response cache's size and this run's hit/miss counts."""
+    stats = response_cache.stats()
+    print(f"{Fore.BLUE}Response cache: {stats['entries']} entries, {stats['size_bytes'] / 1024 / 1024:.1f} of {stats['max_bytes'] / 1024 / 1024:.0f} MB; "
+          f"{stats['hits']} hit(s), {stats['misses']} miss(es) this run.{Fore.RESET}")
 
-    page_urls_to_fetch = []
-    if total_pages > 1:
-        # Construct base URL for subsequent pages using the canonical first page URL
-        base_thread_url_for_pages = canonical_first_page_url.rstrip('/')
-        
-        for page_num in range(2, total_pages + 1):
-            page_urls_to_fetch.append(f"{base_thread_url_for_pages}/page-{page_num}")
-
-    if page_urls_to_fetch:
-        # Max workers can be tuned. None usually defaults to number of processors * 5
-        # Let's cap it to avoid overwhelming the server or hitting rate limits quickly.
-        # Technofino might be sensitive to too many rapid requests.
-        max_workers = min(10, len(page_urls_to_fetch)) 
-        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-            future_to_url = {executor.submit(fetch_page_messages, url): url for url in page_urls_to_fetch}
-            for future in concurrent.futures.as_completed(future_to_url):
-                url = future_to_url[future]
-                try:
-                    page_messages = future.result()
-                    # Extract page number from URL to store in order
-                    match = re.search(r'page-(\d+)', url)
-                    if match:
-                        page_num = int(match.group(1))
-                        all_messages_by_page[page_num] = page_messages
-                    else: # Fallback for URLs not matching page-X, though unlikely with current construction
-                        print(f"{Fore.YELLOW}Warning: Could not determine page number for {url}{Fore.RESET}")
-                        # Append to a temporary list if page number unknown, then append at the end
-                        # For now, we assume URLs will match the pattern
-                except Exception as exc:
-                    print(f'{Fore.RED}{url} generated an exception: {exc}{Fore.RESET}')
-    
-    # Combine all messages in page order
-    final_messages_list = []
-    for page_num in sorted(all_messages_by_page.keys()):
-        final_messages_list.extend(all_messages_by_page[page_num])
-        
-    if use_cache and final_messages_list: # Save to cache only if scraping was successful
-        save_to_cache(cache_filepath, final_messages_list)
-        
-    return final_messages_list
+# --- Prompt Formatting ---
+MESSAGE_SEPARATOR = "\\n\\n---\\n\\n" # MODIFIED: \n\n---\n\n
+RENDERED_THREAD_MEMO_SIZE = 8
+
+def estimate_tokens_locally(text):
+    """Roughly estimates the token count of text without an API call (about 4 characters per token)."""
+    return len(text) // 4 + 1
+
+@functools.lru_cache(maxsize=65536)
+def normalize_message_date(date_info):
+    """Standardizes a message date for prompts. Memoized, so each distinct date is parsed only once."""
+    try:
+        if date_info.endswith('Z'): # Handle UTC 'Z'
+            dt_object = datetime.datetime.fromisoformat(date_info[:-1] + '+00:00')
+        else:
+            dt_object = datetime.datetime.fromisoformat(date_info)
+        return dt_object.strftime("%Y-%m-%d %H:%M %Z%z")
+    except (ValueError, TypeError):
+        return date_info # Fallback
+
+def format_message(msg_dict):
+    """Formats a message dict as the dated text block used in prompts."""
+    return f"Date: {normalize_message_date(msg_dict.get('date', 'Unknown date'))}\\nMessage: {msg_dict.get('content', '')}" # MODIFIED: \n
+
+class RenderedThread:
+    """A thread's per-message prompt token estimates, computed once and shared by summarization, token estimation and Q&A.
+
+    The prompt text itself is rendered on demand, straight into the prompt being built (see
+    build_prompt), so no full copies of the thread's text are kept alongside its messages.
+    """
+    def __init__(self, messages):
+        self.messages = messages
+        self.message_tokens = [estimate_tokens_locally(format_message(msg_dict)) for msg_dict in messages]
+        self.total_tokens = sum(self.message_tokens)
+
+    def iter_text(self, message_ids=None):
+        """Yields the prompt text of the messages given by index (all by default), with separators between them."""
+        for position, message_id in enumerate(range(len(self.messages)) if message_ids is None else message_ids):
+            if position:
+                yield MESSAGE_SEPARATOR
+            yield format_message(self.messages[message_id])
+
+    def join(self, message_ids=None):
+        """Prompt text for the messages given by index (all by default)."""
+        return "".join(self.iter_text(message_ids))
+
+def build_prompt(prefix, rendered_thread, suffix, message_ids=None):
+    """Builds prefix + the messages' prompt text + suffix in one join, without an intermediate copy of the thread text."""
+    return "".join(itertools.chain((prefix,), rendered_thread.iter_text(message_ids), (suffix,)))
+
+_rendered_threads = collections.OrderedDict() # id(messages) -> RenderedThread, most recently used last
+_rendered_threads_lock = threading.Lock()
+_rendered_threads_max = RENDERED_THREAD_MEMO_SIZE
+
+def configure_rendered_thread_memo(size):
+    """Sets how many recently used thread renderings render_thread keeps (at least RENDERED_THREAD_MEMO_SIZE)."""
+    global _rendered_threads_max
+    _rendered_threads_max = max(RENDERED_THREAD_MEMO_SIZE, size)
+
+def render_thread(messages):
+    """Returns the RenderedThread for a message list, rendering it only the first time the list is seen.
+
+    Message lists are treated as immutable once rendered, as they are after scraping or loading from cache.
+    The few most recently used renderings are kept.
+    """
+    key = id(messages)
+    with _rendered_threads_lock:
+        rendered = _rendered_threads.get(key)
+        if rendered is not None and rendered.messages is messages:
+            _rendered_threads.move_to_end(key)
+            return rendered
+    rendered = RenderedThread(messages)
+    with _rendered_threads_lock:
+        _rendered_threads[key] = rendered
+        while len(_rendered_threads) > _rendered_threads_max:
+            _rendered_threads.popitem(last=False)
+    return rendered
+
+# --- Message Compaction ---
+def compact_thread_messages(messages, duplicate_threshold=DEFAULT_DUPLICATE_THRESHOLD):
+    """Compacts a thread's messages for prompting (see compaction.py) and reports the estimated tokens saved.
+
+    Returns (compacted messages, report), where the report holds the compaction counts and the
+    locally estimated prompt tokens of the thread before and after.
+    """
+    with metrics.timed("compaction_seconds"):
+        compacted, stats = compact_messages(messages, duplicate_threshold)
+    tokens_before = RenderedThread(messages).total_tokens # Not memoized: only the compacted thread is prompted with
+    tokens_after = render_thread(compacted).total_tokens
+    metrics.increment("compaction_tokens_saved", tokens_before - tokens_after)
+    saved_percent = (tokens_before - tokens_after) / tokens_before * 100 if tokens_before else 0.0
+    print(f"{Fore.BLUE}Compacted {stats.messages_in} messages to {stats.messages_out}: {stats.quotes_stripped} quote(s) shortened to references, "
+          f"{stats.trivial_dropped} trivial post(s) dropped, {stats.duplicates_collapsed} near-duplicate(s) collapsed. "
+          f"~{tokens_before} -> ~{tokens_after} tokens ({saved_percent:.1f}% saved).{Fore.RESET}")
+    return compacted, {**stats.to_dict(), "tokens_before": tokens_before, "tokens_after": tokens_after}
 
 # --- Summarizer ---
-def summarize_text_with_gemini(text_to_summarize, keywords=None, model_name="models/gemini-2.0-flash"): 
-    """Summarizes the given text (list of message dicts) using the Gemini API, optionally focusing on keywords."""
+DEFAULT_CHUNK_TOKENS = 100000
+DEFAULT_LLM_CONCURRENCY = 4
+SUMMARY_MODES = ('auto', 'single', 'chunked')
+
+def chunk_messages(rendered_thread, max_tokens):
+    """Splits a rendered thread, in thread (date) order, into chunks of at most max_tokens each.
+
+    Returns each chunk as a range of message indexes; its text is only rendered when its prompt is built.
+    Token counts are estimated locally. A single message larger than max_tokens gets a chunk of its own.
+    """
+    chunks = []
+    chunk_start, current_tokens = 0, 0
+    for message_id, message_tokens in enumerate(rendered_thread.message_tokens):
+        if message_id > chunk_start and current_tokens + message_tokens > max_tokens:
+            chunks.append(range(chunk_start, message_id))
+            chunk_start, current_tokens = message_id, 0
+        current_tokens += message_tokens
+    if chunk_start < len(rendered_thread.message_tokens):
+        chunks.append(range(chunk_start, len(rendered_thread.message_tokens)))
+    return chunks
+
+def generate_concurrently(model, model_name, items, build_prompt_for, max_concurrency):
+    """Runs generate_text on the prompt built for each item, with at most max_concurrency calls in flight.
+
+    Each prompt is built just before its request, so at most max_concurrency prompts are held at once.
+    Returns the texts in item order.
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(items)))) as executor:
+        return list(executor.map(lambda item: generate_text(model, model_name, build_prompt_for(item)), items))
+
+def build_chunk_summary_prompt(rendered_thread, message_ids, chunk_index, chunk_count, keywords=None):
+    """Builds the map-step prompt summarizing one chunk of a thread."""
+    current_date_str = datetime.date.today().strftime('%Y-%m-%d')
+    prompt_parts = [
+        f"Please summarize part {chunk_index} of {chunk_count} of the following forum discussion thread. Each message includes its posting date. The current date is {current_date_str}.",
+        "Consider the dates of the messages to identify the most current information and highlight if some points are outdated.",
+        "Extract the key points, main questions, and any conclusions or consensus reached by the users, keeping the dates they refer to. This partial summary will be combined with the summaries of the other parts."
+    ]
+    if keywords:
+        prompt_parts.append(f"Pay special attention to topics related to: {', '.join(keywords)}.")
+    prompt_parts.append("The thread is from Technofino:\\n\\n")
+    return build_prompt("\\n".join(prompt_parts), rendered_thread, f"\\n\\nSummary of part {chunk_index}:", message_ids)
+
+def build_reduce_prompt(partial_summaries, keywords=None):
+    """Builds the reduce-step prompt combining consecutive partial summaries into one summary."""
+    current_date_str = datetime.date.today().strftime('%Y-%m-%d')
+    prompt_parts = [
+        f"The following are summaries of consecutive parts of a forum discussion thread, in chronological order. The current date is {current_date_str}.",
+        "Combine them into a single summary of the whole discussion. Where later parts update or contradict earlier ones, prefer the more recent information and highlight if some points are outdated.",
+        "Extract the key points, main questions, and any conclusions or consensus reached by the users, noting the recency of information."
+    ]
+    if keywords:
+        prompt_parts.append(f"Pay special attention to topics related to: {', '.join(keywords)}.")
+    joined_summaries = MESSAGE_SEPARATOR.join(f"Part {index}:\\n{summary}" for index, summary in enumerate(partial_summaries, start=1))
+    prompt_parts.append(f"The thread is from Technofino:\\n\\n{joined_summaries}\\n\\nSummary:")
+    return "\\n".join(prompt_parts)
+
+def summarize_in_chunks(messages, keywords, model, model_name, chunk_tokens=DEFAULT_CHUNK_TOKENS, max_concurrency=DEFAULT_LLM_CONCURRENCY, on_chunk=None):
+    """Map-reduce summarization: summarizes token-budgeted chunks concurrently, then reduces the partial summaries.
+
+    Partial summaries that together exceed chunk_tokens are reduced in groups, level by level, until one summary remains.
+    Only the request producing the final summary is streamed to on_chunk.
+    """
+    rendered_thread = render_thread(messages)
+    chunks = chunk_messages(rendered_thread, chunk_tokens)
+    print(f"{Fore.BLUE}Summarizing {len(chunks)} chunk(s) of up to ~{chunk_tokens} tokens, {max_concurrency} at a time...{Fore.RESET}")
+    build_chunk_prompt = lambda indexed_chunk: build_chunk_summary_prompt(rendered_thread, indexed_chunk[1], indexed_chunk[0], len(chunks), keywords)
+    indexed_chunks = list(enumerate(chunks, start=1))
+    if len(indexed_chunks) == 1:
+        return generate_text(model, model_name, build_chunk_prompt(indexed_chunks[0]), on_chunk)
+    summaries = generate_concurrently(model, model_name, indexed_chunks, build_chunk_prompt, max_concurrency)
+
+    while len(summaries) > 1:
+        groups, current_group, current_tokens = [], [], 0
+        for summary in summaries:
+            summary_tokens = estimate_tokens_locally(summary)
+            # Always combine at least two summaries per group so every level makes progress
+            if len(current_group) >= 2 and current_tokens + summary_tokens > chunk_tokens:
+                groups.append(current_group)
+                current_group, current_tokens = [], 0
+            current_group.append(summary)
+            current_tokens += summary_tokens
+        groups.append(current_group)
+        print(f"{Fore.BLUE}Combining {len(summaries)} partial summaries in {len(groups)} group(s)...{Fore.RESET}")
+        if len(groups) == 1:
+            return generate_text(model, model_name, build_reduce_prompt(groups[0], keywords), on_chunk)
+        summaries = generate_concurrently(model, model_name, groups, lambda group: build_reduce_prompt(group, keywords), max_concurrency)
+    return summaries[0]
+
+def generate_summary(messages, keywords, model, model_name, mode='single',
+                     chunk_tokens=DEFAULT_CHUNK_TOKENS, max_concurrency=DEFAULT_LLM_CONCURRENCY, on_chunk=None):
+    """Summarizes a non-empty list of message dicts with the given model, streaming to on_chunk if given. Errors from the API are raised."""
+    rendered_thread = render_thread(messages)
+    if mode == 'auto':
+        mode = 'chunked' if rendered_thread.total_tokens > chunk_tokens else 'single'
+    if mode == 'chunked':
+        return summarize_in_chunks(messages, keywords, model, model_name, chunk_tokens, max_concurrency, on_chunk)
+
+    current_date_str = datetime.date.today().strftime('%Y-%m-%d')
+    prompt_parts = [
+        f"Please summarize the following forum discussion thread. Each message includes its posting date. The current date is {current_date_str}.",
+        "Consider the dates of the messages to identify the most current information and highlight if some points are outdated.",
+        "Extract the key points, main questions, and any conclusions or consensus reached by the users, noting the recency of information."
+    ]
+    if keywords:
+        prompt_parts.append(f"Pay special attention to topics related to: {', '.join(keywords)}.")
+    
+    prompt_parts.append("The thread is from Technofino:\\n\\n")
+    prompt = build_prompt("\\n".join(prompt_parts), rendered_thread, "\\n\\nSummary:") # MODIFIED: \\n
+    
+    return generate_text(model, model_name, prompt, on_chunk)
+
+def summarize_text_with_gemini(text_to_summarize, keywords=None, model_name="models/gemini-2.0-flash", mode='single',
+                               chunk_tokens=DEFAULT_CHUNK_TOKENS, max_concurrency=DEFAULT_LLM_CONCURRENCY, model=None, on_chunk=None):
+    """Summarizes the given text (list of message dicts) using the Gemini API, optionally focusing on keywords.
+
+    mode 'chunked' uses map-reduce summarization (summarize_in_chunks); 'auto' does so only when the
+    thread's locally estimated size exceeds chunk_tokens. `model` can be any object with a
+    generate_content(prompt) method returning a response with .text (e.g. a stub when running offline).
+    With on_chunk, the summary is streamed to it as it is generated (see generate_text).
+    """
     if not text_to_summarize:
         return f"{Fore.YELLOW}No text provided to summarize.{Fore.RESET}"
 
-    model = genai.GenerativeModel(model_name)
+    model = model or get_genai().GenerativeModel(model_name)
     try:
-        formatted_messages = []
-        for msg_dict in text_to_summarize:
-            date_info = msg_dict.get('date', 'Unknown date')
-            content_info = msg_dict.get('content', '')
-            try:
-                if date_info.endswith('Z'): # Handle UTC 'Z'
-                    dt_object = datetime.datetime.fromisoformat(date_info[:-1] + '+00:00')
-                else:
-                    dt_object = datetime.datetime.fromisoformat(date_info)
-                standardized_date_str = dt_object.strftime("%Y-%m-%d %H:%M %Z%z")
-            except (ValueError, TypeError):
-                standardized_date_str = date_info # Fallback
-            formatted_messages.append(f"Date: {standardized_date_str}\\nMessage: {content_info}") # MODIFIED: \n
-        full_text = "\\n\\n---\\n\\n".join(formatted_messages) # MODIFIED: \n\n---\n\n
-        
-        current_date_str = datetime.date.today().strftime('%Y-%m-%d')
-        prompt_parts = [
-            f"Please summarize the following forum discussion thread. Each message includes its posting date. The current date is {current_date_str}.",
-            "Consider the dates of the messages to identify the most current information and highlight if some points are outdated.",
-            "Extract the key points, main questions, and any conclusions or consensus reached by the users, noting the recency of information."
-        ]
-        if keywords:
-            prompt_parts.append(f"Pay special attention to topics related to: {', '.join(keywords)}.")
-        
-        prompt_parts.append(f"The thread is from Technofino:\\n\\n{full_text}\\n\\nSummary:") # MODIFIED: \n\n{full_text}\n\n
-        prompt = "\\n".join(prompt_parts) # MODIFIED: \\n
-        
-        response = model.generate_content(prompt)
-        return response.text
+        return generate_summary(text_to_summarize, keywords, model, model_name, mode, chunk_tokens, max_concurrency, on_chunk)
     except Exception as e:
         return f"{Fore.RED}An error occurred during summarization: {e}{Fore.RESET}"
 
@@ -309,97 +1370,607 @@ def estimate_token_count(text_data, model_name="models/gemini-2.0-flash"):
     if not text_data:
         return 0, f"{Fore.YELLOW}No text data to count tokens for.{Fore.RESET}"
     
-    model = genai.GenerativeModel(model_name)
+    model = get_genai().GenerativeModel(model_name)
     try:
-        formatted_messages = []
-        for msg_dict in text_data:
-            date_info = msg_dict.get('date', 'Unknown date')
-            content_info = msg_dict.get('content', '')
-            try:
-                if date_info.endswith('Z'):
-                    dt_object = datetime.datetime.fromisoformat(date_info[:-1] + '+00:00')
-                else:
-                    dt_object = datetime.datetime.fromisoformat(date_info)
-                standardized_date_str = dt_object.strftime("%Y-%m-%d %H:%M %Z%z")
-            except (ValueError, TypeError):
-                standardized_date_str = date_info
-            formatted_messages.append(f"Date: {standardized_date_str}\\nMessage: {content_info}") # MODIFIED: \n
-        full_text = "\\n\\n---\\n\\n".join(formatted_messages) # MODIFIED: \n\n---\n\n
-        
         current_date_str = datetime.date.today().strftime('%Y-%m-%d')
         prompt_for_counting = [
             f"Please summarize the following forum discussion thread. Each message includes its posting date. The current date is {current_date_str}.",
             "Consider the dates of the messages to identify the most current information and highlight if some points are outdated.",
-            f"The thread is from Technofino:\\n\\n{full_text}\\n\\nSummary:" # MODIFIED: \n\n{full_text}\n\n
+            "The thread is from Technofino:\\n\\n"
         ]
-        content_to_count = "\\n".join(prompt_for_counting) # MODIFIED: \\n
+        content_to_count = build_prompt("\\n".join(prompt_for_counting), render_thread(text_data), "\\n\\nSummary:") # MODIFIED: \\n
         
         response = model.count_tokens(content_to_count)
         return response.total_tokens, None
     except Exception as e:
         return 0, f"{Fore.RED}An error occurred during token count estimation: {e}{Fore.RESET}"
 
-def answer_question_with_gemini(thread_messages, question, model_name="models/gemini-2.0-flash"):
-    """Answers a question based on the provided thread messages (list of dicts) using the Gemini API."""
+# --- Q&A Retrieval ---
+DEFAULT_QNA_MAX_TOKENS = 30000
+DEFAULT_QNA_TOP_K = 40
+DEFAULT_QNA_RECENT = 10
+
+def get_index_filepath(cache_filepath):
+    """Returns the path of the retrieval index stored next to a thread's cache file."""
+    return cache_filepath.with_suffix('.index.json')
+
+def load_or_build_retrieval_index(messages, index_filepath=None):
+    """Loads the thread's persisted BM25 index if it matches the messages, otherwise builds (and persists) it."""
+    fingerprint = messages_fingerprint(messages)
+    if index_filepath is not None:
+        index = load_index(index_filepath, fingerprint)
+        if index is not None:
+            print(f"{Fore.GREEN}Loaded Q&A retrieval index from {index_filepath}{Fore.RESET}")
+            return index
+    index = BM25Index.build([msg_dict.get('content', '') for msg_dict in messages], fingerprint)
+    if index_filepath is not None and save_index(index_filepath, index):
+        print(f"{Fore.GREEN}Q&A retrieval index saved to {index_filepath}{Fore.RESET}")
+        record_retrieval_index(index_filepath)
+    return index
+
+def generate_answer(thread_messages, question, model, model_name, retrieval_index=None,
+                    max_context_tokens=DEFAULT_QNA_MAX_TOKENS, top_k=DEFAULT_QNA_TOP_K, recent_count=DEFAULT_QNA_RECENT, on_chunk=None):
+    """Answers a question about a non-empty list of message dicts with the given model, streaming to on_chunk if given. Errors from the API are raised."""
+    rendered_thread = render_thread(thread_messages)
+    if retrieval_index is not None:
+        message_ids = select_relevant_message_ids(retrieval_index, question, rendered_thread.message_tokens, max_context_tokens, top_k, recent_count)
+        context_description = "Context from the thread: the messages most relevant to the question plus the most recent ones, in thread order (includes message dates):"
+    else:
+        message_ids = None
+        context_description = "Context from the thread (includes message dates):"
+    
+    current_date_str = datetime.date.today().strftime('%Y-%m-%d') # This line is fine, but prompt uses datetime.datetime.now()
+    prompt = build_prompt(
+        f"Current date: {datetime.datetime.now().strftime('%Y-%m-%d')}.\\n\\n" # MODIFIED: .\n\n
+        f"Consider the posting dates of the messages when answering. More recent information is generally more relevant. If the information might be outdated, please say so.\\n\\n" # MODIFIED: .\n\n
+        f"{context_description}\\n", # MODIFIED: :\n
+        rendered_thread,
+        f"\\n\\n"
+        f"Based on the above, please answer the question: \"{question}\". "
+        f"If the answer is not found in the provided messages, say so. "
+        f"If the question is subjective or opinion-based, acknowledge that.",
+        message_ids,
+    )
+    
+    return generate_text(model, model_name, prompt, on_chunk)
+
+def answer_question_with_gemini(thread_messages, question, model_name="models/gemini-2.0-flash", retrieval_index=None,
+                                max_context_tokens=DEFAULT_QNA_MAX_TOKENS, top_k=DEFAULT_QNA_TOP_K, recent_count=DEFAULT_QNA_RECENT, model=None, on_chunk=None):
+    """Answers a question based on the provided thread messages (list of dicts) using the Gemini API.
+
+    With a retrieval_index (built over thread_messages), only the top_k messages most relevant to the
+    question plus the recent_count latest ones are sent, within max_context_tokens.
+    With on_chunk, the answer is streamed to it as it is generated.
+    """
     if not thread_messages:
         return f"{Fore.YELLOW}No thread content available to answer questions.{Fore.RESET}"
     if not question:
         return f"{Fore.YELLOW}No question provided.{Fore.RESET}"
 
-    model = genai.GenerativeModel(model_name)
+    model = model or get_genai().GenerativeModel(model_name)
     try:
-        formatted_messages = []
-        for msg_dict in thread_messages:
-            date_info = msg_dict.get('date', 'Unknown date')
-            content_info = msg_dict.get('content', '')
-            try:
-                if date_info.endswith('Z'):
-                    dt_object = datetime.datetime.fromisoformat(date_info[:-1] + '+00:00')
-                else:
-                    dt_object = datetime.datetime.fromisoformat(date_info)
-                standardized_date_str = dt_object.strftime("%Y-%m-%d %H:%M %Z%z")
-            except (ValueError, TypeError):
-                standardized_date_str = date_info
-            formatted_messages.append(f"Date: {standardized_date_str}\\nMessage: {content_info}") # MODIFIED: \n
-        full_text = "\\\\n\\\\n---\\\\n\\\\n".join(formatted_messages) # MODIFIED: \n\n---\n\n
-        
-        current_date_str = datetime.date.today().strftime('%Y-%m-%d') # This line is fine, but prompt uses datetime.datetime.now()
-        prompt = (
-            f"Current date: {datetime.datetime.now().strftime('%Y-%m-%d')}.\\n\\n" # MODIFIED: .\n\n
-            f"Consider the posting dates of the messages when answering. More recent information is generally more relevant. If the information might be outdated, please say so.\\n\\n" # MODIFIED: .\n\n
-            f"Context from the thread (includes message dates):\\n" # MODIFIED: :\n
-            f"{full_text}\\n\\n"  # MODIFIED: {full_text}\n\n (was {formatted_messages_for_prompt})
-            f"Based on the above, please answer the question: \"{question}\". "
-            f"If the answer is not found in the provided messages, say so. "
-            f"If the question is subjective or opinion-based, acknowledge that."
-        )
-        
-        response = model.generate_content(prompt)
-        return response.text
+        return generate_answer(thread_messages, question, model, model_name, retrieval_index, max_context_tokens, top_k, recent_count, on_chunk)
     except Exception as e:
         return f"{Fore.RED}An error occurred while trying to answer the question: {e}{Fore.RESET}"
 
+# --- Output ---
+def open_summary_output(output_path, output_format, thread_url, keywords=None):
+    """Opens the summary output file for writing, starting it with the Markdown header for the 'md' format."""
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    f = open(output_path, 'w', encoding='utf-8')
+    if output_format == 'md':
+        f.write(f"# Summary of: {thread_url}\\n\\n")
+        if keywords:
+            f.write(f"**Keywords focused:** {', '.join(keywords)}\\n\\n")
+    return f
+
+def write_metrics_report(destination, metrics_format='json'):
+    """Writes the collected metrics as JSON or Prometheus text to a file, or to stdout when destination is '-'."""
+    registry = metrics.get_metrics()
+    report = registry.to_prometheus() if metrics_format == 'prometheus' else registry.to_json() + "\n"
+    if destination == '-':
+        print(report, end='')
+        return
+    try:
+        metrics_path = Path(destination)
+        metrics_path.parent.mkdir(parents=True, exist_ok=True)
+        metrics_path.write_text(report, encoding='utf-8')
+        print(f"{Fore.GREEN}Metrics saved to: {metrics_path}{Fore.RESET}")
+    except IOError as e:
+        print(f"{Fore.RED}Error saving metrics to file: {e}{Fore.RESET}")
+
+# --- Batch Mode ---
+DEFAULT_BATCH_OUTPUT_DIR = Path("batch_output")
+DEFAULT_BATCH_FETCH_WORKERS = 4
+BATCH_RESULTS_FILENAME = "results.jsonl"
+
+def read_batch_urls(source):
+    """Reads thread URLs, one per line, from a file or from stdin when source is '-'. Blank lines and '#' comments are skipped."""
+    if source == '-':
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(source, 'r', encoding='utf-8') as f:
+            lines = f.read().splitlines()
+    return [line.strip() for line in lines if line.strip() and not line.strip().startswith('#')]
+
+def load_completed_batch_urls(results_filepath):
+    """Returns the canonical URLs of threads already summarized successfully in an earlier (possibly interrupted) run."""
+    completed = set()
+    if results_filepath.exists():
+        with open(results_filepath, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError: # A line torn by a crash; that thread is simply processed again
+                    continue
+                if record.get("status") == "ok":
+                    completed.add(record.get("canonical_url"))
+    return completed
+
+class BatchResultWriter:
+    """Thread-safe appender of one JSON line per finished thread, synced to disk so a crashed run can resume."""
+    def __init__(self, results_filepath):
+        results_filepath.parent.mkdir(parents=True, exist_ok=True)
+        needs_newline = False
+        if results_filepath.exists() and results_filepath.stat().st_size:
+            with open(results_filepath, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                needs_newline = f.read(1) != b'\n' # Terminate a line torn by a crash before appending
+        self.lock = threading.Lock()
+        self.file = open(results_filepath, 'a', encoding='utf-8')
+        if needs_newline:
+            self.file.write('\n')
+
+    def write(self, record):
+        with self.lock:
+            self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+def run_batch(thread_urls, output_dir, keywords=None, model_name="models/gemini-2.0-flash", summary_mode='auto',
+              chunk_tokens=DEFAULT_CHUNK_TOKENS, llm_concurrency=DEFAULT_LLM_CONCURRENCY, fetch_workers=DEFAULT_BATCH_FETCH_WORKERS,
+              use_cache=True, cache_dir=DEFAULT_CACHE_DIR, cache_expiry_days=DEFAULT_CACHE_EXPIRY_DAYS, force_refresh=False, model=None,
+              compact=True, duplicate_threshold=DEFAULT_DUPLICATE_THRESHOLD):
+    """Scrapes and summarizes many threads in one pipeline, appending one JSON line per thread to output_dir/results.jsonl.
+
+    Up to fetch_workers threads are scraped at once, their page requests sharing the page fetcher's
+    connection and rate limits. Each scraped thread goes straight to a summarization pool, so Gemini
+    calls (bounded process-wide by configure_llm_concurrency) overlap with scraping of the others.
+    Threads already summarized in results.jsonl are skipped, so an interrupted run can be restarted as is.
+    With compact, messages are compacted before summarizing and each result records the tokens saved.
+    Returns a Counter of "ok", "error" and "skipped" threads.
+    """
+    results_filepath = output_dir / BATCH_RESULTS_FILENAME
+    completed = load_completed_batch_urls(results_filepath)
+    counts = collections.Counter()
+    pending, seen = [], set()
+    for thread_url in thread_urls:
+        canonical_url = get_canonical_url(thread_url)
+        if canonical_url in seen:
+            continue
+        seen.add(canonical_url)
+        if canonical_url in completed:
+            counts["skipped"] += 1
+        else:
+            pending.append((thread_url, canonical_url))
+    print(f"{Fore.BLUE}Batch: {len(pending)} thread(s) to summarize, {counts['skipped']} already done in {results_filepath}.{Fore.RESET}")
+    if not pending:
+        return counts
+
+    model = model or get_genai().GenerativeModel(model_name)
+    writer = BatchResultWriter(results_filepath)
+    counts_lock = threading.Lock()
+
+    def write_result(thread_url, canonical_url, status, message_count=0, summary=None, error=None, compaction=None):
+        writer.write({
+            "url": thread_url,
+            "canonical_url": canonical_url,
+            "status": status,
+            "message_count": message_count,
+            "keywords": keywords,
+            "summary": summary,
+            "error": error,
+            "compaction": compaction,
+            "completed_at": datetime.datetime.now().isoformat(),
+        })
+        with counts_lock:
+            counts[status] += 1
+            finished = counts["ok"] + counts["error"]
+        color = Fore.GREEN if status == "ok" else Fore.RED
+        print(f"{color}Batch [{finished}/{len(pending)}] {status}: {thread_url}{Fore.RESET}")
+
+    def scrape(thread_url):
+        with metrics.stage("scrape"):
+            return get_all_messages_from_thread(thread_url, use_cache, cache_dir, cache_expiry_days, force_refresh)
+
+    def summarize(thread_url, canonical_url, messages):
+        compaction_report = None
+        try:
+            prompt_messages = messages
+            if compact:
+                with metrics.stage("compact"):
+                    prompt_messages, compaction_report = compact_thread_messages(messages, duplicate_threshold)
+            with metrics.stage("summarize"):
+                summary = generate_summary(prompt_messages, keywords, model, model_name, summary_mode, chunk_tokens, llm_concurrency)
+        except Exception as e:
+            write_result(thread_url, canonical_url, "error", len(messages), error=f"Summarization failed: {e}", compaction=compaction_report)
+        else:
+            write_result(thread_url, canonical_url, "ok", len(messages), summary=summary, compaction=compaction_report)
+
+    summarize_futures = {}
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, llm_concurrency)) as summarize_pool:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, fetch_workers)) as scrape_pool:
+                scrape_futures = {
+                    scrape_pool.submit(scrape, thread_url): (thread_url, canonical_url)
+                    for thread_url, canonical_url in pending
+                }
+                for future in concurrent.futures.as_completed(scrape_futures):
+                    thread_url, canonical_url = scrape_futures[future]
+                    try:
+                        messages = future.result()
+                    except Exception as e: # Includes MissingPagesError: an incomplete thread is not summarized
+                        write_result(thread_url, canonical_url, "error", error=str(e))
+                        continue
+                    if not messages:
+                        write_result(thread_url, canonical_url, "error", error="No messages were found in the thread.")
+                        continue
+                    summarize_futures[summarize_pool.submit(summarize, thread_url, canonical_url, messages)] = thread_url
+        for future, thread_url in summarize_futures.items():
+            try:
+                future.result()
+            except Exception as e: # e.g. the result could not be written; the thread is neither "ok" nor recorded
+                with counts_lock:
+                    counts["error"] += 1
+                print(f"{Fore.RED}Batch: could not record the result for {thread_url}: {e}{Fore.RESET}")
+    finally:
+        writer.close()
+    return counts
+
+# --- Server Mode ---
+DEFAULT_SERVER_HOST = "127.0.0.1"
+DEFAULT_SERVER_PORT = 8765
+DEFAULT_SERVER_MAX_THREADS = 32
+MAX_REQUEST_BODY_BYTES = 64 * 1024
+
+class ApiError(Exception):
+    """An error reported to the API client with the given HTTP status."""
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+class SingleFlight:
+    """Runs at most one call per key at a time; callers arriving while it runs wait for and share its result (or exception)."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {} # key -> Future of the call in flight
+
+    def run(self, key, function, join=True):
+        """Returns (result, whether it came from another caller's call).
+
+        With join=False, a call already in flight is waited for but not shared: the caller then makes
+        its own call (e.g. a refresh, which needs data fetched after it was asked for).
+        """
+        while True:
+            with self.lock:
+                future = self.calls.get(key)
+                if future is None:
+                    future = self.calls[key] = concurrent.futures.Future()
+                    break
+            if join:
+                return future.result(), True
+            concurrent.futures.wait([future])
+        try:
+            result = function()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self.lock:
+                del self.calls[key]
+
+class ServedThread:
+    """A thread kept warm by the server: its (compacted) messages and, once a question needs it, its retrieval index."""
+    def __init__(self, canonical_url, message_count, messages, compaction_report=None):
+        self.canonical_url = canonical_url
+        self.message_count = message_count # Before compaction
+        self.messages = messages
+        self.compaction = compaction_report
+        self.loaded_at = time.time()
+        self.retrieval_index = None
+        self.index_lock = threading.Lock()
+
+class ThreadStore:
+    """In-memory LRU of recently used threads on top of the disk cache.
+
+    Concurrent requests for a thread that is not in memory (or has expired, or is being refreshed)
+    are coalesced into a single scrape or cache load, whose result they all share.
+    """
+    def __init__(self, max_threads=DEFAULT_SERVER_MAX_THREADS, use_cache=True, cache_dir=DEFAULT_CACHE_DIR,
+                 cache_expiry_days=DEFAULT_CACHE_EXPIRY_DAYS, compact=True, duplicate_threshold=DEFAULT_DUPLICATE_THRESHOLD):
+        self.max_threads = max(1, max_threads)
+        self.use_cache = use_cache
+        self.cache_dir = cache_dir
+        self.cache_expiry_days = cache_expiry_days
+        self.compact = compact
+        self.duplicate_threshold = duplicate_threshold
+        self.threads = collections.OrderedDict() # canonical URL -> ServedThread, most recently used last
+        self.lock = threading.Lock()
+        self.loads = SingleFlight()
+        self.counts = collections.Counter()
+
+    def get(self, thread_url, force_refresh=False):
+        """Returns the ServedThread for a thread URL, loading it unless a fresh copy is in memory."""
+        canonical_url = get_canonical_url(thread_url)
+        with self.lock:
+            served = self.threads.get(canonical_url)
+            if served is not None and not force_refresh and time.time() - served.loaded_at < self.cache_expiry_days * 86400:
+                self.threads.move_to_end(canonical_url)
+                self.counts["hits"] += 1
+                metrics.increment("server_thread_hits")
+                return served
+            self.counts["misses"] += 1
+        metrics.increment("server_thread_misses")
+        # A refresh must not share a load that started before it; later loads share the refresh instead
+        served, coalesced = self.loads.run(canonical_url, lambda: self.load(canonical_url, force_refresh), join=not force_refresh)
+        if coalesced:
+            with self.lock:
+                self.counts["coalesced"] += 1
+            metrics.increment("server_coalesced_loads")
+        return served
+
+    def load(self, canonical_url, force_refresh=False):
+        with metrics.stage("scrape"):
+            messages = get_all_messages_from_thread(canonical_url, self.use_cache, self.cache_dir, self.cache_expiry_days, force_refresh)
+        if not messages:
+            raise ApiError(404, "No messages were found in the thread.")
+        message_count, compaction_report = len(messages), None
+        if self.compact:
+            with metrics.stage("compact"):
+                messages, compaction_report = compact_thread_messages(messages, self.duplicate_threshold)
+        render_thread(messages) # Token estimates are ready before the first prompt is built
+        served = ServedThread(canonical_url, message_count, messages, compaction_report)
+        with self.lock:
+            self.threads[canonical_url] = served
+            self.threads.move_to_end(canonical_url)
+            while len(self.threads) > self.max_threads:
+                self.threads.popitem(last=False)
+            self.counts["loads"] += 1
+        return served
+
+    def stats(self):
+        with self.lock:
+            return {
+                "threads": [{"url": served.canonical_url, "message_count": served.message_count, "prompt_message_count": len(served.messages),
+                             "loaded_at": datetime.datetime.fromtimestamp(served.loaded_at).isoformat(timespec='seconds')}
+                            for served in reversed(self.threads.values())],
+                "max_threads": self.max_threads,
+                **{name: self.counts[name] for name in ("hits", "misses", "coalesced", "loads")},
+            }
+
+class ThreadService:
+    """The server's summarize, ask, refresh and status operations, shared by all client connections.
+
+    Each operation takes the request's JSON object and returns the JSON-serializable response.
+    """
+    def __init__(self, store, model, model_name="models/gemini-2.0-flash", keywords=None, summary_mode='auto', chunk_tokens=DEFAULT_CHUNK_TOKENS,
+                 llm_concurrency=DEFAULT_LLM_CONCURRENCY, qna_max_tokens=DEFAULT_QNA_MAX_TOKENS, qna_top_k=DEFAULT_QNA_TOP_K,
+                 qna_recent=DEFAULT_QNA_RECENT, qna_full_context=False):
+        self.store = store
+        self.model = model
+        self.model_name = model_name
+        self.keywords = keywords
+        self.summary_mode = summary_mode
+        self.chunk_tokens = chunk_tokens
+        self.llm_concurrency = llm_concurrency
+        self.qna_max_tokens = qna_max_tokens
+        self.qna_top_k = qna_top_k
+        self.qna_recent = qna_recent
+        self.qna_full_context = qna_full_context
+        self.summaries = SingleFlight()
+
+    @staticmethod
+    def required_string(payload, name):
+        value = payload.get(name)
+        if not isinstance(value, str) or not value.strip():
+            raise ApiError(400, f"'{name}' must be a non-empty string.")
+        return value.strip()
+
+    def summarize(self, payload):
+        served = self.store.get(self.required_string(payload, "url"))
+        keywords = payload.get("keywords", self.keywords)
+        if isinstance(keywords, str):
+            keywords = [k.strip() for k in keywords.split(',') if k.strip()]
+        if keywords is not None and not (isinstance(keywords, list) and all(isinstance(k, str) for k in keywords)):
+            raise ApiError(400, "'keywords' must be a list of strings or a comma-separated string.")
+        mode = payload.get("summary_mode", self.summary_mode)
+        if mode not in SUMMARY_MODES:
+            raise ApiError(400, f"'summary_mode' must be one of: {', '.join(SUMMARY_MODES)}.")
+        # Identical concurrent requests share one Gemini call; later ones hit the response cache
+        summary, _ = self.summaries.run(
+            (served, tuple(keywords or ()), mode),
+            lambda: generate_summary(served.messages, keywords or None, self.model, self.model_name, mode, self.chunk_tokens, self.llm_concurrency))
+        return {"url": served.canonical_url, "message_count": served.message_count, "compaction": served.compaction, "summary": summary}
+
+    def get_retrieval_index(self, served):
+        """Returns the thread's retrieval index, building it on the first question, or None when the whole thread fits the Q&A budget."""
+        if self.qna_full_context or render_thread(served.messages).total_tokens <= self.qna_max_tokens:
+            return None
+        with served.index_lock:
+            if served.retrieval_index is None:
+                index_filepath = get_index_filepath(get_cache_filepath(served.canonical_url, self.store.cache_dir)) if self.store.use_cache else None
+                with metrics.stage("retrieval_index"):
+                    served.retrieval_index = load_or_build_retrieval_index(served.messages, index_filepath)
+            return served.retrieval_index
+
+    def ask(self, payload):
+        question = self.required_string(payload, "question")
+        served = self.store.get(self.required_string(payload, "url"))
+        retrieval_index = self.get_retrieval_index(served)
+        with metrics.stage("qna"):
+            answer = generate_answer(served.messages, question, self.model, self.model_name, retrieval_index,
+                                     self.qna_max_tokens, self.qna_top_k, self.qna_recent)
+        return {"url": served.canonical_url, "question": question, "answer": answer, "retrieval": retrieval_index is not None}
+
+    def refresh(self, payload):
+        served = self.store.get(self.required_string(payload, "url"), force_refresh=True)
+        return {"url": served.canonical_url, "message_count": served.message_count, "compaction": served.compaction}
+
+    def status(self):
+        return self.store.stats()
+
+def make_api_handler(service):
+    """Builds the HTTP request handler class serving a ThreadService as a JSON API."""
+    from http.server import BaseHTTPRequestHandler
+
+    class ThreadApiHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1" # Keep-alive, so clients can reuse their connection
+        post_routes = {"/summarize": service.summarize, "/ask": service.ask, "/refresh": service.refresh}
+
+        def send_body(self, status, body, content_type):
+            data = body.encode('utf-8')
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def send_json(self, status, obj):
+            self.send_body(status, json.dumps(obj, ensure_ascii=False) + "\n", "application/json; charset=utf-8")
+
+        def read_json(self):
+            try:
+                length = int(self.headers.get("Content-Length") or 0)
+            except ValueError:
+                length = -1
+            if not 0 <= length <= MAX_REQUEST_BODY_BYTES:
+                self.close_connection = True # The body is left unread, so the connection cannot be reused
+                raise ApiError(413 if length > 0 else 400, f"Content-Length must be between 0 and {MAX_REQUEST_BODY_BYTES} bytes.")
+            try:
+                payload = json.loads(self.rfile.read(length) or b"{}")
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                raise ApiError(400, "Request body must be a JSON object.")
+            if not isinstance(payload, dict):
+                raise ApiError(400, "Request body must be a JSON object.")
+            return payload
+
+        def do_GET(self):
+            path = self.path.split('?', 1)[0]
+            if path == "/status":
+                self.send_json(200, service.status())
+            elif path == "/metrics":
+                if metrics.get_metrics() is None:
+                    self.send_json(404, {"error": "Metrics are not enabled; start the server with --metrics."})
+                else:
+                    self.send_body(200, metrics.get_metrics().to_prometheus(), "text/plain; version=0.0.4; charset=utf-8")
+            else:
+                self.send_json(404, {"error": f"Unknown endpoint: GET {path}"})
+
+        def do_POST(self):
+            path = self.path.split('?', 1)[0]
+            operation = self.post_routes.get(path)
+            try:
+                payload = self.read_json() # Read even for unknown endpoints, so the connection stays usable
+                if operation is None:
+                    raise ApiError(404, f"Unknown endpoint: POST {path}")
+                self.send_json(200, operation(payload))
+            except ApiError as e:
+                self.send_json(e.status, {"error": str(e)})
+            except MissingPagesError as e:
+                self.send_json(502, {"error": f"{e}. Not using an incomplete thread; try again later."})
+            except Exception as e:
+                self.send_json(500, {"error": f"{type(e).__name__}: {e}"})
+
+        def log_message(self, format, *args):
+            print(f"{Fore.BLUE}[server] {self.address_string()} {format % args}{Fore.RESET}")
+
+    return ThreadApiHandler
+
+def run_server(service, host=DEFAULT_SERVER_HOST, port=DEFAULT_SERVER_PORT):
+    """Serves the ThreadService over HTTP, one thread per connection, until interrupted."""
+    from http.server import ThreadingHTTPServer
+    configure_rendered_thread_memo(service.store.max_threads)
+    server = ThreadingHTTPServer((host, port), make_api_handler(service))
+    print(f"{Fore.GREEN}Serving on http://{host}:{server.server_address[1]} (POST /summarize, /ask, /refresh; GET /status, /metrics). Press Ctrl+C to stop.{Fore.RESET}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"{Fore.BLUE}Server stopped.{Fore.RESET}")
+    finally:
+        server.server_close()
+
 # --- Main Execution --- 
 if __name__ == "__main__":
     init(autoreset=True) # Initialize colorama
 
     parser = argparse.ArgumentParser(description="Summarize a Technofino thread.")
     # Make thread_url optional at the parser level
-    parser.add_argument("thread_url", nargs='?', default=None, help="The URL of the Technofino thread to summarize. Required unless --clear-cache is used.")
+    parser.add_argument("thread_url", nargs='?', default=None, help="The URL of the Technofino thread to summarize. Required unless --clear-cache, --batch or --serve is used.")
     parser.add_argument("--debug", action="store_true", help="Enable debug mode for more verbose output.")
+    parser.add_argument("--metrics", metavar="FILE", help="Collect fetch, parse, cache, Gemini and stage metrics, and write a report to FILE ('-' for stdout) when the run ends.")
+    parser.add_argument("--metrics-format", choices=['json', 'prometheus'], default='json', help="Format of the --metrics report. Default: json.")
     
     # Arguments for output format
     parser.add_argument("--output-file", "-o", help="Path to save the summary (e.g., summary.txt or summary.md).")
     parser.add_argument("--output-format", choices=['txt', 'md'], default='txt', help="Format for the output file (txt or md). Default: txt.")
+    parser.add_argument("--stream", action="store_true", help="Print the summary and Q&A answers (and write the summary to --output-file) as Gemini generates them, instead of after the full response.")
     
     # Arguments for keyword-focused summary
     parser.add_argument("--keywords", help="Comma-separated keywords to focus the summary on (e.g., 'credit card,rewards,travel').")
 
+    # Arguments for chunked (map-reduce) summarization
+    parser.add_argument("--summary-mode", choices=SUMMARY_MODES, default='auto', help="'single' sends the whole thread in one request; 'chunked' summarizes token-budgeted chunks concurrently and then combines them; 'auto' chunks only threads larger than --chunk-tokens. Default: auto.")
+    parser.add_argument("--chunk-tokens", type=int, default=DEFAULT_CHUNK_TOKENS, help=f"Estimated token budget per chunk in chunked summarization. Default: {DEFAULT_CHUNK_TOKENS}.")
+    parser.add_argument("--llm-concurrency", type=int, default=DEFAULT_LLM_CONCURRENCY, help=f"Maximum concurrent Gemini requests. Default: {DEFAULT_LLM_CONCURRENCY}.")
+
+    # Arguments for message compaction
+    parser.add_argument("--no-compact", action="store_true", help="Send messages as scraped, without shortening quotes to references, dropping trivial posts or collapsing near-duplicates.")
+    parser.add_argument("--duplicate-threshold", type=float, default=DEFAULT_DUPLICATE_THRESHOLD, help=f"Word-trigram Jaccard similarity at or above which a post is collapsed into an earlier one. Default: {DEFAULT_DUPLICATE_THRESHOLD}.")
+
+    # Arguments for Q&A retrieval
+    parser.add_argument("--qna-max-tokens", type=int, default=DEFAULT_QNA_MAX_TOKENS, help=f"Estimated token budget for the thread context sent with each question. Threads larger than this are answered from retrieved messages. Default: {DEFAULT_QNA_MAX_TOKENS}.")
+    parser.add_argument("--qna-top-k", type=int, default=DEFAULT_QNA_TOP_K, help=f"Number of most relevant messages retrieved per question. Default: {DEFAULT_QNA_TOP_K}.")
+    parser.add_argument("--qna-recent", type=int, default=DEFAULT_QNA_RECENT, help=f"Number of latest messages always included per question. Default: {DEFAULT_QNA_RECENT}.")
+    parser.add_argument("--qna-full-context", action="store_true", help="Always send the whole thread with each question, without retrieval.")
+
     # Arguments for caching
     parser.add_argument("--cache-dir", type=Path, default=DEFAULT_CACHE_DIR, help=f"Directory to store cached thread content. Default: {DEFAULT_CACHE_DIR}")
-    parser.add_argument("--cache-expiry", type=int, default=DEFAULT_CACHE_EXPIRY_DAYS, help=f"Cache expiry in days. Default: {DEFAULT_CACHE_EXPIRY_DAYS} days.")
+    parser.add_argument("--cache-expiry", type=float, default=DEFAULT_CACHE_EXPIRY_DAYS, help=f"Cache expiry in days (fractions such as 0.5 allowed). Default: {DEFAULT_CACHE_EXPIRY_DAYS} days.")
+    parser.add_argument("--cache-max-mb", type=int, default=DEFAULT_CACHE_MAX_MB, help=f"Maximum total size of cached threads; the least recently used threads are evicted beyond it. Default: {DEFAULT_CACHE_MAX_MB} MB.")
+    parser.add_argument("--cache-retention-days", type=int, default=DEFAULT_CACHE_RETENTION_DAYS, help=f"Delete cached threads not used for this many days, even below --cache-max-mb (0 keeps them until evicted for space). Default: {DEFAULT_CACHE_RETENTION_DAYS} days.")
+    parser.add_argument("--cache-stats", action="store_true", help="Print the thread cache's size, expired entries and most recently used threads, then exit.")
+    parser.add_argument("--invalidate-cache", action="append", metavar="URL", help="Delete the cached copy of the thread at URL (repeatable), then exit.")
     parser.add_argument("--no-cache", action="store_true", help="Disable caching for this run.")
     parser.add_argument("--clear-cache", action="store_true", help="Clear all cached data from the cache directory and exit.")
+    parser.add_argument("--no-response-cache", action="store_true", help="Bypass the Gemini response cache for this run (always call the API).")
+    parser.add_argument("--response-cache-expiry", type=int, default=DEFAULT_RESPONSE_CACHE_EXPIRY_DAYS, help=f"Gemini response cache expiry in days. Default: {DEFAULT_RESPONSE_CACHE_EXPIRY_DAYS} days.")
+    parser.add_argument("--response-cache-max-mb", type=int, default=DEFAULT_RESPONSE_CACHE_MAX_MB, help=f"Maximum size of the Gemini response cache; least recently used responses are evicted beyond it. Default: {DEFAULT_RESPONSE_CACHE_MAX_MB} MB.")
+    parser.add_argument("--response-cache-stats", action="store_true", help="Print Gemini response cache statistics and exit.")
+    # Arguments for HTTP fetching
+    parser.add_argument("--max-connections", type=int, default=DEFAULT_MAX_CONNECTIONS, help=f"Maximum concurrent connections (and fetch workers) to the forum. Default: {DEFAULT_MAX_CONNECTIONS}.")
+    parser.add_argument("--rate-limit", type=float, default=DEFAULT_RATE_LIMIT, help=f"Maximum requests per second per host (0 disables the limit). Default: {DEFAULT_RATE_LIMIT}.")
+    parser.add_argument("--max-retries", type=int, default=DEFAULT_MAX_RETRIES, help=f"Retries per page on connection errors, HTTP 429 and 5xx responses. Default: {DEFAULT_MAX_RETRIES}.")
+    parser.add_argument("--engine", choices=FETCH_ENGINES, default=DEFAULT_FETCH_ENGINE, help=f"Page fetching engine: a thread pool, or asyncio (requires aiohttp). Default: {DEFAULT_FETCH_ENGINE}.")
+    parser.add_argument("--parser", choices=PARSER_BACKENDS, default='auto', help="HTML parser backend for thread pages. 'auto' uses selectolax or lxml when installed, otherwise BeautifulSoup. Default: auto.")
+    parser.add_argument("--parse-workers", type=int, default=0, help="Number of processes to parse pages in, separately from the fetching threads (0 parses in the fetching threads). Default: 0.")
+    parser.add_argument("--refresh", action="store_true", help="Refresh a cached thread now, even if it has not expired. Only pages that can have changed are re-fetched.")
+    # Arguments for batch mode
+    parser.add_argument("--batch", metavar="URL_FILE", help="Summarize every thread URL in URL_FILE (one per line; '-' reads stdin) in one run, without Q&A. Results are appended as JSON lines to --batch-output-dir; re-running skips threads already summarized.")
+    parser.add_argument("--batch-output-dir", type=Path, default=DEFAULT_BATCH_OUTPUT_DIR, help=f"Directory for batch results ({BATCH_RESULTS_FILENAME}). Default: {DEFAULT_BATCH_OUTPUT_DIR}")
+    parser.add_argument("--batch-fetch-workers", type=int, default=DEFAULT_BATCH_FETCH_WORKERS, help=f"Threads scraped at once in batch mode. Their page requests share --max-connections and --rate-limit (with --engine asyncio, --max-connections applies per thread). Default: {DEFAULT_BATCH_FETCH_WORKERS}.")
+
+    # Arguments for server mode
+    parser.add_argument("--serve", action="store_true", help="Run as a long-lived local HTTP server with summarize, ask and refresh endpoints, keeping recently used threads, the HTTP connection pool and the Gemini client warm.")
+    parser.add_argument("--host", default=DEFAULT_SERVER_HOST, help=f"Address the server listens on. Default: {DEFAULT_SERVER_HOST}.")
+    parser.add_argument("--port", type=int, default=DEFAULT_SERVER_PORT, help=f"Port the server listens on. Default: {DEFAULT_SERVER_PORT}.")
+    parser.add_argument("--server-max-threads", type=int, default=DEFAULT_SERVER_MAX_THREADS, help=f"Number of recently used threads the server keeps in memory. Default: {DEFAULT_SERVER_MAX_THREADS}.")
 
     args = parser.parse_args()
 
@@ -410,26 +1981,108 @@ if __name__ == "__main__":
         print(f"{Fore.GREEN}Cache clearing requested. Exiting.{Fore.RESET}")
         exit(0)
 
-    # If not --clear-cache, thread_url is now mandatory.
-    if not args.thread_url:
-        parser.error("thread_url is required if --clear-cache is not specified.")
+    if args.cache_stats:
+        print_cache_stats(configure_cache_index(args.cache_dir, args.cache_max_mb, args.cache_retention_days), args.cache_expiry)
+        exit(0)
+
+    if args.invalidate_cache:
+        configure_cache_index(args.cache_dir, args.cache_max_mb, args.cache_retention_days)
+        for invalidate_url in args.invalidate_cache:
+            invalidate_cached_thread(invalidate_url, args.cache_dir)
+        exit(0)
+
+    if args.response_cache_stats:
+        print_response_cache_stats(configure_response_cache(args.cache_dir, args.response_cache_expiry, args.response_cache_max_mb))
+        exit(0)
+
+    # If not --clear-cache, thread_url is now mandatory (unless URLs come from --batch, or requests from --serve).
+    if not args.thread_url and not args.batch and not args.serve:
+        parser.error("thread_url is required if --clear-cache, --batch or --serve is not specified.")
 
     if args.debug:
         # Corrected f-string for API key debug print
-        api_key_display = f"{GEMINI_API_KEY[:5]}...{GEMINI_API_KEY[-5:]}" if len(GEMINI_API_KEY) > 10 else GEMINI_API_KEY
+        api_key = resolve_gemini_api_key()
+        api_key_display = f"{api_key[:5]}...{api_key[-5:]}" if len(api_key) > 10 else api_key
         print(f"{Fore.BLUE}[DEBUG] Attempting to use API Key: {api_key_display}{Fore.RESET}")
         list_available_models()
     
+    if args.engine == 'asyncio':
+        try:
+            import aiohttp # noqa: F401 - only checking availability
+        except ImportError:
+            parser.error("--engine asyncio requires aiohttp (pip install aiohttp).")
+    try:
+        configure_parser_backend(args.parser)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.metrics: # Only once the arguments are valid, so a usage error writes no report
+        metrics.enable_metrics()
+        atexit.register(write_metrics_report, args.metrics, args.metrics_format) # Also reports runs ending in exit()
+    configure_parse_workers(args.parse_workers)
+    if not args.no_cache:
+        configure_cache_index(args.cache_dir, args.cache_max_mb, args.cache_retention_days)
+    if not args.no_cache and not args.no_response_cache:
+        configure_response_cache(args.cache_dir, args.response_cache_expiry, args.response_cache_max_mb)
+    configure_page_fetcher(max_connections=args.max_connections, rate_limit=args.rate_limit, max_retries=args.max_retries, engine=args.engine)
+    configure_llm_concurrency(args.llm_concurrency)
+
+    if args.serve:
+        thread_store = ThreadStore(
+            max_threads=args.server_max_threads, use_cache=not args.no_cache, cache_dir=args.cache_dir, cache_expiry_days=args.cache_expiry,
+            compact=not args.no_compact, duplicate_threshold=args.duplicate_threshold
+        )
+        model_name = "models/gemini-2.0-flash"
+        service = ThreadService(
+            thread_store, get_genai().GenerativeModel(model_name), model_name,
+            keywords=[k.strip() for k in args.keywords.split(',')] if args.keywords else None,
+            summary_mode=args.summary_mode, chunk_tokens=args.chunk_tokens, llm_concurrency=args.llm_concurrency,
+            qna_max_tokens=args.qna_max_tokens, qna_top_k=args.qna_top_k, qna_recent=args.qna_recent, qna_full_context=args.qna_full_context
+        )
+        try:
+            run_server(service, args.host, args.port)
+        except OSError as e:
+            parser.error(f"Cannot listen on {args.host}:{args.port}: {e}")
+        exit(0)
+
+    if args.batch:
+        try:
+            batch_urls = read_batch_urls(args.batch)
+        except OSError as e:
+            parser.error(f"Cannot read --batch URL file: {e}")
+        batch_counts = run_batch(
+            batch_urls, args.batch_output_dir,
+            keywords=[k.strip() for k in args.keywords.split(',')] if args.keywords else None,
+            summary_mode=args.summary_mode, chunk_tokens=args.chunk_tokens, llm_concurrency=args.llm_concurrency,
+            fetch_workers=args.batch_fetch_workers, use_cache=not args.no_cache, cache_dir=args.cache_dir,
+            cache_expiry_days=args.cache_expiry, force_refresh=args.refresh,
+            compact=not args.no_compact, duplicate_threshold=args.duplicate_threshold
+        )
+        print(f"{Fore.BLUE}Batch finished: {batch_counts['ok']} summarized, {batch_counts['error']} failed, {batch_counts['skipped']} already done.{Fore.RESET}")
+        if args.debug and get_response_cache() is not None:
+            print_response_cache_stats(get_response_cache())
+        exit(1 if batch_counts['error'] else 0)
+
     print(f"{Fore.BLUE}Starting to scrape messages...{Fore.RESET}")
-    messages = get_all_messages_from_thread(
-        args.thread_url,
-        use_cache=not args.no_cache,
-        cache_dir=args.cache_dir,
-        cache_expiry_days=args.cache_expiry
-    )
+    try:
+        with metrics.stage("scrape"):
+            messages = get_all_messages_from_thread(
+                args.thread_url,
+                use_cache=not args.no_cache,
+                cache_dir=args.cache_dir,
+                cache_expiry_days=args.cache_expiry,
+                force_refresh=args.refresh
+            )
+    except MissingPagesError as e:
+        print(f"{Fore.RED}{e}. Not summarizing an incomplete thread; try again later or lower --rate-limit.{Fore.RESET}")
+        exit(1)
 
     if messages:
         print(f"{Fore.GREEN}Found {len(messages)} messages (from cache or scraping). Now summarizing...{Fore.RESET}")
+
+        if not args.no_compact:
+            with metrics.stage("compact"):
+                messages, _ = compact_thread_messages(messages, args.duplicate_threshold)
         
         user_keywords = [k.strip() for k in args.keywords.split(',')] if args.keywords else None
 
@@ -440,29 +2093,46 @@ if __name__ == "__main__":
             else:
                 print(f"{Fore.BLUE}[DEBUG] Estimated token count for summarization: {token_count}{Fore.RESET}")
         
-        summary = summarize_text_with_gemini(messages, keywords=user_keywords)
-        
-        if args.output_file:
-            output_path = Path(args.output_file)
-            output_path.parent.mkdir(parents=True, exist_ok=True)
-            try:
-                with open(output_path, 'w', encoding='utf-8') as f:
-                    if args.output_format == 'md':
-                        f.write(f"# Summary of: {args.thread_url}\\n\\n")
-                        if user_keywords:
-                            f.write(f"**Keywords focused:** {', '.join(user_keywords)}\\n\\n")
-                    f.write(summary)
+        if args.stream:
+            # Chunks are printed (and written to the output file) as Gemini generates them
+            output_path = Path(args.output_file) if args.output_file else None
+            output_file = None
+            if output_path:
+                try:
+                    output_file = open_summary_output(output_path, args.output_format, args.thread_url, user_keywords)
+                except IOError as e:
+                    print(f"{Fore.RED}Error saving summary to file: {e}{Fore.RESET}")
+            print(f"{Fore.BLUE}--- Summary of the Thread ---{Fore.RESET}")
+            summary_stream = ResponseStream(output_file)
+            with metrics.stage("summarize"):
+                summary = summarize_text_with_gemini(messages, keywords=user_keywords, mode=args.summary_mode,
+                                                     chunk_tokens=args.chunk_tokens, max_concurrency=args.llm_concurrency, on_chunk=summary_stream)
+            summary_stream.finish(summary)
+            if output_file is not None:
+                output_file.close()
                 print(f"{Fore.GREEN}Summary saved to: {output_path}{Fore.RESET}")
-            except IOError as e:
-                print(f"{Fore.RED}Error saving summary to file: {e}{Fore.RESET}")
-                print(f"{Fore.BLUE}--- Summary of the Thread (Console Fallback) ---{Fore.RESET}")
-                print(summary)
         else:
-            print(f"{Fore.BLUE}--- Summary of the Thread ---{Fore.RESET}")
-            print(summary)
+            with metrics.stage("summarize"):
+                summary = summarize_text_with_gemini(messages, keywords=user_keywords, mode=args.summary_mode,
+                                                     chunk_tokens=args.chunk_tokens, max_concurrency=args.llm_concurrency)
+
+            if args.output_file:
+                output_path = Path(args.output_file)
+                try:
+                    with open_summary_output(output_path, args.output_format, args.thread_url, user_keywords) as f:
+                        f.write(summary)
+                    print(f"{Fore.GREEN}Summary saved to: {output_path}{Fore.RESET}")
+                except IOError as e:
+                    print(f"{Fore.RED}Error saving summary to file: {e}{Fore.RESET}")
+                    print(f"{Fore.BLUE}--- Summary of the Thread (Console Fallback) ---{Fore.RESET}")
+                    print(summary)
+            else:
+                print(f"{Fore.BLUE}--- Summary of the Thread ---{Fore.RESET}")
+                print(summary)
 
         # Interactive Q&A session
         if messages: # Ensure messages were loaded before starting Q&A
+            retrieval_index = None
             while True:
                 try:
                     ask_qna = input(f"{Fore.YELLOW}Do you want to ask questions about this thread? (yes/no): {Fore.RESET}").strip().lower()
@@ -470,6 +2140,13 @@ if __name__ == "__main__":
                     break
                 if ask_qna == 'yes':
                     print(f"{Fore.BLUE}Entering Q&A mode. Type 'quit' to exit.{Fore.RESET}")
+                    thread_tokens = render_thread(messages).total_tokens
+                    if not args.qna_full_context and thread_tokens > args.qna_max_tokens:
+                        # Built once per thread (and persisted next to the cache file), so each question only sends relevant messages
+                        index_filepath = None if args.no_cache else get_index_filepath(get_cache_filepath(get_canonical_url(args.thread_url), args.cache_dir))
+                        with metrics.stage("retrieval_index"):
+                            retrieval_index = load_or_build_retrieval_index(messages, index_filepath)
+                        print(f"{Fore.BLUE}Thread is ~{thread_tokens} tokens; answering from up to {args.qna_top_k} relevant and {args.qna_recent} recent messages (~{args.qna_max_tokens} tokens) per question.{Fore.RESET}")
                     while True:
                         try:
                             user_question = input(f"{Fore.CYAN}Your question: {Fore.RESET}").strip()
@@ -481,8 +2158,18 @@ if __name__ == "__main__":
                             print(f"{Fore.YELLOW}Exiting Q&A mode.{Fore.RESET}")
                             break
                         
-                        answer = answer_question_with_gemini(messages, user_question)
-                        print(f"{Fore.MAGENTA}Answer: {answer}{Fore.RESET}")
+                        if args.stream:
+                            print(f"{Fore.MAGENTA}Answer: ", end='', flush=True)
+                            answer_stream = ResponseStream(color=Fore.MAGENTA)
+                            with metrics.stage("qna"):
+                                answer = answer_question_with_gemini(messages, user_question, retrieval_index=retrieval_index, max_context_tokens=args.qna_max_tokens,
+                                                                     top_k=args.qna_top_k, recent_count=args.qna_recent, on_chunk=answer_stream)
+                            answer_stream.finish(answer)
+                        else:
+                            with metrics.stage("qna"):
+                                answer = answer_question_with_gemini(messages, user_question, retrieval_index=retrieval_index, max_context_tokens=args.qna_max_tokens,
+                                                                     top_k=args.qna_top_k, recent_count=args.qna_recent)
+                            print(f"{Fore.MAGENTA}Answer: {answer}{Fore.RESET}")
                     break # Exit Q&A loop and main program after Q&A session ends
                 elif ask_qna == 'no':
                     print(f"{Fore.YELLOW}Skipping Q&A.{Fore.RESET}")
@@ -491,3 +2178,6 @@ if __name__ == "__main__":
                     print(f"{Fore.RED}Invalid input. Please answer 'yes' or 'no'.{Fore.RESET}")
     else:
         print(f"{Fore.RED}No messages were found from the thread (or cache). Cannot summarize or start Q&A.{Fore.RESET}")
+
+    if args.debug and get_response_cache() is not None:
+        print_response_cache_stats(get_response_cache())
@@ -0,0 +1,182 @@
+"""Run metrics for the hot paths: fetches, parsing, caches, Gemini requests and pipeline stages.
+
+Instrumentation points call the module-level functions (increment, observe, timed, stage). Until
+enable_metrics() is called they return immediately, so instrumented code pays one global lookup per
+call when metrics are off. The collected metrics are reported as JSON or in the Prometheus text format.
+Memory stays bounded however long the process runs (e.g. the API server): each sampled metric keeps
+exact running totals and a fixed-size uniform sample of its values for the quantiles.
+"""
+import json
+import math
+import random
+import threading
+import time
+
+METRIC_PREFIX = "technofino_"
+REPORT_QUANTILES = (0.5, 0.9, 0.99)
+MAX_SAMPLES_PER_METRIC = 4096 # Quantiles are exact up to this many observations, then estimated from a reservoir sample
+
+class SampleSeries:
+    """Running count, sum, min and max of a metric's values, plus a reservoir sample of them (Algorithm R)."""
+    __slots__ = ('count', 'total', 'minimum', 'maximum', 'reservoir')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.minimum = None
+        self.maximum = None
+        self.reservoir = []
+
+    def add(self, value, max_samples, rng):
+        self.count += 1
+        self.total += value
+        if self.minimum is None or value < self.minimum:
+            self.minimum = value
+        if self.maximum is None or value > self.maximum:
+            self.maximum = value
+        if len(self.reservoir) < max_samples:
+            self.reservoir.append(value)
+        else:
+            slot = rng.randrange(self.count)
+            if slot < max_samples:
+                self.reservoir[slot] = value
+
+class MetricsRegistry:
+    """Thread-safe store of counters, value samples (latencies, sizes) and accumulated stage timings."""
+    def __init__(self, max_samples=MAX_SAMPLES_PER_METRIC):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.samples = {} # name -> SampleSeries
+        self.stages = {} # stage -> [count, total seconds]
+        self.max_samples = max_samples
+        self.rng = random.Random()
+        self.started = time.perf_counter()
+
+    def increment(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, name, value):
+        with self.lock:
+            series = self.samples.get(name)
+            if series is None:
+                series = self.samples[name] = SampleSeries()
+            series.add(value, self.max_samples, self.rng)
+
+    def add_stage_time(self, stage_name, seconds):
+        with self.lock:
+            totals = self.stages.setdefault(stage_name, [0, 0.0])
+            totals[0] += 1
+            totals[1] += seconds
+
+    def report(self):
+        """Returns the metrics as a JSON-serializable dict."""
+        with self.lock:
+            counters = dict(self.counters)
+            samples = {name: (series.count, series.total, series.minimum, series.maximum, list(series.reservoir)) for name, series in self.samples.items()}
+            stages = {name: {"count": count, "seconds": round(seconds, 6)} for name, (count, seconds) in self.stages.items()}
+        summaries = {}
+        for name, (count, total, minimum, maximum, values) in samples.items():
+            values.sort()
+            summaries[name] = {
+                "count": count,
+                "sum": round(total, 6),
+                "min": round(minimum, 6),
+                "max": round(maximum, 6),
+                **{f"p{int(quantile * 100)}": round(quantile_of(values, quantile), 6) for quantile in REPORT_QUANTILES},
+            }
+        return {
+            "elapsed_seconds": round(time.perf_counter() - self.started, 6),
+            "stages": stages,
+            "counters": counters,
+            "summaries": summaries,
+        }
+
+    def to_json(self):
+        return json.dumps(self.report(), indent=2, sort_keys=True)
+
+    def to_prometheus(self):
+        """Renders the metrics in the Prometheus text exposition format."""
+        report = self.report()
+        lines = [
+            f"# TYPE {METRIC_PREFIX}elapsed_seconds gauge",
+            f"{METRIC_PREFIX}elapsed_seconds {report['elapsed_seconds']}",
+        ]
+        if report["stages"]:
+            lines.append(f"# TYPE {METRIC_PREFIX}stage_seconds gauge")
+            lines.extend(f'{METRIC_PREFIX}stage_seconds{{stage="{name}"}} {stage["seconds"]}' for name, stage in sorted(report["stages"].items()))
+        for name, value in sorted(report["counters"].items()):
+            lines.append(f"# TYPE {METRIC_PREFIX}{name}_total counter")
+            lines.append(f"{METRIC_PREFIX}{name}_total {value}")
+        for name, summary in sorted(report["summaries"].items()):
+            lines.append(f"# TYPE {METRIC_PREFIX}{name} summary")
+            lines.extend(f'{METRIC_PREFIX}{name}{{quantile="{quantile}"}} {summary[f"p{int(quantile * 100)}"]}' for quantile in REPORT_QUANTILES)
+            lines.append(f"{METRIC_PREFIX}{name}_sum {summary['sum']}")
+            lines.append(f"{METRIC_PREFIX}{name}_count {summary['count']}")
+        return "\n".join(lines) + "\n"
+
+def quantile_of(sorted_values, quantile):
+    """Nearest-rank quantile of a non-empty sorted list."""
+    index = min(len(sorted_values) - 1, max(0, math.ceil(quantile * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+_registry = None
+
+def enable_metrics():
+    """Starts collecting metrics (from now on) and returns the registry."""
+    global _registry
+    _registry = MetricsRegistry()
+    return _registry
+
+def get_metrics():
+    """Returns the registry, or None when metrics are disabled."""
+    return _registry
+
+def increment(name, amount=1):
+    if _registry is not None:
+        _registry.increment(name, amount)
+
+def observe(name, value):
+    if _registry is not None:
+        _registry.observe(name, value)
+
+class _Timer:
+    """Context manager recording its duration as a sample (or, for stages, as stage time)."""
+    __slots__ = ('name', 'is_stage', 'start')
+
+    def __init__(self, name, is_stage=False):
+        self.name = name
+        self.is_stage = is_stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        registry = _registry
+        if registry is not None:
+            if self.is_stage:
+                registry.add_stage_time(self.name, elapsed)
+            else:
+                registry.observe(self.name, elapsed)
+        return False
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NULL_TIMER = _NullTimer()
+
+def timed(name):
+    """Times a block into the `name` samples (e.g. `with timed("parse_seconds"): ...`). A shared no-op when disabled."""
+    return _NULL_TIMER if _registry is None else _Timer(name)
+
+def stage(name):
+    """Times a pipeline stage (scrape, summarize, ...); repeated or concurrent runs of a stage are summed."""
+    return _NULL_TIMER if _registry is None else _Timer(name, is_stage=True)
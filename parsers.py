@@ -0,0 +1,301 @@
+"""HTML parser backends for XenForo thread pages.
+
+Every backend turns the raw bytes of a thread page into a (messages, total_pages) tuple, where
+messages is a list of {'date': ..., 'content': ...} dicts. All backends produce identical output;
+they only differ in speed and in which optional packages they need.
+
+*   bs4: BeautifulSoup with html.parser (always available, the original implementation).
+*   stream: a single pass over the stdlib html.parser tokenizer, without building a tree.
+*   lxml: the same single-pass extractor driven by lxml's (libxml2) parser events, without building a tree.
+*   selectolax: selectolax's lexbor parser and CSS engine.
+"""
+import html.parser
+import importlib.util
+
+TEXT_SEPARATOR = '\\n' # Literal backslash-n, as the summarizer has always joined message lines
+UNKNOWN_DATE = "Unknown date"
+SKIPPED_TEXT_TAGS = {'script', 'style', 'template'} # BeautifulSoup's get_text() leaves these out
+VOID_ELEMENTS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param', 'source', 'track', 'wbr'}
+
+PARSER_BACKENDS = ('auto', 'bs4', 'stream', 'lxml', 'selectolax')
+# Preference order for 'auto'; bs4 is the fallback when neither optional package is installed
+AUTO_BACKEND_ORDER = ('selectolax', 'lxml', 'bs4')
+OPTIONAL_BACKEND_MODULES = {'lxml': 'lxml', 'selectolax': 'selectolax'}
+
+def decode_page_content(content):
+    """Decodes raw page bytes to text (UTF-8, falling back to Windows-1252 like BeautifulSoup)."""
+    if isinstance(content, str):
+        return content
+    try:
+        return content.decode('utf-8')
+    except UnicodeDecodeError:
+        return content.decode('cp1252', errors='replace')
+
+def total_pages_from_link_texts(page_link_texts):
+    """Determines the total number of pages of a thread from the texts of its pagination links."""
+    total_pages = 1
+    if page_link_texts:
+        last_page_link_text = page_link_texts[-1]
+        if last_page_link_text.isdigit():
+            total_pages = int(last_page_link_text)
+        # Fallback if last link is not a number (e.g., "Next"): check the one before it.
+        # If still not found, it might be a single page or very few pages.
+        elif len(page_link_texts) > 1 and page_link_texts[-2].isdigit():
+            total_pages = int(page_link_texts[-2])
+    return total_pages
+
+# --- bs4 Backend ---
+def extract_messages_from_soup(soup):
+    """Extracts messages with their dates from a parsed thread page."""
+    messages_with_dates = []
+    message_articles = soup.select('article.message')
+    for article in message_articles:
+        date_str = UNKNOWN_DATE
+        time_tag = article.select_one('time.u-dt')
+        if time_tag:
+            if time_tag.has_attr('datetime'):
+                date_str = time_tag['datetime']
+            else:
+                date_str = time_tag.get_text(strip=True) # Fallback to text
+
+        content_tag = article.select_one('.message-content .bbWrapper')
+        if not content_tag:
+             content_tag = article.select_one('.bbWrapper') # General fallback within article
+
+        if content_tag:
+            content_text = content_tag.get_text(separator=TEXT_SEPARATOR, strip=True)
+            if content_text: # Only add if there's actual content
+                messages_with_dates.append({'date': date_str, 'content': content_text})
+    return messages_with_dates
+
+def extract_total_pages(soup):
+    """Determines the total number of pages of a thread from its pagination links."""
+    page_nav = soup.select_one('.pageNav-main')
+    if not page_nav:
+        return 1
+    return total_pages_from_link_texts([link.get_text(strip=True) for link in page_nav.select('li.pageNav-page a[href]')])
+
+def parse_page_bs4(content):
+    """Parses a page with BeautifulSoup and html.parser."""
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(content, 'html.parser')
+    return extract_messages_from_soup(soup), extract_total_pages(soup)
+
+# --- Single-pass Backends (stream, lxml) ---
+class PageEventHandler:
+    """Extracts messages and pagination from start/end/data/comment parser events in a single pass.
+
+    Mirrors the selectors used by the bs4 backend ('article.message', 'time.u-dt',
+    '.message-content .bbWrapper' falling back to '.bbWrapper', and '.pageNav-main li.pageNav-page a[href]')
+    while only keeping a stack of open elements, never a document tree. The method names follow
+    lxml's parser target interface, so an instance can be passed to lxml directly.
+    """
+    def __init__(self):
+        self.messages = []
+        self.page_link_texts = []
+        self._open = [] # (tag, classes) of each open element
+        self._text_parts = [] # Pending run of adjacent text
+        self._skip_depth = 0 # Number of open script/style/template elements
+        self._captures = {} # Stack depth of a capturing element -> list of its stripped strings
+        self._page_link_depths = set()
+        self._articles = [] # Open 'article.message' elements, outermost first (articles can nest)
+        self._message_slots = [] # Each article's message (None if it has no content), in document order like select()
+        self._page_nav_depth = None
+        self._page_nav_seen = False
+
+    def _flush_text(self):
+        if self._text_parts:
+            text = ''.join(self._text_parts).strip()
+            self._text_parts = []
+            if text and not self._skip_depth:
+                for parts in self._captures.values():
+                    parts.append(text)
+
+    def _capture(self, depth):
+        return self._captures.setdefault(depth, [])
+
+    def start(self, tag, attrib):
+        self._flush_text()
+        classes = (attrib.get('class') or '').split()
+        depth = len(self._open)
+        self._open.append((tag, classes))
+        if tag in SKIPPED_TEXT_TAGS:
+            self._skip_depth += 1
+
+        # Every open article sees its descendants, so an outer article can take its date or content from a nested one, as select_one() does
+        for article in self._articles:
+            if tag == 'time' and 'u-dt' in classes and article['date'] is None and article['time_parts'] is None:
+                if 'datetime' in attrib:
+                    article['date'] = attrib['datetime'] or ''
+                else:
+                    article['time_parts'] = self._capture(depth)
+            if 'bbWrapper' in classes:
+                if article['fallback'] is None:
+                    article['fallback'] = self._capture(depth)
+                if article['primary'] is None and any('message-content' in open_classes for _, open_classes in self._open[:-1]):
+                    article['primary'] = self._capture(depth)
+        if tag == 'article' and 'message' in classes:
+            self._articles.append({'depth': depth, 'slot': len(self._message_slots), 'date': None, 'time_parts': None, 'primary': None, 'fallback': None})
+            self._message_slots.append(None)
+
+        if 'pageNav-main' in classes and not self._page_nav_seen:
+            self._page_nav_seen = True
+            self._page_nav_depth = depth
+        elif tag == 'a' and 'href' in attrib and self._page_nav_depth is not None:
+            if any(open_tag == 'li' and 'pageNav-page' in open_classes for open_tag, open_classes in self._open[self._page_nav_depth + 1:-1]):
+                self._page_link_depths.add(depth)
+                self._capture(depth)
+
+    def end(self, tag):
+        self._flush_text()
+        # Close up to the most recent matching element, like BeautifulSoup; stray end tags are ignored
+        for index in range(len(self._open) - 1, -1, -1):
+            if self._open[index][0] == tag:
+                break
+        else:
+            return
+        while len(self._open) > index:
+            self._close_innermost()
+
+    def _close_innermost(self):
+        depth = len(self._open) - 1
+        tag, _ = self._open.pop()
+        if tag in SKIPPED_TEXT_TAGS:
+            self._skip_depth -= 1
+        parts = self._captures.pop(depth, None)
+        if depth in self._page_link_depths:
+            self._page_link_depths.discard(depth)
+            self.page_link_texts.append(''.join(parts))
+        if depth == self._page_nav_depth:
+            self._page_nav_depth = None
+        if self._articles and depth == self._articles[-1]['depth']:
+            self._finish_article()
+
+    def _finish_article(self):
+        article = self._articles.pop()
+        date_str = article['date']
+        if date_str is None:
+            date_str = ''.join(article['time_parts']) if article['time_parts'] is not None else UNKNOWN_DATE
+        content_parts = article['primary'] if article['primary'] is not None else article['fallback']
+        if content_parts is not None:
+            content_text = TEXT_SEPARATOR.join(content_parts)
+            if content_text:
+                self._message_slots[article['slot']] = {'date': date_str, 'content': content_text}
+
+    def data(self, data):
+        self._text_parts.append(data)
+
+    def comment(self, text):
+        self._flush_text() # Comments split text runs, but are not text themselves
+
+    def close(self):
+        self._flush_text()
+        while self._open:
+            self._close_innermost()
+        self.messages = [message for message in self._message_slots if message is not None]
+        return self.messages, total_pages_from_link_texts(self.page_link_texts)
+
+class _StreamTokenizer(html.parser.HTMLParser):
+    """Feeds stdlib html.parser tokens to a PageEventHandler."""
+    def __init__(self, handler):
+        super().__init__(convert_charrefs=True)
+        self.handler = handler
+
+    def handle_starttag(self, tag, attrs):
+        self.handler.start(tag, dict(attrs))
+        if tag in VOID_ELEMENTS:
+            self.handler.end(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handler.start(tag, dict(attrs))
+        self.handler.end(tag)
+
+    def handle_endtag(self, tag):
+        self.handler.end(tag)
+
+    def handle_data(self, data):
+        self.handler.data(data)
+
+    def handle_comment(self, data):
+        self.handler.comment(data)
+
+    handle_decl = handle_pi = unknown_decl = handle_comment
+
+def parse_page_stream(content):
+    """Parses a page in one pass over the stdlib html.parser tokenizer."""
+    handler = PageEventHandler()
+    tokenizer = _StreamTokenizer(handler)
+    tokenizer.feed(decode_page_content(content))
+    tokenizer.close()
+    return handler.close()
+
+def parse_page_lxml(content):
+    """Parses a page in one pass over lxml's parser events (no tree is built when a target is set)."""
+    from lxml import etree
+    parser = etree.HTMLParser(target=PageEventHandler())
+    parser.feed(decode_page_content(content))
+    return parser.close()
+
+# --- selectolax Backend ---
+def _selectolax_strings(node):
+    """Yields the stripped, non-empty strings under a selectolax node, skipping script/style/template text."""
+    for descendant in node.traverse(include_text=True):
+        if descendant.tag == '-text' and descendant.parent.tag not in SKIPPED_TEXT_TAGS:
+            text = descendant.text_content.strip()
+            if text:
+                yield text
+
+def parse_page_selectolax(content):
+    """Parses a page with selectolax's lexbor engine."""
+    from selectolax.lexbor import LexborHTMLParser
+    tree = LexborHTMLParser(decode_page_content(content))
+    messages_with_dates = []
+    for article in tree.css('article.message'):
+        date_str = UNKNOWN_DATE
+        time_node = article.css_first('time.u-dt')
+        if time_node is not None:
+            if 'datetime' in time_node.attributes:
+                date_str = time_node.attributes['datetime'] or ''
+            else:
+                date_str = ''.join(_selectolax_strings(time_node))
+
+        content_node = article.css_first('.message-content .bbWrapper')
+        if content_node is None:
+            content_node = article.css_first('.bbWrapper')
+
+        if content_node is not None:
+            content_text = TEXT_SEPARATOR.join(_selectolax_strings(content_node))
+            if content_text:
+                messages_with_dates.append({'date': date_str, 'content': content_text})
+
+    page_link_texts = []
+    page_nav = tree.css_first('.pageNav-main')
+    if page_nav is not None:
+        page_link_texts = [''.join(_selectolax_strings(link)) for link in page_nav.css('li.pageNav-page a[href]')]
+    return messages_with_dates, total_pages_from_link_texts(page_link_texts)
+
+_BACKEND_FUNCTIONS = {
+    'bs4': parse_page_bs4,
+    'stream': parse_page_stream,
+    'lxml': parse_page_lxml,
+    'selectolax': parse_page_selectolax,
+}
+
+def is_parser_backend_available(backend):
+    """Checks whether a backend's optional package is installed."""
+    module_name = OPTIONAL_BACKEND_MODULES.get(backend)
+    return module_name is None or importlib.util.find_spec(module_name) is not None
+
+def resolve_parser_backend(backend='auto'):
+    """Resolves 'auto' to the fastest installed backend. Raises ValueError for unknown or unavailable backends."""
+    if backend == 'auto':
+        return next(name for name in AUTO_BACKEND_ORDER if is_parser_backend_available(name))
+    if backend not in _BACKEND_FUNCTIONS:
+        raise ValueError(f"Unknown parser backend: {backend}")
+    if not is_parser_backend_available(backend):
+        raise ValueError(f"Parser backend '{backend}' requires the '{OPTIONAL_BACKEND_MODULES[backend]}' package.")
+    return backend
+
+def parse_page(content, backend='bs4'):
+    """Parses raw page content with the given (resolved) backend, returning (messages, total_pages)."""
+    return _BACKEND_FUNCTIONS[backend](content)
@@ -0,0 +1,81 @@
+"""Persistent cache of Gemini responses.
+
+Responses are keyed on the model name, the fully rendered prompt and a prompt-template version, and
+stored in a SQLite database under the cache directory. Entries expire after a TTL, and the least
+recently used entries are evicted when the cache grows beyond its size limit.
+"""
+import hashlib
+import sqlite3
+import threading
+import time
+
+RESPONSE_CACHE_FILENAME = "responses.sqlite3"
+
+class ResponseCache:
+    """Thread-safe, size-bounded LRU cache of model responses with a TTL."""
+    def __init__(self, db_filepath, ttl_seconds, max_bytes):
+        self.db_filepath = db_filepath
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        db_filepath.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(str(db_filepath), check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, model TEXT NOT NULL, response TEXT NOT NULL,"
+            " size INTEGER NOT NULL, created_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self.connection.commit()
+
+    @staticmethod
+    def make_key(model_name, prompt, template_version):
+        digest = hashlib.sha256()
+        for part in (str(template_version), model_name, prompt):
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Returns the cached response for key, or None if it is missing or expired."""
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl_seconds:
+                self.misses += 1
+                return None
+            self.connection.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self.connection.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, model_name, response):
+        """Stores a response, then drops expired entries and evicts least recently used ones beyond max_bytes."""
+        now = time.time()
+        size = len(response.encode('utf-8'))
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, size, created_at, last_access) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model_name, response, size, now, now)
+            )
+            self.connection.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,))
+            total_size = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total_size > self.max_bytes:
+                for evict_key, evict_size in self.connection.execute("SELECT key, size FROM responses ORDER BY last_access").fetchall():
+                    if total_size <= self.max_bytes:
+                        break
+                    self.connection.execute("DELETE FROM responses WHERE key = ?", (evict_key,))
+                    total_size -= evict_size
+            self.connection.commit()
+
+    def stats(self):
+        """Returns entry count, total size and this session's hit/miss counts."""
+        with self.lock:
+            entries, total_size = self.connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return {"entries": entries, "size_bytes": total_size, "max_bytes": self.max_bytes, "hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,121 @@
+"""Local retrieval over thread messages for Q&A.
+
+A BM25 inverted index is built once per thread and persisted next to the thread's cache file, so
+each question only sends the most relevant (and the most recent) messages to Gemini instead of the
+whole thread.
+"""
+import hashlib
+import json
+import math
+import re
+from collections import Counter
+
+from parsers import TEXT_SEPARATOR
+
+INDEX_FORMAT_VERSION = 2 # 2: message lines are split on the literal backslash-n separator
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset("""
+a an and are as at be but by can do does for from had has have how i if in is it its me my no not of on or so
+than that the their them then there these they this to was we were what when where which who why will with you your
+""".split())
+
+def tokenize(text):
+    """Lowercases text and splits it into alphanumeric terms, dropping stopwords.
+
+    Message lines are joined by a literal backslash-n (TEXT_SEPARATOR), which would otherwise glue an
+    'n' onto the first word of every line.
+    """
+    return [term for term in TOKEN_PATTERN.findall(text.replace(TEXT_SEPARATOR, ' ').lower()) if term not in STOPWORDS]
+
+def messages_fingerprint(messages):
+    """Hashes the dates and contents of a thread's messages, to detect when derived data is stale."""
+    digest = hashlib.sha1()
+    for msg_dict in messages:
+        digest.update(msg_dict.get('date', '').encode('utf-8'))
+        digest.update(b'\0')
+        digest.update(msg_dict.get('content', '').encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+class BM25Index:
+    """Okapi BM25 inverted index over a list of documents (one per message)."""
+    def __init__(self, postings, doc_lengths, fingerprint=None):
+        self.postings = postings # term -> [[doc_id, term_frequency], ...]
+        self.doc_lengths = doc_lengths
+        self.fingerprint = fingerprint
+        self.doc_count = len(doc_lengths)
+        self.avg_doc_length = (sum(doc_lengths) / self.doc_count) if self.doc_count else 0.0
+
+    @classmethod
+    def build(cls, documents, fingerprint=None):
+        postings = {}
+        doc_lengths = []
+        for doc_id, document in enumerate(documents):
+            terms = tokenize(document)
+            doc_lengths.append(len(terms))
+            for term, frequency in Counter(terms).items():
+                postings.setdefault(term, []).append([doc_id, frequency])
+        return cls(postings, doc_lengths, fingerprint)
+
+    def search(self, query, top_k):
+        """Returns up to top_k (doc_id, score) pairs for the query, best first."""
+        scores = {}
+        for term in set(tokenize(query)):
+            term_postings = self.postings.get(term)
+            if not term_postings:
+                continue
+            idf = math.log(1 + (self.doc_count - len(term_postings) + 0.5) / (len(term_postings) + 0.5))
+            for doc_id, frequency in term_postings:
+                length_norm = 1 - BM25_B + BM25_B * self.doc_lengths[doc_id] / (self.avg_doc_length or 1)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (BM25_K1 + 1) / (frequency + BM25_K1 * length_norm)
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:top_k]
+
+    def to_dict(self):
+        return {"version": INDEX_FORMAT_VERSION, "fingerprint": self.fingerprint, "doc_lengths": self.doc_lengths, "postings": self.postings}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["postings"], data["doc_lengths"], data.get("fingerprint"))
+
+def load_index(index_filepath, fingerprint):
+    """Loads a persisted index, or returns None if it is missing, unreadable or built from other messages."""
+    try:
+        with open(index_filepath, 'r') as f:
+            data = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+    if data.get("version") != INDEX_FORMAT_VERSION or data.get("fingerprint") != fingerprint:
+        return None
+    return BM25Index.from_dict(data)
+
+def save_index(index_filepath, index):
+    """Persists an index as JSON. Failures are not fatal, as the index can always be rebuilt."""
+    try:
+        index_filepath.parent.mkdir(parents=True, exist_ok=True)
+        with open(index_filepath, 'w') as f:
+            json.dump(index.to_dict(), f)
+        return True
+    except OSError:
+        return False
+
+def select_relevant_message_ids(index, question, message_tokens, max_tokens, top_k=40, recent_count=10):
+    """Picks the messages to answer a question from, within a token budget.
+
+    The top_k best BM25 matches come first, then the recent_count latest messages (recent posts often
+    carry the current state of a discussion). `message_tokens` gives the prompt cost of each message.
+    Returns the selected message indexes in thread order.
+    """
+    message_count = len(message_tokens)
+    candidate_ids = [doc_id for doc_id, _ in index.search(question, top_k)]
+    candidate_ids += range(max(0, message_count - recent_count), message_count)
+    selected_ids = set()
+    used_tokens = 0
+    for doc_id in candidate_ids:
+        if doc_id in selected_ids or used_tokens + message_tokens[doc_id] > max_tokens:
+            continue
+        selected_ids.add(doc_id)
+        used_tokens += message_tokens[doc_id]
+    return sorted(selected_ids)
@@ -0,0 +1,88 @@
+"""Map-reduce summarization: chunk boundaries, multi-level reduction and the concurrency bound."""
+import itertools
+import threading
+import types
+
+import main
+from benchmark import FakeGenerativeModel, FakeResponse
+
+def chunk_ranges(message_tokens, max_tokens):
+    return [(chunk.start, chunk.stop) for chunk in main.chunk_messages(types.SimpleNamespace(message_tokens=message_tokens), max_tokens)]
+
+def test_chunks_fill_up_to_the_budget():
+    assert chunk_ranges([30, 30, 30, 10], 70) == [(0, 2), (2, 4)]
+    assert chunk_ranges([35, 35, 35], 70) == [(0, 2), (2, 3)] # Exactly at the budget still fits
+
+def test_message_larger_than_the_budget_gets_its_own_chunk():
+    assert chunk_ranges([30, 30, 200, 10, 10], 70) == [(0, 2), (2, 3), (3, 5)]
+    assert chunk_ranges([200], 70) == [(0, 1)]
+    assert chunk_ranges([200, 300], 70) == [(0, 1), (1, 2)]
+
+def test_chunks_cover_every_message_once_in_order():
+    message_tokens = [(i * 37) % 90 + 1 for i in range(200)]
+    chunks = main.chunk_messages(types.SimpleNamespace(message_tokens=message_tokens), 100)
+    assert [message_id for chunk in chunks for message_id in chunk] == list(range(200))
+    assert all(len(chunk) == 1 or sum(message_tokens[i] for i in chunk) <= 100 for chunk in chunks)
+
+def test_empty_thread_has_no_chunks():
+    assert main.chunk_messages(types.SimpleNamespace(message_tokens=[]), 100) == []
+
+class TrackingModel(FakeGenerativeModel):
+    """Fake model that numbers its responses and records the most requests it had in flight at once."""
+    def __init__(self, latency=0.0, response_size=2000):
+        super().__init__(latency, response_size)
+        self.responses = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.count_lock = threading.Lock()
+
+    def generate_content(self, prompt, stream=False):
+        with self.count_lock:
+            self.responses += 1
+            response_number = self.responses
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            response = super().generate_content(prompt, stream)
+            if stream:
+                return itertools.chain([FakeResponse(f"[response {response_number}] ")], response)
+            response.text = f"[response {response_number}] " + response.text
+            return response
+        finally:
+            with self.count_lock:
+                self.in_flight -= 1
+
+def thread_of(message_count, content_size):
+    return [{"date": f"2024-05-{day % 28 + 1:02d}T10:00:00+0530", "content": f"post {day} " + "x" * content_size} for day in range(message_count)]
+
+def test_partial_summaries_beyond_the_budget_are_reduced_level_by_level():
+    # Each ~1000-token message is a chunk of its own; each ~500-token summary leaves room for two per reduce group
+    model = TrackingModel(response_size=2000)
+    streamed = []
+    summary = main.summarize_in_chunks(thread_of(8, 4000), None, model, "models/test", chunk_tokens=1200, max_concurrency=1, on_chunk=streamed.append)
+
+    map_prompts, reduce_prompts = model.prompts[:8], model.prompts[8:]
+    assert all(prompt.startswith(f"Please summarize part {index} of 8 ") for index, prompt in enumerate(map_prompts, start=1))
+    assert len(reduce_prompts) == 4 + 2 + 1 # 8 summaries -> 4 -> 2 -> 1
+    assert all(prompt.startswith("The following are summaries of consecutive parts") for prompt in reduce_prompts)
+    # Each level combines the previous level's summaries, in order
+    assert "[response 1]" in reduce_prompts[0] and "[response 2]" in reduce_prompts[0]
+    assert "[response 9]" in reduce_prompts[4] and "[response 10]" in reduce_prompts[4]
+    assert "[response 13]" in reduce_prompts[6] and "[response 14]" in reduce_prompts[6]
+    assert "Part 3:" not in reduce_prompts[6]
+    # Only the final summary is streamed
+    assert summary.startswith("[response 15]")
+    assert "".join(streamed) == summary
+
+def test_single_chunk_is_summarized_in_one_request():
+    model = TrackingModel(response_size=100)
+    summary = main.summarize_in_chunks(thread_of(5, 100), ["miles"], model, "models/test", chunk_tokens=10000)
+    assert len(model.prompts) == 1
+    assert model.prompts[0].startswith("Please summarize part 1 of 1 ")
+    assert summary.startswith("[response 1]")
+
+def test_requests_in_flight_stay_within_max_concurrency():
+    model = TrackingModel(latency=0.05, response_size=100)
+    main.summarize_in_chunks(thread_of(12, 4000), None, model, "models/test", chunk_tokens=1200, max_concurrency=3)
+    assert len(model.prompts) == 12 + 1
+    assert 1 < model.max_in_flight <= 3
@@ -0,0 +1,73 @@
+"""Compaction may shorten a thread, but must never drop or merge a post that says something different."""
+import pytest
+
+import parsers
+from benchmark import generate_thread_page
+from compaction import compact_messages, content_words, is_trivial, strip_quotes
+from parsers import TEXT_SEPARATOR
+
+def lines(*parts):
+    return TEXT_SEPARATOR.join(parts)
+
+def test_strip_quotes_replaces_a_quote_with_a_reference():
+    content = lines("Ravi said:", "Is the Infinia still invite only?", "Click to expand...", "No, you can apply online now.")
+    assert strip_quotes(content) == (lines('[Replying to Ravi: "Is the Infinia still invite only?"]', "No, you can apply online now."), 1)
+
+def test_strip_quotes_replaces_nested_quotes_innermost_first():
+    content = lines(
+        "Asha said:", "Meera said:", "Got the Atlas approved", "Click to expand...", "Which limit did you get?", "Click to expand...",
+        "Same question here, also what income proof",
+    )
+    stripped, count = strip_quotes(content)
+    assert count == 2
+    assert stripped == lines('[Replying to Asha: "Which limit did you get?"]', "Same question here, also what income proof")
+
+def test_strip_quotes_shortens_long_quote_previews():
+    content = lines("Ravi said:", "one two three four five six seven eight nine ten", "Click to expand...", "Agreed")
+    assert strip_quotes(content)[0] == lines('[Replying to Ravi: "one two three four five six seven eight..."]', "Agreed")
+
+def test_strip_quotes_leaves_unquoted_text_alone():
+    content = lines("He said: the fee is waived", "Click here to expand your limit")
+    assert strip_quotes(content) == (content, 0)
+
+@pytest.mark.parametrize("content, trivial", [
+    ("+1", True),
+    ("Thanks for sharing bro!", True),
+    ("", True),
+    ('[Replying to Ravi: "Got the card"]', True),
+    ("Thanks, my limit went up to 5 lakh", False),
+    ("Same here", True),
+    ("Same here, also got the 10x points on Amazon", False),
+])
+def test_is_trivial(content, trivial):
+    assert is_trivial(content_words(content)) is trivial
+
+def test_posts_differing_only_in_a_number_are_all_kept():
+    messages = [{"date": f"2025-01-0{n + 1}", "content": f"Applied for HDFC Regalia Gold today, got approved with limit of {n} lakh"} for n in range(5)]
+    compacted, stats = compact_messages(messages)
+    assert compacted == messages
+    assert stats.duplicates_collapsed == 0
+
+def test_near_duplicates_collapse_into_the_first_post():
+    first = {"date": "2025-01-01", "content": "Amazon Pay ICICI card is now giving 5 percent back on all bill payments through the app"}
+    messages = [
+        first,
+        {"date": "2025-01-02", "content": "+1"},
+        {"date": "2025-01-03", "content": "Amazon Pay ICICI card is now giving 5 percent back on all bill payments through the app!"},
+        {"date": "2025-01-04", "content": "Amazon pay ICICI card is now giving 5 percent back on all bill payments through the app."},
+        {"date": "2025-01-05", "content": "Got it"},
+        {"date": "2025-01-06", "content": "got it"},
+    ]
+    compacted, stats = compact_messages(messages)
+    assert compacted == [
+        {"date": "2025-01-01", "content": lines(first["content"], "[2 similar later post(s), the last dated 2025-01-04]")},
+        {"date": "2025-01-05", "content": lines("Got it", "[1 similar later post(s), the last dated 2025-01-06]")},
+    ]
+    assert stats.to_dict() == {"messages_in": 6, "messages_out": 2, "quotes_stripped": 0, "trivial_dropped": 1, "duplicates_collapsed": 3}
+    assert messages[0] is first and first["content"].endswith("app")
+
+def test_synthetic_benchmark_thread_loses_no_posts():
+    messages = [msg_dict for page_num in range(1, 11) for msg_dict in parsers.parse_page(generate_thread_page(page_num, 10).encode('utf-8'), 'bs4')[0]]
+    compacted, stats = compact_messages(messages)
+    assert compacted == messages
+    assert stats.messages_out == stats.messages_in == 200
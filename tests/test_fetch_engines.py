@@ -0,0 +1,59 @@
+"""The thread-pool and asyncio fetch engines must scrape the same messages and fail the same way."""
+import contextlib
+import importlib.util
+import io
+import os
+from pathlib import Path
+
+import pytest
+
+import main
+from benchmark import SyntheticThreadServer
+
+ENGINES = [
+    "threads",
+    pytest.param("asyncio", marks=pytest.mark.skipif(not importlib.util.find_spec("aiohttp"), reason="aiohttp is not installed")),
+]
+
+@pytest.fixture(autouse=True)
+def restore_page_fetcher(monkeypatch):
+    monkeypatch.setattr(main, "_page_fetcher", None)
+
+def scrape(thread_url, engine):
+    main.configure_page_fetcher(engine=engine, max_connections=3, rate_limit=0, backoff_base=0.01)
+    with contextlib.redirect_stdout(io.StringIO()):
+        return main.get_all_messages_from_thread(thread_url, use_cache=False, cache_dir=Path(os.devnull), cache_expiry_days=0)
+
+@pytest.fixture(scope="module")
+def expected_messages():
+    with SyntheticThreadServer(6, posts_per_page=5, post_size=80) as server:
+        return scrape(server.thread_url, "threads")
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_engines_scrape_identical_messages(engine, expected_messages):
+    with SyntheticThreadServer(6, posts_per_page=5, post_size=80) as server:
+        assert scrape(server.thread_url, engine) == expected_messages
+    assert len(expected_messages) == 6 * 5
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_engines_retry_a_503_then_use_the_page(engine, expected_messages):
+    with SyntheticThreadServer(6, posts_per_page=5, post_size=80, page_errors={1: [503], 4: [503, 503]}) as server:
+        assert scrape(server.thread_url, engine) == expected_messages
+        assert server.request_count == 6 + 3
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_engines_raise_missing_pages_for_a_page_that_is_always_404(engine):
+    with SyntheticThreadServer(6, posts_per_page=5, post_size=80, missing_pages={4}) as server:
+        with pytest.raises(main.MissingPagesError) as excinfo:
+            scrape(server.thread_url, engine)
+    assert excinfo.value.page_nums == [4]
+    assert excinfo.value.thread_url == server.thread_url
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_parse_workers_scrape_identical_messages(engine, expected_messages):
+    main.configure_parse_workers(2)
+    try:
+        with SyntheticThreadServer(6, posts_per_page=5, post_size=80) as server:
+            assert scrape(server.thread_url, engine) == expected_messages
+    finally:
+        main.configure_parse_workers(0)
@@ -0,0 +1,76 @@
+"""Pins the exact prompt text sent to Gemini.
+
+The summary and token-count prompts must stay byte-for-byte what the original per-function formatting
+produced (literal "\\n" separators included), so shared prompt formatting changes nothing the model
+sees. The Q&A prompt deliberately switched from its doubly escaped message separator to the shared one.
+"""
+import datetime
+import types
+
+import main
+from benchmark import FakeGenerativeModel
+
+MESSAGES = [
+    {"date": "2024-05-01T10:00:00+0530", "content": "Axis Atlas devalued"},
+    {"date": "2024-05-02T11:30:00Z", "content": "Still worth it for miles"},
+    {"date": "yesterday", "content": "Unparseable date is kept as is"},
+]
+# The messages as the baseline rendered them: "Date: ...\nMessage: ..." joined by "\n\n---\n\n", all with literal backslash-n
+BASELINE_THREAD_TEXT = (
+    "Date: 2024-05-01 10:00 UTC+05:30+0530\\nMessage: Axis Atlas devalued"
+    "\\n\\n---\\n\\n"
+    "Date: 2024-05-02 11:30 UTC+0000\\nMessage: Still worth it for miles"
+    "\\n\\n---\\n\\n"
+    "Date: yesterday\\nMessage: Unparseable date is kept as is"
+)
+
+def today():
+    return datetime.date.today().strftime('%Y-%m-%d')
+
+def test_summary_prompt_matches_baseline_format():
+    model = FakeGenerativeModel(response_size=10)
+    main.generate_summary(MESSAGES, ["miles", "devaluation"], model, "models/test", mode='single')
+    assert model.prompts == [
+        f"Please summarize the following forum discussion thread. Each message includes its posting date. The current date is {today()}."
+        "\\nConsider the dates of the messages to identify the most current information and highlight if some points are outdated."
+        "\\nExtract the key points, main questions, and any conclusions or consensus reached by the users, noting the recency of information."
+        "\\nPay special attention to topics related to: miles, devaluation."
+        f"\\nThe thread is from Technofino:\\n\\n{BASELINE_THREAD_TEXT}\\n\\nSummary:"
+    ]
+
+def test_summary_prompt_without_keywords_has_no_keyword_line():
+    model = FakeGenerativeModel(response_size=10)
+    main.generate_summary(MESSAGES, None, model, "models/test", mode='single')
+    assert "Pay special attention" not in model.prompts[0]
+    assert model.prompts[0].endswith(f"noting the recency of information.\\nThe thread is from Technofino:\\n\\n{BASELINE_THREAD_TEXT}\\n\\nSummary:")
+
+def test_token_count_prompt_matches_baseline_format(monkeypatch):
+    counted = []
+    class CountingModel:
+        def __init__(self, model_name):
+            pass
+        def count_tokens(self, content):
+            counted.append(content)
+            return types.SimpleNamespace(total_tokens=42)
+    monkeypatch.setattr(main, "get_genai", lambda: types.SimpleNamespace(GenerativeModel=CountingModel))
+    assert main.estimate_token_count(MESSAGES) == (42, None)
+    assert counted == [
+        f"Please summarize the following forum discussion thread. Each message includes its posting date. The current date is {today()}."
+        "\\nConsider the dates of the messages to identify the most current information and highlight if some points are outdated."
+        f"\\nThe thread is from Technofino:\\n\\n{BASELINE_THREAD_TEXT}\\n\\nSummary:"
+    ]
+
+def test_qna_prompt_uses_the_shared_message_separator():
+    model = FakeGenerativeModel(response_size=10)
+    main.generate_answer(MESSAGES, "Is Atlas still worth it?", model, "models/test")
+    assert model.prompts == [
+        f"Current date: {today()}.\\n\\n"
+        "Consider the posting dates of the messages when answering. More recent information is generally more relevant. If the information might be outdated, please say so.\\n\\n"
+        "Context from the thread (includes message dates):\\n"
+        f"{BASELINE_THREAD_TEXT}\\n\\n"
+        "Based on the above, please answer the question: \"Is Atlas still worth it?\". "
+        "If the answer is not found in the provided messages, say so. "
+        "If the question is subjective or opinion-based, acknowledge that."
+    ]
+    # The baseline Q&A prompt joined messages with a doubly escaped separator; changed on purpose
+    assert "\\\\n\\\\n---\\\\n\\\\n" not in model.prompts[0]
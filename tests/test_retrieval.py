@@ -0,0 +1,37 @@
+"""BM25 retrieval over scraped messages, whose lines are joined by a literal backslash-n."""
+import json
+
+import retrieval
+from parsers import TEXT_SEPARATOR
+
+MESSAGES = [
+    {"date": "2024-03-01", "content": TEXT_SEPARATOR.join(["HDFC Infinia", "Lounge access", "Rewards devalued"])},
+    {"date": "2024-03-02", "content": "Axis Atlas transfer partners"},
+    {"date": "2024-03-03", "content": TEXT_SEPARATOR.join(["Amex Platinum", "Taj vouchers renewed"])},
+]
+
+def build_index(messages=MESSAGES):
+    return retrieval.BM25Index.build([msg_dict["content"] for msg_dict in messages], retrieval.messages_fingerprint(messages))
+
+def test_words_after_a_line_separator_are_indexed():
+    assert retrieval.tokenize(MESSAGES[0]["content"]) == ["hdfc", "infinia", "lounge", "access", "rewards", "devalued"]
+    assert [doc_id for doc_id, _ in build_index().search("lounge rewards", 5)] == [0]
+    assert [doc_id for doc_id, _ in build_index().search("taj", 5)] == [2]
+
+def test_search_ranks_by_relevance():
+    index = build_index()
+    results = index.search("axis atlas partners lounge", 5)
+    assert [doc_id for doc_id, _ in results] == [1, 0]
+    assert results[0][1] > results[1][1]
+
+def test_saved_index_is_reused_only_for_the_same_version_and_messages(tmp_path):
+    index_filepath = tmp_path / "thread.index.json"
+    index = build_index()
+    assert retrieval.save_index(index_filepath, index)
+    assert retrieval.load_index(index_filepath, index.fingerprint).postings == index.postings
+    assert retrieval.load_index(index_filepath, "other fingerprint") is None
+
+    data = json.loads(index_filepath.read_text())
+    data["version"] = retrieval.INDEX_FORMAT_VERSION - 1 # e.g. built with the old tokenizer
+    index_filepath.write_text(json.dumps(data))
+    assert retrieval.load_index(index_filepath, index.fingerprint) is None
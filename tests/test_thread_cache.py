@@ -0,0 +1,100 @@
+"""The thread cache file format: committed entries survive interrupted appends, and appends are compacted."""
+import io
+
+import pytest
+
+import thread_cache
+
+def make_page(page_num, text="post"):
+    return page_num, {"page": page_num, "message_count": 1}, [{"date": f"2025-01-0{page_num}", "content": f"{text} on page {page_num}"}]
+
+def make_metadata(page_count):
+    return {"timestamp": "2025-01-10T12:00:00", "url": "https://example.com/threads/t.1/", "page_count": page_count, "message_count": page_count}
+
+def read_entry(cache_filepath):
+    return list(thread_cache.iter_pages(cache_filepath))
+
+def scan(cache_filepath):
+    with open(cache_filepath, 'rb') as f:
+        return thread_cache._scan(f)
+
+@pytest.fixture
+def cache_filepath(tmp_path):
+    cache_filepath = tmp_path / "thread.tfcache"
+    thread_cache.write_entry(cache_filepath, make_metadata(3), [make_page(1), make_page(2), make_page(3)])
+    return cache_filepath
+
+def test_written_entry_reads_back(cache_filepath):
+    assert read_entry(cache_filepath) == [make_page(1), make_page(2), make_page(3)]
+    assert thread_cache.read_metadata(cache_filepath) == make_metadata(3)
+    assert list(thread_cache.iter_pages(cache_filepath, last_pages=1)) == [make_page(3)]
+    assert list(thread_cache.iter_pages(cache_filepath, page_nums={1, 3})) == [make_page(1), make_page(3)]
+
+def test_append_replaces_pages_and_commits_new_metadata(cache_filepath):
+    thread_cache.append_pages(cache_filepath, make_metadata(4), [make_page(3, "edited"), make_page(4)])
+    assert read_entry(cache_filepath) == [make_page(1), make_page(2), make_page(3, "edited"), make_page(4)]
+    assert thread_cache.read_metadata(cache_filepath) == make_metadata(4)
+
+@pytest.mark.parametrize("torn_bytes", [None, 5], ids=["after-page-record", "mid-page-record"])
+def test_interrupted_append_keeps_the_previous_commit_and_is_truncated(cache_filepath, torn_bytes):
+    committed_size = cache_filepath.stat().st_size
+    payload = thread_cache._encode({"state": make_page(2, "torn")[1], "messages": make_page(2, "torn")[2]})
+    record = thread_cache.RECORD_HEADER.pack(len(payload), thread_cache.PAGE_RECORD, 2) + payload
+    with open(cache_filepath, 'ab') as f: # The process died before writing the commit record
+        f.write(record if torn_bytes is None else record[:-torn_bytes])
+
+    assert read_entry(cache_filepath) == [make_page(1), make_page(2), make_page(3)]
+    assert thread_cache.read_metadata(cache_filepath) == make_metadata(3)
+
+    thread_cache.append_pages(cache_filepath, make_metadata(3), [make_page(3, "edited")])
+    # The torn page 2 record was truncated, not committed along with the new page 3
+    assert read_entry(cache_filepath) == [make_page(1), make_page(2), make_page(3, "edited")]
+    assert scan(cache_filepath).page_record_count == 4
+    appended = io.BytesIO()
+    thread_cache._write_record(appended, thread_cache.PAGE_RECORD, 3, thread_cache._encode({"state": make_page(3)[1], "messages": make_page(3, "edited")[2]}))
+    thread_cache._write_record(appended, thread_cache.COMMIT_RECORD, 0, thread_cache._encode(make_metadata(3)))
+    assert cache_filepath.stat().st_size == committed_size + len(appended.getvalue())
+
+def test_appends_are_compacted_once_superseded_records_exceed_the_ratio(cache_filepath):
+    # 3 live pages allow COMPACTION_RATIO * 3 = 6 page records before the entry is rewritten
+    for edit in range(3):
+        thread_cache.append_pages(cache_filepath, make_metadata(3), [make_page(3, f"edit {edit}")])
+    assert scan(cache_filepath).page_record_count == 6
+    size_before_compaction = cache_filepath.stat().st_size
+
+    thread_cache.append_pages(cache_filepath, make_metadata(3), [make_page(3, "edit 3")])
+    assert scan(cache_filepath).page_record_count == 3
+    assert cache_filepath.stat().st_size < size_before_compaction
+    assert read_entry(cache_filepath) == [make_page(1), make_page(2), make_page(3, "edit 3")]
+    assert not list(cache_filepath.parent.glob("*.tmp"))
+
+def test_compaction_drops_pages_beyond_the_new_page_count(cache_filepath):
+    thread_cache.append_pages(cache_filepath, make_metadata(2), [make_page(2, "edited")]) # 4 page records, the limit for 2 pages
+    assert scan(cache_filepath).page_record_count == 4
+    thread_cache.append_pages(cache_filepath, make_metadata(2), [make_page(2, "edited")])
+    assert read_entry(cache_filepath) == [make_page(1), make_page(2, "edited")]
+    assert scan(cache_filepath).page_record_count == 2
+
+@pytest.mark.parametrize("preamble, message", [
+    (b"NOTCACHE", "not a thread cache file"),
+    (thread_cache.MAGIC + bytes([thread_cache.FORMAT_VERSION - 1]), "unsupported cache format version 1"),
+    (thread_cache.MAGIC + bytes([thread_cache.FORMAT_VERSION + 1]), "unsupported cache format version 3"),
+    (b"", "not a thread cache file"),
+])
+def test_magic_or_version_mismatch_raises_cache_format_error(cache_filepath, preamble, message):
+    cache_filepath.write_bytes(preamble + cache_filepath.read_bytes()[len(thread_cache.MAGIC) + 1:])
+    with pytest.raises(thread_cache.CacheFormatError, match=message):
+        thread_cache.read_metadata(cache_filepath)
+    with pytest.raises(thread_cache.CacheFormatError, match=message):
+        read_entry(cache_filepath)
+    with pytest.raises(thread_cache.CacheFormatError, match=message):
+        thread_cache.append_pages(cache_filepath, make_metadata(3), [make_page(3, "edited")])
+
+def test_entry_without_a_commit_raises_cache_format_error(tmp_path):
+    cache_filepath = tmp_path / "thread.tfcache"
+    with thread_cache.EntryWriter(cache_filepath) as writer:
+        writer.add_page(*make_page(1))
+        writer.f.flush()
+        cache_filepath.write_bytes(writer.temp_filepath.read_bytes()) # Never committed
+    with pytest.raises(thread_cache.CacheFormatError, match="no committed entry"):
+        thread_cache.read_metadata(cache_filepath)
@@ -0,0 +1,77 @@
+"""iter_thread_pages must serve cached threads, and fall back to scraping, exactly as a fresh scrape would."""
+import contextlib
+import datetime
+import io
+import json
+
+import pytest
+
+import main
+import thread_cache
+from benchmark import SyntheticThreadServer
+
+@pytest.fixture(autouse=True)
+def restore_page_fetcher(monkeypatch):
+    monkeypatch.setattr(main, "_page_fetcher", None)
+    monkeypatch.setattr(main, "_cache_index", None)
+    main.configure_page_fetcher(max_connections=3, rate_limit=0, backoff_base=0.01)
+
+def get_messages(thread_url, cache_dir, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        messages = main.get_all_messages_from_thread(thread_url, True, cache_dir, 7, **kwargs)
+    return messages, output.getvalue()
+
+def corrupt_page_record(cache_filepath, page_num):
+    with open(cache_filepath, 'r+b') as f:
+        offset, length = thread_cache._scan(f).page_locations[page_num]
+        f.seek(offset + length // 2)
+        f.write(b"\0" * 4)
+
+def test_legacy_entry_without_page_state_is_served_and_rewritten(tmp_path):
+    with SyntheticThreadServer(4, posts_per_page=3, post_size=60) as server:
+        cache_filepath = main.get_cache_filepath(main.get_canonical_url(server.thread_url), tmp_path)
+        legacy_messages = [{"date": "2024-01-01", "content": f"cached post {i}"} for i in range(5)]
+        timestamp = (datetime.datetime.now() - datetime.timedelta(days=1)).isoformat()
+        main.get_legacy_cache_filepath(cache_filepath).write_text(json.dumps({"timestamp": timestamp, "messages": legacy_messages}))
+
+        messages, output = get_messages(server.thread_url, tmp_path)
+        assert messages == legacy_messages
+        assert "Cache hit" in output
+        assert server.request_count == 0
+        assert not main.get_legacy_cache_filepath(cache_filepath).exists()
+        assert main.read_cache_timestamp(cache_filepath) == timestamp
+
+        assert get_messages(server.thread_url, tmp_path)[0] == legacy_messages
+        assert server.request_count == 0
+
+        # Without validators, refreshing the rewritten entry re-fetches every page
+        messages, _ = get_messages(server.thread_url, tmp_path, force_refresh=True)
+        assert len(messages) == 4 * 3
+        assert server.request_count == 4
+
+@pytest.mark.parametrize("page_num", [1, 3])
+def test_corrupt_page_record_is_discarded_and_the_thread_scraped(tmp_path, page_num):
+    with SyntheticThreadServer(4, posts_per_page=3, post_size=60) as server:
+        expected_messages, _ = get_messages(server.thread_url, tmp_path)
+        cache_filepath = main.get_cache_filepath(main.get_canonical_url(server.thread_url), tmp_path)
+        corrupt_page_record(cache_filepath, page_num)
+
+        messages, output = get_messages(server.thread_url, tmp_path)
+        assert messages == expected_messages
+        assert "Error loading cache file" in output
+        assert server.request_count == 4 + 4
+        # The fresh scrape replaced the entry
+        assert [page_num for page_num, _, _ in thread_cache.iter_pages(cache_filepath)] == [1, 2, 3, 4]
+        assert get_messages(server.thread_url, tmp_path)[0] == expected_messages
+        assert server.request_count == 4 + 4
+
+def test_corrupt_page_record_is_discarded_during_a_refresh(tmp_path):
+    with SyntheticThreadServer(4, posts_per_page=3, post_size=60) as server:
+        expected_messages, _ = get_messages(server.thread_url, tmp_path)
+        cache_filepath = main.get_cache_filepath(main.get_canonical_url(server.thread_url), tmp_path)
+        corrupt_page_record(cache_filepath, 2) # Read from the cache between the re-fetched first and last pages
+
+        messages, output = get_messages(server.thread_url, tmp_path, force_refresh=True)
+        assert messages == expected_messages
+        assert "Error loading cache file" in output
+        assert [page_num for page_num, _, _ in thread_cache.iter_pages(cache_filepath)] == [1, 2, 3, 4]
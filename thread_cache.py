@@ -0,0 +1,176 @@
+"""On-disk format of the thread cache.
+
+Each thread is cached in one file of length-prefixed records:
+
+    file   := MAGIC version:uint8 record*
+    record := length:uint32 kind:uint8 page:uint32 payload[length]
+
+A page record holds one page's zlib-compressed JSON ({"state": ..., "messages": [...]}). A commit
+record holds the entry's zlib-compressed metadata ({"timestamp", "url", "page_count", "message_count"}).
+
+*   Full writes stream pages into a temporary file that atomically replaces the entry once committed.
+*   Refreshed pages are appended, followed by a new commit record. A later page record overrides
+    earlier ones for the same page, and only records up to the last commit are read, so an interrupted
+    append leaves the previously committed entry intact.
+*   Readers stream pages one at a time and can skip pages (e.g. read only the last N) by seeking over
+    their payloads without decompressing them. The metadata can be read without decompressing any page.
+"""
+import heapq
+import json
+import os
+import struct
+import zlib
+
+MAGIC = b"TFCACHE"
+FORMAT_VERSION = 2 # Version 1 was a single uncompressed JSON document
+RECORD_HEADER = struct.Struct(">IBI")
+PAGE_RECORD = 1
+COMMIT_RECORD = 2
+COMPRESSION_LEVEL = 6
+# Rewrite an entry once appends have made its page records this many times the live page count
+COMPACTION_RATIO = 2
+
+class CacheFormatError(Exception):
+    """Raised when a file is not a readable thread cache entry of a supported version."""
+
+def _encode(obj):
+    return zlib.compress(json.dumps(obj, separators=(',', ':')).encode('utf-8'), COMPRESSION_LEVEL)
+
+def _decode(payload):
+    return json.loads(zlib.decompress(payload).decode('utf-8'))
+
+def _write_record(f, kind, page_num, payload):
+    f.write(RECORD_HEADER.pack(len(payload), kind, page_num))
+    f.write(payload)
+
+class _Scan:
+    """Committed layout of an entry: its metadata and the file location of each live page record."""
+    def __init__(self, metadata, page_locations, page_record_count, committed_end):
+        self.metadata = metadata
+        self.page_locations = page_locations # page number -> (payload offset, payload length)
+        self.page_record_count = page_record_count
+        self.committed_end = committed_end
+
+def _scan(f):
+    """Reads record headers (and commit payloads only) to find the committed pages of an entry."""
+    file_size = os.fstat(f.fileno()).st_size
+    preamble = f.read(len(MAGIC) + 1)
+    if len(preamble) < len(MAGIC) + 1 or preamble[:len(MAGIC)] != MAGIC:
+        raise CacheFormatError("not a thread cache file")
+    if preamble[-1] != FORMAT_VERSION:
+        raise CacheFormatError(f"unsupported cache format version {preamble[-1]}")
+
+    committed, pending = {}, {}
+    metadata, committed_end, page_record_count = None, f.tell(), 0
+    while True:
+        header = f.read(RECORD_HEADER.size)
+        if len(header) < RECORD_HEADER.size:
+            break # End of file, or a torn header from an interrupted append
+        length, kind, page_num = RECORD_HEADER.unpack(header)
+        offset = f.tell()
+        if offset + length > file_size:
+            break # Torn payload from an interrupted append
+        if kind == PAGE_RECORD:
+            pending[page_num] = (offset, length)
+            f.seek(length, os.SEEK_CUR)
+        elif kind == COMMIT_RECORD:
+            metadata = _decode(f.read(length))
+            committed.update(pending)
+            page_record_count += len(pending)
+            pending = {}
+            committed_end = f.tell()
+        else:
+            break # Unknown record kind: treat as a torn tail
+    if metadata is None:
+        raise CacheFormatError("no committed entry")
+    page_locations = {page_num: location for page_num, location in committed.items() if page_num <= metadata["page_count"]}
+    return _Scan(metadata, page_locations, page_record_count, committed_end)
+
+def read_metadata(cache_filepath):
+    """Returns an entry's metadata without decompressing any page."""
+    with open(cache_filepath, 'rb') as f:
+        return _scan(f).metadata
+
+def iter_pages(cache_filepath, last_pages=None, page_nums=None):
+    """Streams (page_num, page_state, messages) in page order.
+
+    Reads only the last `last_pages` pages, or only the pages in `page_nums`, when given.
+    """
+    with open(cache_filepath, 'rb') as f:
+        scan = _scan(f)
+        selected_page_nums = sorted(scan.page_locations)
+        if last_pages is not None:
+            selected_page_nums = selected_page_nums[-last_pages:] if last_pages > 0 else []
+        if page_nums is not None:
+            selected_page_nums = [page_num for page_num in selected_page_nums if page_num in page_nums]
+        for page_num in selected_page_nums:
+            offset, length = scan.page_locations[page_num]
+            f.seek(offset)
+            page = _decode(f.read(length))
+            yield page_num, page["state"], page["messages"]
+
+class EntryWriter:
+    """Writes a whole entry page by page into a temporary file, which replaces the entry on commit.
+
+    Used as a context manager: leaving the block without committing (e.g. because the pages being
+    streamed in failed) discards the temporary file and leaves any existing entry untouched.
+    """
+    def __init__(self, cache_filepath):
+        self.cache_filepath = cache_filepath
+        cache_filepath.parent.mkdir(parents=True, exist_ok=True)
+        self.temp_filepath = cache_filepath.with_name(f"{cache_filepath.name}.{os.getpid()}.{id(self)}.tmp")
+        self.f = open(self.temp_filepath, 'wb')
+        self.f.write(MAGIC + bytes([FORMAT_VERSION]))
+
+    def add_page(self, page_num, page_state, messages):
+        _write_record(self.f, PAGE_RECORD, page_num, _encode({"state": page_state, "messages": messages}))
+
+    def commit(self, metadata):
+        _write_record(self.f, COMMIT_RECORD, 0, _encode(metadata))
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.f.close()
+        os.replace(self.temp_filepath, self.cache_filepath)
+
+    def close(self):
+        """Discards the temporary file unless the entry was committed."""
+        self.f.close()
+        self.temp_filepath.unlink(missing_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+def write_entry(cache_filepath, metadata, pages):
+    """Atomically writes a whole entry from an iterable of (page_num, page_state, messages) tuples."""
+    with EntryWriter(cache_filepath) as writer:
+        for page_num, page_state, messages in pages:
+            writer.add_page(page_num, page_state, messages)
+        writer.commit(metadata)
+
+def append_pages(cache_filepath, metadata, pages):
+    """Appends new or replaced pages to an existing entry and commits them with the new metadata.
+
+    Falls back to an atomic full rewrite (compaction) when superseded page records would make up
+    too much of the file. Raises CacheFormatError if the existing entry is unreadable.
+    """
+    pages = list(pages)
+    with open(cache_filepath, 'r+b') as f:
+        scan = _scan(f)
+        if scan.page_record_count + len(pages) <= COMPACTION_RATIO * max(1, metadata["page_count"]):
+            f.seek(scan.committed_end)
+            f.truncate() # Drop any torn, uncommitted tail before appending
+            for page_num, page_state, messages in pages:
+                _write_record(f, PAGE_RECORD, page_num, _encode({"state": page_state, "messages": messages}))
+            _write_record(f, COMMIT_RECORD, 0, _encode(metadata))
+            f.flush()
+            os.fsync(f.fileno())
+            return
+    replaced = {page[0]: page for page in pages}
+    # Stream the merge one page at a time; the old entry stays readable until the new one replaces it
+    kept = (page for page in iter_pages(cache_filepath) if page[0] not in replaced)
+    merged = heapq.merge(kept, (replaced[page_num] for page_num in sorted(replaced)), key=lambda page: page[0])
+    write_entry(cache_filepath, metadata, (page for page in merged if page[0] <= metadata["page_count"]))